@@ -0,0 +1,97 @@
+# Import packages
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Make the bot modules in the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standin_servers import add_standin_arguments, build_standin_servers
+
+###-----------------------------###-----------------------------###
+
+def import_bot(servers, work_dir):
+    """
+    A function that points the bot at the stand-in site and imports it. The environment variables must be set before the import because the bot reads them at import time
+    """
+    os.environ.update({
+        "WAFID_BASE_URL": servers.base_url,
+        "WAFID_EXIT_IP_URL": servers.exit_ip_url,
+        "WAFID_PROXY_MODE": "direct",
+        "WAFID_METRICS_PORT": "0",
+        "WAFID_TRACING": "0",
+        "WAFID_PROFILE_TEMPLATE_DIR": os.path.join(work_dir, "chrome_profile_template"),
+    })
+    return importlib.import_module("wafid_bot_selenium_parallel")
+
+def time_launches(bot, launches):
+    """
+    A function that launches Chrome launches times and returns the seconds until the driver was ready and until the search form was loaded on it
+    """
+    launch_durations = []
+    ready_durations = []
+    for _ in range(launches):
+        started_at = time.perf_counter()
+        driver = bot.create_chrome_driver()
+        launch_durations.append(time.perf_counter() - started_at)
+        try:
+            bot.load_search_form(driver)
+            ready_durations.append(time.perf_counter() - started_at)
+        finally:
+            bot.quit_chrome_driver(driver)
+    return launch_durations, ready_durations
+
+def time_clones(template, clones):
+    """
+    A function that returns the seconds it takes to copy the profile template and to delete the copy
+    """
+    durations = []
+    for _ in range(clones):
+        started_at = time.perf_counter()
+        template.remove(template.clone())
+        durations.append(time.perf_counter() - started_at)
+    return durations
+
+def run_benchmark(args):
+    servers = build_standin_servers(args).start()
+    work_dir = tempfile.mkdtemp(prefix="wafid_benchmark_")
+    bot = import_bot(servers=servers, work_dir=work_dir)
+    try:
+        # Cold: every browser starts from an empty temporary profile
+        bot.use_profile_template = False
+        cold_launches, cold_ready = time_launches(bot=bot, launches=args.launches)
+
+        # Warm: every browser starts from a copy of the warmed profile template. The template is built first and its build time is reported on its own
+        bot.use_profile_template = True
+        template = bot.get_chrome_profile_template()
+        started_at = time.perf_counter()
+        template.build()
+        build_duration = time.perf_counter() - started_at
+        warm_launches, warm_ready = time_launches(bot=bot, launches=args.launches)
+        clone_durations = time_clones(template=template, clones=args.launches)
+    finally:
+        servers.stop()
+
+    print(f"\nLaunches per mode: {args.launches}, clone root: {template.clone_root}")
+    print(f"{'':<36}{'p50':>10}{'p90':>10}")
+    for name, durations in (
+        ("Cold launch", cold_launches),
+        ("Cold launch + search form", cold_ready),
+        ("Warm launch (incl. clone)", warm_launches),
+        ("Warm launch + search form", warm_ready),
+        ("Clone + delete", clone_durations),
+    ):
+        p50, p90 = np.percentile(durations, [50, 90])
+        print(f"{name:<36}{p50:>8.2f} s{p90:>8.2f} s")
+    print(f"{'Template build (once)':<36}{build_duration:>8.2f} s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the startup time of Chrome with an empty profile (cold) and with a copy of the warmed profile template (warm)")
+    parser.add_argument("--launches", type=int, default=5, help="The number of browsers that are launched per mode")
+    add_standin_arguments(parser)
+    run_benchmark(parser.parse_args())
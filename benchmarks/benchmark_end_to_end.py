@@ -0,0 +1,150 @@
+# Import packages
+import argparse
+import importlib
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+# Make the bot modules in the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standin_servers import add_standin_arguments, build_standin_servers
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+first_slip_number = 90907202359893415
+
+###-----------------------------###-----------------------------###
+
+# Create a class that stands in for telegram.Bot so that the notifier runs without sending anything
+class NullBot:
+    async def initialize(self):
+        pass
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        pass
+
+    async def shutdown(self):
+        pass
+
+# Create a class that samples the memory of the benchmark and all the browsers it started, and keeps the peak
+class PeakMemorySampler:
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peak_rss = 0
+        self._is_stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="peak-memory-sampler", daemon=True)
+
+    # Function to sum the resident memory of this process and all its children (Chrome, chromedriver)
+    def _measure(self):
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return rss
+
+    def _sample(self):
+        while not self._is_stopped.wait(timeout=self.interval):
+            self.peak_rss = max(self.peak_rss, self._measure())
+
+    def start(self):
+        if psutil is not None:
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        A function that returns the peak memory in bytes. Without psutil, the peak of this process plus the largest child is used (from getrusage)
+        """
+        if psutil is None:
+            return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+        self._is_stopped.set()
+        self._thread.join(timeout=5)
+        return self.peak_rss
+
+###-----------------------------###-----------------------------###
+
+def import_bot(servers, work_dir, args):
+    """
+    A function that points the bot at the stand-in servers and imports it. The environment variables must be set before the import because the bot reads them at import time
+    """
+    os.environ.update({
+        "WAFID_BASE_URL": servers.base_url,
+        "WAFID_EXIT_IP_URL": servers.exit_ip_url,
+        "CAPMONSTER_SERVICE_URL": servers.cap_monster_url,
+        "CAPMONSTER_KEY": "standin-key",
+        "WAFID_PROXY_MODE": "direct",
+        "WAFID_LOOKUP_ENGINE": args.engine,
+        "WAFID_METRICS_PORT": "0",
+        "WAFID_TRACE_PATH": os.path.join(work_dir, "wafid_trace.jsonl"),
+        # Keep everything the bot writes in work_dir, and never append the results to the real Google Sheet
+        "WAFID_RESULT_SINK": "0",
+        "WAFID_RESULT_HISTORY_DIR": os.path.join(work_dir, "wafid_result_history"),
+        "WAFID_LOG_PATH": os.path.join(work_dir, "wafid_bot_logs.jsonl"),
+        "WAFID_PROFILE_TEMPLATE_DIR": os.path.join(work_dir, "chrome_profile_template"),
+    })
+    bot = importlib.import_module("wafid_bot_selenium_parallel")
+    bot.parallel_jobs = args.concurrency
+    bot.result_store_path = os.path.join(work_dir, "wafid_bot_results.db")
+    bot.telegram_notifier = bot.TelegramNotifier(channels={"wafid": (NullBot(), 0), "errors": (NullBot(), 0)}, min_send_interval=0).start()
+    return bot
+
+def read_slip_results(db_path):
+    with sqlite3.connect(db_path) as connection:
+        return connection.execute("SELECT status, duration_s FROM slip_results").fetchall()
+
+def run_benchmark(args):
+    servers = build_standin_servers(args).start()
+    work_dir = tempfile.mkdtemp(prefix="wafid_benchmark_")
+    bot = import_bot(servers=servers, work_dir=work_dir, args=args)
+    slip_numbers_list = [first_slip_number + i for i in range(args.slips)]
+
+    memory_sampler = PeakMemorySampler().start()
+    started_at = time.time()
+    try:
+        bot.execute_all(slip_numbers_list=slip_numbers_list)
+    finally:
+        elapsed = time.time() - started_at
+        peak_rss = memory_sampler.stop()
+        bot.shutdown_driver_pool()
+        bot.stop_captcha_token_pool()
+        bot.stop_telegram_notifier()
+        bot.get_result_store().close()
+        servers.stop()
+
+    slip_results = read_slip_results(bot.result_store_path)
+    durations = [duration for status, duration in slip_results if duration is not None]
+    outcomes = Counter(status for status, duration in slip_results)
+    print(f"\nEngine: {args.engine}, concurrency: {args.concurrency}, slips: {args.slips}")
+    print(f"Stand-ins: submit latency {args.submit_latency} s, captcha rejection rate {args.captcha_rejection_rate}, captcha solve latency {args.captcha_solve_latency} s, captcha failure rate {args.captcha_failure_rate}")
+    print(f"{'Elapsed':<24}{elapsed:>12.1f} s")
+    print(f"{'Slips per minute':<24}{len(slip_results) / elapsed * 60:>12.2f}")
+    if durations:
+        p50, p95 = np.percentile(durations, [50, 95])
+        print(f"{'p50 slip latency':<24}{p50:>12.1f} s")
+        print(f"{'p95 slip latency':<24}{p95:>12.1f} s")
+    print(f"{'Peak memory':<24}{peak_rss / 1024 ** 2:>12.0f} MB")
+    print(f"{'Outcomes':<24}{dict(outcomes)}")
+    print(f"{'Form submissions':<24}{servers.wafid_site.submissions:>12}")
+    print(f"The trace of the run is in {os.path.join(work_dir, 'wafid_trace.jsonl')} (python wafid_tracing.py report <path>)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot end to end against the stand-in Wafid site and CapMonster API, and report the throughput, latency and memory")
+    parser.add_argument("--slips", type=int, default=20, help="The number of slips to crawl")
+    parser.add_argument("--concurrency", type=int, default=2, help="The number of parallel workers (parallel_jobs)")
+    parser.add_argument("--engine", choices=["selenium", "http"], default="selenium", help="The lookup engine of the bot")
+    add_standin_arguments(parser)
+    run_benchmark(parser.parse_args())
@@ -0,0 +1,104 @@
+# Import packages
+import argparse
+import os
+import sys
+import time
+
+# Make the bot modules in the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wafid_page_extraction import (LexborHTMLParser, extract_page_state_in_browser, parse_page_state_with_beautifulsoup,
+                                   parse_page_state_with_selectolax)
+
+# The saved pages of the three states of the medical status search page and the status each one should be parsed as
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+fixtures = {
+    "search_form_captcha_rejected.html": "captcha_failure",
+    "records_not_found.html": "not_found",
+    "record_found.html": "found",
+}
+
+###-----------------------------###-----------------------------###
+
+def available_parsers():
+    """
+    A function that returns the HTML parsers that are installed on this machine
+    """
+    parsers = {"bs4 + html.parser (current)": lambda html: parse_page_state_with_beautifulsoup(html, features="html.parser")}
+    try:
+        import lxml # noqa: F401
+        parsers["bs4 + lxml"] = lambda html: parse_page_state_with_beautifulsoup(html, features="lxml")
+    except ImportError:
+        print("lxml is not installed. Skipping bs4 + lxml")
+    if LexborHTMLParser is not None:
+        parsers["selectolax (lexbor)"] = parse_page_state_with_selectolax
+    else:
+        print("selectolax is not installed. Skipping selectolax")
+    return parsers
+
+def time_per_call(func, repeats):
+    """
+    A function that returns the average number of milliseconds one call of func takes
+    """
+    started_at = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - started_at) / repeats * 1000
+
+def benchmark_parsers(pages, repeats):
+    """
+    A function that checks that every parser reads the same fields from the fixtures and prints how long each one takes per page.
+    The fields of the first parser (the current one) are the reference the other parsers are compared with
+    """
+    print(f"\n{'Parser':<30}" + "".join(f"{name:>36}" for name in pages))
+    reference_states = {}
+    for parser_name, parser in available_parsers().items():
+        timings = []
+        for name, html in pages.items():
+            page_state = parser(html)
+            assert page_state.status == fixtures[name], f"{parser_name} parsed {name} as {page_state.status} instead of {fixtures[name]}"
+            reference_state = reference_states.setdefault(name, page_state)
+            assert page_state.to_dict() == reference_state.to_dict(), f"{parser_name} read different fields from {name}: {page_state} instead of {reference_state}"
+            timings.append(time_per_call(lambda: parser(html), repeats))
+        print(f"{parser_name:<30}" + "".join(f"{timing:>33.3f} ms" for timing in timings))
+
+def benchmark_browser(pages, repeats):
+    """
+    A function that compares downloading driver.page_source and parsing it in Python with evaluating the selectors in the browser
+    """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    chrome_options.add_argument("--headless=new")
+    chrome_options.add_argument("--no-sandbox")
+    driver = webdriver.Chrome(options=chrome_options)
+    try:
+        print(f"\n{'Approach':<30}" + "".join(f"{name:>36}" for name in pages))
+        approaches = {
+            "page_source + bs4 (current)": lambda: parse_page_state_with_beautifulsoup(driver.page_source, features="html.parser"),
+            "in-browser selectors": lambda: extract_page_state_in_browser(driver),
+        }
+        for approach_name, approach in approaches.items():
+            timings = []
+            for name, html in pages.items():
+                driver.get("file://" + os.path.join(fixtures_dir, name))
+                page_state = approach()
+                assert page_state.status == fixtures[name], f"{approach_name} parsed {name} as {page_state.status} instead of {fixtures[name]}"
+                reference_state = parse_page_state_with_beautifulsoup(html, features="html.parser")
+                assert page_state.to_dict() == reference_state.to_dict(), f"{approach_name} read different fields from {name}: {page_state} instead of {reference_state}"
+                timings.append(time_per_call(approach, repeats))
+            print(f"{approach_name:<30}" + "".join(f"{timing:>33.3f} ms" for timing in timings))
+    finally:
+        driver.quit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ways of extracting the fields of the medical status search page")
+    parser.add_argument("--repeats", type=int, default=200, help="The number of times each page is parsed")
+    parser.add_argument("--browser", action="store_true", help="Also compare page_source parsing with in-browser extraction (needs Chrome)")
+    args = parser.parse_args()
+
+    pages = {name: open(os.path.join(fixtures_dir, name), encoding="utf-8").read() for name in fixtures}
+    benchmark_parsers(pages=pages, repeats=args.repeats)
+    if args.browser:
+        benchmark_browser(pages=pages, repeats=args.repeats)
@@ -0,0 +1,248 @@
+# Import packages
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import re
+import threading
+import time
+
+from aiohttp import web
+
+# The saved pages of the medical status search page are used as the templates of the stand-in pages
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+search_path = "/medical-status-search/"
+countries = ["Saudi Arabia", "Kuwait", "Oman", "Qatar", "Bahrain", "United Arab Emirates"]
+
+###-----------------------------###-----------------------------###
+
+def read_fixture(name, is_offline):
+    html = open(os.path.join(fixtures_dir, name), encoding="utf-8").read()
+    if is_offline:
+        # Drop the scripts from google.com and googletagmanager.com so that Chrome does not block on them without internet access
+        html = re.sub(r'<script[^>]*src="https?://[^"]*"[^>]*></script>', "", html)
+    return html
+
+def set_slip_number(html, slip_number):
+    """
+    A function that fills in the GCC slip number field the way the website does after a successful submission
+    """
+    return re.sub(r'(<input[^>]*id="id_gcc_slip_no"[^>]*?)(?: value="[^"]*")?>', rf'\1 value="{slip_number}">', html, count=1)
+
+# Create a class that serves a stand-in of the medical status search page of wafid.com.
+# It reproduces the id_search_variant_1 / id_gcc_slip_no form, the captcha rejection message under input.g-recaptcha, the "Records not found" header and the found-record page
+class StandinWafidSite:
+    def __init__(self, page_latency=0.3, submit_latency=0.8, latency_jitter=0.3, captcha_rejection_rate=0.2, error_rate=0.0, found_rate=0.1, is_offline=True, seed=0):
+        """
+        - page_latency: The mean number of seconds it takes to serve the search form
+        - submit_latency: The mean number of seconds it takes to answer a form submission
+        - latency_jitter: The latencies are drawn uniformly from mean * (1 ± latency_jitter)
+        - captcha_rejection_rate: The share of submissions that are answered with the captcha message
+        - error_rate: The share of requests that are answered with HTTP 502
+        - found_rate: The share of slip numbers a record is found for. The same slip number always gives the same answer
+        - is_offline: Remove the external scripts from the pages so that the browser does not need internet access
+        """
+        self.page_latency = page_latency
+        self.submit_latency = submit_latency
+        self.latency_jitter = latency_jitter
+        self.captcha_rejection_rate = captcha_rejection_rate
+        self.error_rate = error_rate
+        self.found_rate = found_rate
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.submissions = 0
+        captcha_rejected_html = read_fixture("search_form_captcha_rejected.html", is_offline=is_offline)
+        self.search_form_html = re.sub(r'\s*<p class="ui red message">.*?</p>', "", captcha_rejected_html, count=1)
+        self.captcha_rejected_html = captcha_rejected_html
+        self.records_not_found_html = read_fixture("records_not_found.html", is_offline=is_offline)
+        self.record_found_html = read_fixture("record_found.html", is_offline=is_offline)
+
+    def is_slip_found(self, slip_number):
+        return random.Random(f"{self.seed}-{slip_number}").random() < self.found_rate
+
+    async def _wait(self, mean_latency):
+        await asyncio.sleep(mean_latency * self.random.uniform(1 - self.latency_jitter, 1 + self.latency_jitter))
+        if self.random.random() < self.error_rate:
+            raise web.HTTPBadGateway()
+
+    async def get_search_form(self, request):
+        await self._wait(self.page_latency)
+        return web.Response(text=self.search_form_html, content_type="text/html")
+
+    async def post_search_form(self, request):
+        form = await request.post()
+        self.submissions += 1
+        await self._wait(self.submit_latency)
+        slip_number = form.get("gcc_slip_no", "").strip()
+        if self.random.random() < self.captcha_rejection_rate or form.get("search_variant") != "gcc_slip_no" or not slip_number:
+            return web.Response(text=self.captcha_rejected_html, content_type="text/html")
+        if self.is_slip_found(slip_number):
+            html = set_slip_number(self.record_found_html, slip_number)
+            html = html.replace('value="Saudi Arabia"', f'value="{random.Random(slip_number).choice(countries)}"', 1)
+        else:
+            html = set_slip_number(self.records_not_found_html, slip_number)
+        return web.Response(text=html, content_type="text/html")
+
+    async def get_exit_ip(self, request):
+        return web.Response(text="203.0.113.7", content_type="text/plain")
+
+    async def get_static_file(self, request):
+        return web.Response(text="", content_type="application/javascript")
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_get(search_path, self.get_search_form)
+        app.router.add_post(search_path, self.post_search_form)
+        app.router.add_get("/ip", self.get_exit_ip)
+        app.router.add_get("/static/{path:.*}", self.get_static_file)
+        return app
+
+# Create a class that serves a stand-in of the CapMonster task API (createTask, getTaskResult and getBalance)
+class StandinCapMonster:
+    def __init__(self, solve_latency=5, latency_jitter=0.5, failure_rate=0.05, seed=0):
+        """
+        - solve_latency: The mean number of seconds it takes to solve a captcha
+        - latency_jitter: The latencies are drawn uniformly from mean * (1 ± latency_jitter)
+        - failure_rate: The share of tasks that end with ERROR_CAPTCHA_UNSOLVABLE
+        """
+        self.solve_latency = solve_latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.task_ids = itertools.count(1)
+        self.tasks = {} # task ID --> (the time the task is done, is_failure)
+
+    async def create_task(self, request):
+        body = await request.json()
+        if not body.get("clientKey"):
+            return web.json_response({"errorId": 1, "errorCode": "ERROR_KEY_DOES_NOT_EXIST", "errorDescription": "Account authorization key not found"})
+        task_id = next(self.task_ids)
+        solve_latency = self.solve_latency * self.random.uniform(1 - self.latency_jitter, 1 + self.latency_jitter)
+        self.tasks[task_id] = (time.time() + solve_latency, self.random.random() < self.failure_rate)
+        return web.json_response({"errorId": 0, "taskId": task_id})
+
+    async def get_task_result(self, request):
+        body = await request.json()
+        if body.get("taskId") not in self.tasks:
+            return web.json_response({"errorId": 1, "errorCode": "ERROR_NO_SUCH_CAPCHA_ID", "errorDescription": "Task with this ID not found"})
+        done_at, is_failure = self.tasks[body["taskId"]]
+        if time.time() < done_at:
+            return web.json_response({"errorId": 0, "status": "processing"})
+        self.tasks.pop(body["taskId"])
+        if is_failure:
+            return web.json_response({"errorId": 1, "errorCode": "ERROR_CAPTCHA_UNSOLVABLE", "errorDescription": "Captcha could not be solved"})
+        return web.json_response({"errorId": 0, "status": "ready", "solution": {"gRecaptchaResponse": f"standin-token-{body['taskId']}"}})
+
+    async def get_balance(self, request):
+        return web.json_response({"errorId": 0, "balance": 100.0})
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post("/createTask", self.create_task)
+        app.router.add_post("/getTaskResult", self.get_task_result)
+        app.router.add_post("/getBalance", self.get_balance)
+        return app
+
+###-----------------------------###-----------------------------###
+
+# Create a class that runs the stand-in servers on free local ports in a background thread
+class StandinServers:
+    def __init__(self, wafid_site, cap_monster, host="127.0.0.1", wafid_port=0, cap_monster_port=0):
+        self.wafid_site = wafid_site
+        self.cap_monster = cap_monster
+        self.host = host
+        self.ports = {"wafid": wafid_port, "cap_monster": cap_monster_port}
+        self._loop = asyncio.new_event_loop()
+        self._runners = []
+        self._is_started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="standin-servers", daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.ports['wafid']}{search_path}"
+
+    @property
+    def exit_ip_url(self):
+        return f"http://{self.host}:{self.ports['wafid']}/ip"
+
+    @property
+    def cap_monster_url(self):
+        return f"http://{self.host}:{self.ports['cap_monster']}"
+
+    def start(self):
+        self._thread.start()
+        self._is_started.wait(timeout=10)
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._cleanup(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    async def _serve(self, name, app):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.ports[name])
+        await site.start()
+        self.ports[name] = site._server.sockets[0].getsockname()[1]
+        self._runners.append(runner)
+
+    async def _cleanup(self):
+        for runner in self._runners:
+            await runner.cleanup()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve("wafid", self.wafid_site.build_app()))
+        self._loop.run_until_complete(self._serve("cap_monster", self.cap_monster.build_app()))
+        self._is_started.set()
+        self._loop.run_forever()
+
+def add_standin_arguments(parser):
+    """
+    A function that adds the latency and failure rate options of the stand-in servers to an argument parser
+    """
+    parser.add_argument("--page-latency", type=float, default=0.3, help="The mean number of seconds it takes to serve the search form")
+    parser.add_argument("--submit-latency", type=float, default=0.8, help="The mean number of seconds it takes to answer a form submission")
+    parser.add_argument("--captcha-rejection-rate", type=float, default=0.2, help="The share of submissions that are answered with the captcha message")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="The share of requests to the stand-in site that fail with HTTP 502")
+    parser.add_argument("--found-rate", type=float, default=0.1, help="The share of slip numbers a record is found for")
+    parser.add_argument("--captcha-solve-latency", type=float, default=5, help="The mean number of seconds the stand-in CapMonster takes to solve a captcha")
+    parser.add_argument("--captcha-failure-rate", type=float, default=0.05, help="The share of captcha tasks that cannot be solved")
+    parser.add_argument("--seed", type=int, default=0)
+
+def build_standin_servers(args, wafid_port=0, cap_monster_port=0):
+    """
+    A function that creates the stand-in servers from the parsed options of add_standin_arguments
+    """
+    return StandinServers(
+        wafid_site=StandinWafidSite(
+            page_latency=args.page_latency,
+            submit_latency=args.submit_latency,
+            captcha_rejection_rate=args.captcha_rejection_rate,
+            error_rate=args.error_rate,
+            found_rate=args.found_rate,
+            seed=args.seed
+        ),
+        cap_monster=StandinCapMonster(solve_latency=args.captcha_solve_latency, failure_rate=args.captcha_failure_rate, seed=args.seed),
+        wafid_port=wafid_port,
+        cap_monster_port=cap_monster_port
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a stand-in of the Wafid medical status search page and of the CapMonster API")
+    parser.add_argument("--wafid-port", type=int, default=8001)
+    parser.add_argument("--cap-monster-port", type=int, default=8002)
+    add_standin_arguments(parser)
+    args = parser.parse_args()
+
+    servers = build_standin_servers(args, wafid_port=args.wafid_port, cap_monster_port=args.cap_monster_port).start()
+    print(f"WAFID_BASE_URL={servers.base_url}")
+    print(f"WAFID_EXIT_IP_URL={servers.exit_ip_url}")
+    print(f"CAPMONSTER_SERVICE_URL={servers.cap_monster_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servers.stop()
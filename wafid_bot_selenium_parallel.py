@@ -1,35 +1,58 @@
 # Import packages
 import asyncio
+import copy
+import itertools
 import logging
 import os
 import random
 import re
+import threading
 import time
 import warnings
-from datetime import datetime
+from contextlib import nullcontext
+from urllib.parse import urlparse
 
 # If you get an error with the ChromeBrowser version, pip install chromedriver-binary and chromedriver-binary-auto from https://pypi.org/project/chromedriver-binary/
 # Then run pip install --upgrade --force-reinstall chromedriver-binary-auto
 # This will install redetect the required version and install the newest suitable chromedriver
 # There is no need to use service=Service(executable_path=ChromeDriverManager().install()) anymore
 import chromedriver_binary  # This will add the executable to your PATH so it will be found. You can also get the absolute filename of the binary with chromedriver_binary.chromedriver_filename
-import gspread
-import numpy as np
 import pandas as pd
-import pytz
-from bs4 import BeautifulSoup
 from capmonstercloudclient import CapMonsterClient, ClientOptions
 from capmonstercloudclient.requests import RecaptchaV3ProxylessRequest
 from dotenv import load_dotenv
-from joblib import Parallel, delayed
-from oauth2client.service_account import ServiceAccountCredentials
+from joblib import Parallel, delayed, effective_n_jobs
+from selenium import webdriver as selenium_webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from seleniumwire import webdriver
 from telegram import Bot
-from telegram.constants import ParseMode
+from telegram.helpers import escape_markdown
+
+from wafid_browser_supervisor import BrowserSupervisor, owner_argument
+from wafid_captcha_pool import CaptchaTokenPool
+from wafid_captcha_solvers import CaptchaProvider, CaptchaSolverRouter, solve_two_captcha_token
+from wafid_chrome_profiles import ChromeProfileTemplate, warm_profile_arguments
+from wafid_concurrency import ConcurrencyController
+from wafid_crawl_scheduler import CrawlScheduler, parse_calendar
+from wafid_driver_pool import WebDriverPool
+from wafid_http_lookup import lookup_slips_http
+from wafid_logging import LogPipeline
+from wafid_metrics import CrawlerMetrics
+from wafid_page_extraction import extract_page_state_in_browser
+from wafid_page_readiness import reset_search_form_script, submit_form_and_wait
+from wafid_proxy_forwarder import ProxyForwarder
+from wafid_proxy_manager import ProxyManager
+from wafid_request_filter import SlipTrafficMeter, apply_request_filter
+from wafid_result_sink import ResultSink, result_columns
+from wafid_result_store import ResultStore
+from wafid_retry_policy import RetryBudget, RetryPolicy, classify_exception, classify_page_state
+from wafid_sheet_client import CachedSheetClient
+from wafid_slip_frontier import SlipFrontier
+from wafid_telegram_notifier import TelegramNotifier
+from wafid_tracing import SlipTracer
 
 warnings.filterwarnings(action="ignore")
 
@@ -43,7 +66,6 @@ path = os.path.dirname(os.path.expanduser("~") + "/cap_monster_extension/manifes
 chrome_options = Options()
 chrome_options.add_argument("start-maximized") # Required for a maximized Viewport
 chrome_options.add_experimental_option('excludeSwitches', ['enable-logging', 'enable-automation', 'disable-popup-blocking']) # Disable pop-ups to speed up browsing
-chrome_options.add_experimental_option("detach", True) # Keeps the Chrome window open after all the Selenium commands/operations are performed 
 chrome_options.add_experimental_option('prefs', {'intl.accept_languages': 'en,en_US'}) # Operate Chrome using English as the main language
 chrome_options.add_argument("--headless=new") # Operate Selenium in headless mode
 chrome_options.add_argument('--no-sandbox') # Disables the sandbox for all process types that are normally sandboxed. Meant to be used as a browser-level switch for testing purposes only
@@ -52,49 +74,226 @@ chrome_options.add_argument("enable-features=NetworkServiceInProcess") # Combats
 chrome_options.add_argument("disable-features=NetworkService") # Combats the renderer timeout problem
 chrome_options.add_experimental_option('extensionLoadTimeout', 45000) # Fixes the problem of renderer timeout for a slow PC
 chrome_options.add_argument("--window-size=1920x1080") # Set the Chrome window size to 1920 x 1080
+for argument in warm_profile_arguments: # Skip the first-run work and the component updates so that Chrome starts faster
+    chrome_options.add_argument(argument)
+chrome_options.add_argument(owner_argument()) # Tags the browsers of this process so that the browser supervisor can find them if they are orphaned
 
 # Global inputs (1): Basic information
-base_url = "https://wafid.com/medical-status-search/"
+base_url = os.getenv("WAFID_BASE_URL", "https://wafid.com/medical-status-search/") # Point it at benchmarks/standin_servers.py to run the bot offline
+exit_ip_url = os.getenv("WAFID_EXIT_IP_URL", "https://ip.oxylabs.io/")
+capmonster_service_url = os.getenv("CAPMONSTER_SERVICE_URL", "https://api.capmonster.cloud")
 slip_number_list_len = 50
 parallel_jobs = -1
 webdriver_waiting_time = 30
-recaptcha_retries = 5
+page_outcome_timeout = 30 # The maximum number of seconds to wait for the page to show the result or the captcha message after submitting the form
 close_to_end_of_cycle_index = 40 # The index of the slip number list where the bot will send a message to Telegram informing the user that it is time to change the starting slip number
 
-# Create a list of hours outside the crawling window where the bot will sleep
-starting_local_time = 10 # 10 am
-ending_local_time = 21 # 10 pm (we subtract one because we still want to be crawling at 21:59)
+# Global inputs (2): Lookup engine. "selenium" crawls every slip with Chrome. "http" submits the form over a pooled async HTTP session and falls back to Selenium for the slips it could not resolve
+lookup_engine = os.getenv("WAFID_LOOKUP_ENGINE", "selenium")
+http_lookup_concurrency = 10 # The number of slips that are looked up over HTTP at the same time
+
+# Global inputs (3): Web driver pool. The pooled drivers are shared between the workers, so the workers run as threads in one process instead of separate processes
+use_driver_pool = True
+driver_max_uses = 20 # The number of slips a Chrome browser is used for before it is replaced with a fresh one
+parallel_backend = "threading" if use_driver_pool else "loky"
+driver_pool = None # Created lazily by get_driver_pool() and shut down when the crawling window closes
+shared_services_lock = threading.Lock() # Makes sure that the worker threads don't create the shared pools and stores twice
+
+# Global inputs (4): Captcha token pool. The tokens are solved in the background and handed out to the workers instantly
+use_captcha_token_pool = True
+captcha_site_key = "6LflPAwnAAAAAL2wBGi6tSyGUyj-xFvftINOR9xp"
+captcha_token_ttl = 100 # reCAPTCHA tokens expire after 120 seconds. Evict them earlier so that a token does not expire while the form is being filled in
+captcha_pool_max_size = 10 # The maximum number of tokens that are ready or being solved at the same time
+captcha_token_pool = None # Created lazily by get_captcha_token_pool() and stopped when the crawling window closes
+cap_monster_client = None # Created lazily by solve_capmonster_token()
+
+# Global inputs (5): Result store. The result of every slip is stored in a local SQLite database so that a crashed cycle can be resumed and resolved slips are not crawled again
+result_store_path = "wafid_bot_results.db"
+result_store = None # Created lazily by get_result_store()
+
+# Global inputs (6): Slip frontier. Instead of crawling slip_number_list_len consecutive slips from the Google Sheet, crawl a dense window after the newest slip a record was found for and probe further ahead to detect jumps
+use_slip_frontier = True
+frontier_lookback = 5 # The number of slips before the frontier that are re-checked in case they were issued out of order
+frontier_probe_count = 6 # The number of slips of the budget that are spent on probes ahead of the dense window
+frontier_probe_base_step = 8 # The distance of the first probe from the end of the dense window. Every following probe is twice as far
+
+# Global inputs (7): Google Sheet cache. The sheet is only re-read when it changes or after sheet_cache_ttl seconds, and the last records are used if the API is down
+sheet_cache_ttl = 600
+sheet_cache_path = "wafid_sheet_cache.json"
+sheet_client = None # Created lazily by get_sheet_client()
+
+# Global inputs (8): Telegram notifier. Found records and errors are sent right away, and the "No records found" lines are sent as one digest every telegram_digest_interval seconds
+telegram_digest_interval = 600
+telegram_notifier = None # Created lazily by get_telegram_notifier()
+
+# Global inputs (9): Proxy manager. Every browser gets a sticky proxy session (one exit IP). Sessions are scored by success rate and latency, and rotated to a new exit IP after a captcha failure
+proxy_sessions_per_endpoint = 5
+proxy_session_username_template = os.getenv("PROXY_SERVICE_SESSION_USERNAME_TEMPLATE", "{username}-sessid-{session_id}") # Set it to an empty string to disable sticky sessions
+proxy_manager = None # Created lazily by get_proxy_manager()
+
+# Global inputs (10): Proxy mode. "seleniumwire" sends the traffic of every browser through the seleniumwire MITM proxy, which decrypts and stores every request.
+# "native" points Chrome at a local forwarder that only adds the proxy credentials to the CONNECT requests, so TLS is not decrypted and no requests are stored.
+# "direct" does not use a proxy at all. It is meant for the local stand-in servers of the benchmarks
+proxy_mode = os.getenv("WAFID_PROXY_MODE", "seleniumwire")
+
+# Global inputs (11): Request filter. Fonts, analytics, trackers and media are not downloaded through the proxy (which bills per GB). Images and the reCAPTCHA resources are always downloaded
+use_request_filter = True
+
+# Global inputs (12): Metrics. Throughput, outcomes, retries, captcha, browser and Telegram metrics are exported to Prometheus on http://0.0.0.0:<metrics_port>/metrics (0 disables the endpoint)
+# and/or written to metrics_textfile_path for the textfile collector of the node exporter
+metrics_port = int(os.getenv("WAFID_METRICS_PORT", "9108"))
+metrics_textfile_path = os.getenv("WAFID_METRICS_TEXTFILE")
+metrics_exporter_variable = "WAFID_METRICS_EXPORTER_PID" # Only the process whose PID is in this environment variable exports the metrics. The loky worker processes inherit it and skip the export
+crawler_metrics = None # Created lazily by get_crawler_metrics(). It lives as long as the process because the HTTP endpoint cannot be restarted on the same port
+
+# Global inputs (13): Tracing. Every stage of every slip (driver launch, IP check, page load, captcha solve, submits, parsing, notifications) is written to trace_path as one JSON line.
+# Run "python wafid_tracing.py report wafid_trace.jsonl" to get the percentiles of every stage and the critical path of every cycle
+use_tracing = os.getenv("WAFID_TRACING", "1") == "1"
+trace_path = os.getenv("WAFID_TRACE_PATH", "wafid_trace.jsonl")
+slip_tracer = None # Created lazily by get_slip_tracer()
+
+# Global inputs (14): Captcha providers. Every captcha job goes to the provider with the best latency, failure rate and cost. If it is slower than usual, the next provider is raced against it
+# ("hedge"). "race" starts all the providers at once and "single" only fails over. 2Captcha is used if TWO_CAPTCHA_KEY is set
+captcha_providers = os.getenv("WAFID_CAPTCHA_PROVIDERS", "capmonster,2captcha" if os.getenv("TWO_CAPTCHA_KEY") else "capmonster").split(",")
+captcha_routing_mode = os.getenv("WAFID_CAPTCHA_ROUTING_MODE", "hedge")
+captcha_costs_per_1000 = {"capmonster": 0.9, "2captcha": 1.45} # USD per 1000 reCAPTCHA V3 tokens. Update them when the price lists change
+two_captcha_service_url = os.getenv("TWO_CAPTCHA_SERVICE_URL", "https://api.2captcha.com")
+captcha_solver_router = None # Created lazily by get_captcha_solver_router()
+
+# Global inputs (15): Retry policy. Every failure is classified (captcha rejected, form not filled, timeout, proxy error, WebDriver crash) and retried with a jittered backoff of its class,
+# either on the same browser or on another browser and exit IP (up to max_requeues times). A cycle can spend at most min_retry_budget + retry_budget_ratio retries per slip
+max_requeues = 2
+retry_budget_ratio = 0.5
+min_retry_budget = 10
+retry_policy = None # Created lazily by get_retry_policy()
+
+# Global inputs (16): Batched sessions. Every worker takes a chunk of session_batch_size slips and looks them up one after the other on the same loaded search page,
+# instead of loading the page and selecting the search variant for every slip
+use_batched_sessions = os.getenv("WAFID_BATCHED_SESSIONS", "1") == "1"
+session_batch_size = 5
+
+# Global inputs (17): Chrome profile template. A warmed Chrome profile (first run done, the static assets of the search page cached) is built once in profile_template_dir
+# and every new browser starts from a throwaway copy of it on tmpfs (/dev/shm) instead of an empty profile. The template is built again after profile_template_max_age seconds
+use_profile_template = os.getenv("WAFID_PROFILE_TEMPLATE", "1") == "1"
+profile_template_dir = os.getenv("WAFID_PROFILE_TEMPLATE_DIR", os.path.expanduser("~") + "/.cache/wafid_chrome_profile_template")
+profile_template_max_age = 86400
+chrome_profile_template = None # Created lazily by get_chrome_profile_template()
 
-day_hours = np.arange(1, 25).astype(str)
-mask = day_hours == "24" # Change 24 to 00 by creating a boolean mask to identify elements equal to "24"
-day_hours[mask] = "00" # Replace elements in the array that match the condition with new_value
+# Global inputs (18): Browser supervisor. The process tree (chromedriver, Chrome and its children) of every browser is sampled every browser_sample_interval seconds.
+# A browser that uses more than browser_max_rss bytes or runs longer than browser_max_lifetime seconds is killed, and the orphaned Chrome processes are reaped at the end of every cycle
+browser_max_rss = int(os.getenv("WAFID_BROWSER_MAX_RSS_MB", "1536")) * 1024 ** 2
+browser_max_lifetime = 3600
+browser_sample_interval = 5
+browser_supervisor = None # Created lazily by get_browser_supervisor()
 
-bot_crawling_window = np.arange(starting_local_time, ending_local_time + 1).astype(str) # The hours where the bot will crawl the website
-outside_crawling_hrs = day_hours[~np.isin(day_hours, bot_crawling_window)].tolist() # The hours where the bot will sleep
+# Global inputs (19): Adaptive concurrency. parallel_jobs worker threads are started, but only the number of slips (or chunks) the concurrency controller allows are crawled at the same time.
+# The limit starts at initial_concurrency and moves between min_concurrency and max_concurrency (parallel_jobs by default) with AIMD: it grows by one while all the slots are busy
+# and is cut when slips fail, the captcha rejections pile up, or the host runs short of memory. It needs the threading backend, i.e., the driver pool
+use_adaptive_concurrency = parallel_backend == "threading"
+min_concurrency = 1
+max_concurrency = int(os.getenv("WAFID_MAX_CONCURRENCY", "0")) or None # None means parallel_jobs
+initial_concurrency = 2
+concurrency_adjust_interval = 30
+max_slip_error_rate = 0.2
+max_captcha_rejection_rate = 0.35
+min_available_memory = 1024 ** 3 # Bytes of free host memory below which the limit is cut
+concurrency_controller = None # Created lazily by get_concurrency_controller()
+
+# Global inputs (20): Result sink. The results of the slips are buffered and appended to the results_worksheet_title worksheet of the Google Sheet with one API call every
+# result_sink_flush_interval seconds, and to a history in result_history_dir that is partitioned by day (Parquet if pyarrow is installed, CSV otherwise)
+use_result_sink = os.getenv("WAFID_RESULT_SINK", "1") == "1"
+results_worksheet_title = "results"
+result_sink_flush_interval = 60
+result_history_dir = os.getenv("WAFID_RESULT_HISTORY_DIR", "wafid_result_history")
+result_sink = None # Created lazily by get_result_sink() and stopped when the crawling window closes
+
+# Global inputs (21): Logging. All the processes and threads of the bot put their log records in a queue that one log writer process drains into log_path as JSON lines.
+# The file is rotated at log_max_bytes or every log_rotate_interval seconds and the rotated files are gzipped. Only a share of the verbose per-submission lines is kept (verbose_log_sample_rates)
+log_path = os.getenv("WAFID_LOG_PATH", "wafid_bot_logs.jsonl")
+log_level = os.getenv("WAFID_LOG_LEVEL", "INFO")
+log_max_bytes = 50 * 1024 ** 2
+log_backup_count = 20
+log_rotate_interval = 86400
+verbose_log_sample_rates = {"DEBUG": 0.05, "INFO": 0.25} # WARNING and above are always kept
+log_pipeline = None # Created lazily by setup_logging()
+
+# Crawling calendar. By default, the bot crawls every day from 10:00 until 21:59 Dhaka time. Set WAFID_CRAWL_CALENDAR to use other windows per weekday, e.g.,
+# {"default": [["10:00", "22:00"]], "fri": [["14:00", "18:00"], ["19:00", "22:00"]], "sun": []}
+crawl_timezone = "Asia/Dhaka"
+crawl_calendar = parse_calendar(os.getenv("WAFID_CRAWL_CALENDAR", '{"default": [["10:00", "22:00"]]}'))
+default_cycle_duration = 900 # The number of seconds a cycle is assumed to take before there is any history in the result store
+cycle_duration_safety_factor = 1.2 # A cycle only starts if the window is open for at least the estimated cycle duration times this factor
+cycle_history_len = 10 # The number of recent cycles the cycle duration is estimated from
 
 ###-----------------------------###-----------------------------###
 
+def setup_logging():
+    """
+    A function that sends the log records of this process to the log writer, and starts the writer if no process of the bot started it yet.
+    Every worker calls it because joblib may run the workers in other processes
+    """
+    global log_pipeline
+    with shared_services_lock:
+        if log_pipeline is None:
+            log_pipeline = LogPipeline(
+                log_path=log_path,
+                level=log_level,
+                max_bytes=log_max_bytes,
+                backup_count=log_backup_count,
+                rotate_interval=log_rotate_interval,
+                verbose_sample_rates=verbose_log_sample_rates
+            ).start()
+    return log_pipeline
+
 # Get the list of slip numbers from the Google Sheet --> https://docs.google.com/spreadsheets/d/1F2F2yWmvMebUG1rtppzt1Z9RZ9bOSHwu2VjXzk4XmC8/edit?pli=1#gid=0
 # Replace 'your_spreadsheet_key' with the key of your Google Sheets document.
 # You can find the key in the URL of your spreadsheet: 'https://docs.google.com/spreadsheets/d/your_spreadsheet_key/edit'
-def google_sheet_reader():
-    SPREADSHEET_KEY = '1F2F2yWmvMebUG1rtppzt1Z9RZ9bOSHwu2VjXzk4XmC8'
-    # Replace 'your_service_account.json' with the filename of your service account key.
-    SERVICE_ACCOUNT_FILE = os.path.expanduser("~") + "/service_account_key.json"
-
-    # Authenticate with Google Sheets API using the service account credentials
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
-    client = gspread.authorize(creds)
+def get_sheet_client():
+    """
+    A function that returns the cached Google Sheets client and creates it if it does not exist yet
+    """
+    global sheet_client
+    with shared_services_lock:
+        if sheet_client is None:
+            # Replace 'your_service_account.json' with the filename of your service account key.
+            sheet_client = CachedSheetClient(
+                service_account_file=os.path.expanduser("~") + "/service_account_key.json",
+                spreadsheet_key='1F2F2yWmvMebUG1rtppzt1Z9RZ9bOSHwu2VjXzk4XmC8',
+                scope=['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive'],
+                worksheet_index=0, # Select the worksheet you want to read from (by index, starting from 0)
+                ttl=sheet_cache_ttl,
+                cache_path=sheet_cache_path
+            )
+    return sheet_client
 
-    # Open the spreadsheet
-    spreadsheet = client.open_by_key(SPREADSHEET_KEY)
+def get_result_sink():
+    """
+    A function that returns the result sink and starts flushing it if it does not exist yet
+    """
+    global result_sink
+    client = get_sheet_client() # Outside the lock because get_sheet_client() takes it too
+    with shared_services_lock:
+        if result_sink is None:
+            result_sink = ResultSink(
+                append_rows_func=lambda rows: client.append_rows(rows=rows, worksheet_title=results_worksheet_title, header=result_columns),
+                history_dir=result_history_dir,
+                flush_interval=result_sink_flush_interval,
+                timezone=crawl_timezone
+            ).start()
+    return result_sink
 
-    # Select the worksheet you want to read from (by index, starting from 0) or by title
-    worksheet = spreadsheet.get_worksheet(index=0)
+def stop_result_sink():
+    """
+    A function that writes out the buffered results and stops the result sink
+    """
+    global result_sink
+    if result_sink is not None:
+        result_sink.stop()
+        result_sink = None
 
-    # Get all values from the worksheet
-    df_slip_numbers = pd.DataFrame(worksheet.get_all_records(empty2zero=False, default_blank=None))
+def google_sheet_reader():
+    # Get all values from the worksheet. The client re-authorizes and re-reads the sheet only when needed
+    df_slip_numbers = pd.DataFrame(get_sheet_client().get_records())
 
     # Create a list of slip numbers from the provided slip number
     slip_numbers_list = []
@@ -106,6 +305,29 @@ def google_sheet_reader():
     # Return the slip_numbers_list and the starting slip number
     return slip_numbers_list, df_slip_numbers["slip_number"][0]
 
+def plan_slip_numbers():
+    """
+    A function that returns the slip numbers of the next crawling cycle. The slip number in the Google Sheet is only used as the seed of the slip frontier
+    """
+    slip_numbers_list, starting_slip_number = google_sheet_reader()
+    if not use_slip_frontier:
+        return slip_numbers_list
+
+    slip_frontier = SlipFrontier(
+        result_store=get_result_store(),
+        budget=slip_number_list_len,
+        lookback=frontier_lookback,
+        probe_count=frontier_probe_count,
+        probe_base_step=frontier_probe_base_step
+    )
+    return slip_frontier.plan_cycle(seed_slip=starting_slip_number)
+
+def is_close_to_end_of_cycle(slip, slip_numbers_list):
+    """
+    A function that checks whether it is time to remind the user to change the starting slip number in the Google Sheet. This is not needed when the slip frontier moves the starting point
+    """
+    return not use_slip_frontier and len(slip_numbers_list) > close_to_end_of_cycle_index and slip == slip_numbers_list[close_to_end_of_cycle_index]
+
 ###-----------------------------###-----------------------------###
 
 # Define a function to specify the proxy configuration
@@ -122,154 +344,492 @@ def chrome_proxy(user: str, password: str, endpoint: str):
 
 ###-----------------------------###-----------------------------###
 
-def solve_capmonster_captcha(slip_number):
+def get_proxy_manager():
+    """
+    A function that returns the proxy manager and creates it if it does not exist yet.
+    The endpoints are read from PROXY_SERVICE_ENDPOINTS (comma-separated) or PROXY_SERVICE_ENDPOINT
+    """
+    global proxy_manager
+    with shared_services_lock:
+        if proxy_manager is None:
+            # In direct mode the sessions are only used to score the browsers, so one placeholder endpoint is enough
+            endpoints = "direct" if proxy_mode == "direct" else os.getenv("PROXY_SERVICE_ENDPOINTS") or os.getenv("PROXY_SERVICE_ENDPOINT")
+            proxy_manager = ProxyManager(
+                endpoints=[endpoint.strip() for endpoint in endpoints.split(",") if endpoint.strip()],
+                username=os.getenv("PROXY_SERVICE_USERNAME"),
+                password=os.getenv("PROXY_SERVICE_PASSWORD"),
+                sessions_per_endpoint=max(proxy_sessions_per_endpoint, effective_n_jobs(parallel_jobs)),
+                session_username_template=proxy_session_username_template
+            )
+    return proxy_manager
+
+def get_chrome_profile_template():
+    """
+    A function that returns the Chrome profile template and creates it if it does not exist yet. The template itself is built (or rebuilt) the first time a browser is launched from it
+    """
+    global chrome_profile_template
+    with shared_services_lock:
+        if chrome_profile_template is None:
+            chrome_profile_template = ChromeProfileTemplate(template_dir=profile_template_dir, warm_func=warm_chrome_profile, max_age=profile_template_max_age)
+            chrome_profile_template.remove_stale_clones()
+    return chrome_profile_template
+
+def warm_chrome_profile(user_data_dir):
+    """
+    A function that launches Chrome on user_data_dir, loads the search page so that its static assets are cached, and quits Chrome
+    """
+    driver = create_chrome_driver(user_data_dir=user_data_dir)
+    try:
+        load_search_form(driver)
+    finally:
+        quit_chrome_driver(driver)
+
+# Define a function that launches a new Chrome web driver behind the proxy service
+def create_chrome_driver(user_data_dir=None):
+    """
+    A function that launches a Chrome web driver behind the best proxy session and sets the implicit waiting time to be 60 seconds.
+    The proxy session is attached to the driver so that the outcome of every slip can be reported to the proxy manager.
+    Chrome runs on user_data_dir if it is given, or on a fresh copy of the profile template (deleted when the driver is quit) if use_profile_template is True
+    """
+    proxy_session = get_proxy_manager().acquire()
+    proxy_forwarder = None
+    profile_clone_dir = None
+    launch_started_at = time.time()
+    try:
+        with get_slip_tracer().span("driver_launch"):
+            driver_chrome_options = copy.deepcopy(chrome_options)
+            if user_data_dir is None and use_profile_template:
+                with get_slip_tracer().span("profile_clone"):
+                    profile_clone_dir = get_chrome_profile_template().clone()
+            if user_data_dir or profile_clone_dir:
+                driver_chrome_options.add_argument(f"--user-data-dir={user_data_dir or profile_clone_dir}")
+
+            if proxy_mode == "native":
+                # Chrome cannot authenticate to a proxy from the command line, so it talks to a local forwarder that adds the credentials of the proxy session
+                proxy_forwarder = ProxyForwarder(upstream_endpoint=proxy_session.endpoint, username=proxy_session.username, password=proxy_session.password).start()
+                driver_chrome_options.add_argument(f"--proxy-server={proxy_forwarder.url}")
+                driver = selenium_webdriver.Chrome(options=driver_chrome_options)
+            elif proxy_mode == "direct":
+                driver = selenium_webdriver.Chrome(options=driver_chrome_options)
+            else:
+                proxies = chrome_proxy(proxy_session.username, proxy_session.password, proxy_session.endpoint)
+                driver = webdriver.Chrome(options=driver_chrome_options, seleniumwire_options=proxies)
+    except Exception:
+        if proxy_forwarder is not None:
+            proxy_forwarder.stop()
+        if profile_clone_dir is not None:
+            get_chrome_profile_template().remove(profile_clone_dir)
+        get_proxy_manager().release(proxy_session)
+        raise
+    try:
+        get_crawler_metrics().observe_driver_launch(time.time() - launch_started_at)
+    except Exception as e:
+        logging.warning(f"The launch of the web driver could not be recorded in the metrics: {e}") # The metrics must never fail a browser that is already running
+    driver.proxy_forwarder = proxy_forwarder # None in seleniumwire mode
+    driver.profile_clone_dir = profile_clone_dir # None if the browser does not run on a copy of the profile template
+    driver.proxy_session = proxy_session
+    driver.proxy_session_id = proxy_session.session_id # The session ID the browser was launched with. It changes if the proxy manager rotates the session
+    get_browser_supervisor().register(driver)
+
+    # Quit the browser if it cannot be set up, otherwise nobody would quit it
+    try:
+        driver.implicitly_wait(60)
+        if use_request_filter:
+            apply_request_filter(driver)
+    except Exception:
+        quit_chrome_driver(driver)
+        raise
+    return driver
+
+def quit_chrome_driver(driver):
+    """
+    A function that quits a Chrome web driver, stops its local proxy forwarder (in native proxy mode), deletes its copy of the profile template, and gives its proxy session back to the proxy manager
+    """
+    get_proxy_manager().release(driver.proxy_session)
+    try:
+        driver.quit()
+    finally:
+        get_browser_supervisor().unregister(driver) # Kills the processes of the browser that did not exit
+        if driver.proxy_forwarder is not None:
+            driver.proxy_forwarder.stop()
+        if driver.profile_clone_dir is not None:
+            get_chrome_profile_template().remove(driver.profile_clone_dir)
+
+def is_proxy_session_current(driver):
+    """
+    A function that checks whether a driver still uses the current exit IP of its proxy session. The driver must be replaced if the session was rotated
+    """
+    return driver.proxy_session.session_id == driver.proxy_session_id
+
+def release_chrome_driver(driver, is_broken=False, uses=1):
+    """
+    A function that returns a driver to the pool, or quits it if the pool is disabled. uses is the number of slips the driver was used for during this checkout
+    """
+    if use_driver_pool:
+        get_driver_pool().release(driver, is_broken=is_broken, uses=uses)
+    else:
+        quit_chrome_driver(driver)
+
+def fetch_exit_ip(driver):
+    """
+    A function that navigates to ip.oxylabs.io (or exit_ip_url) to get the exit IP of the proxy
+    """
+    driver.get(exit_ip_url)
+    return re.search(r"[0-9].{2,}", driver.page_source).group()
+
+def get_origin(url):
+    """
+    A function that returns the origin of a URL (e.g., https://wafid.com for https://wafid.com/medical-status-search/)
+    """
+    parsed_url = urlparse(url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+def get_driver_pool():
+    """
+    A function that returns the web driver pool of the current crawling window and creates it if it does not exist yet
+    """
+    global driver_pool
+    with shared_services_lock:
+        if driver_pool is None:
+            driver_pool = WebDriverPool(
+                driver_factory=create_chrome_driver,
+                size=effective_n_jobs(parallel_jobs),
+                max_uses_per_driver=driver_max_uses,
+                reset_origins=[get_origin(base_url), get_origin(exit_ip_url)],
+                quit_func=quit_chrome_driver,
+                is_reusable=is_proxy_session_current
+            )
+    return driver_pool
+
+def shutdown_driver_pool():
+    """
+    A function that quits all the pooled Chrome browsers (e.g., when the crawling window closes)
+    """
+    global driver_pool
+    if driver_pool is not None:
+        driver_pool.shutdown()
+        driver_pool = None
+
+###-----------------------------###-----------------------------###
+
+def get_crawler_metrics():
+    """
+    A function that returns the crawler metrics and starts exporting them if they do not exist yet
+    """
+    global crawler_metrics
+    with shared_services_lock:
+        if crawler_metrics is None:
+            # Only the first process of the bot binds metrics_port and writes metrics_textfile_path, otherwise the worker processes would fight over them
+            is_exporter = os.environ.setdefault(metrics_exporter_variable, str(os.getpid())) == str(os.getpid())
+            crawler_metrics = CrawlerMetrics(
+                live_browsers_func=lambda: driver_pool.live_drivers if driver_pool is not None else 0,
+                telegram_send_latencies_func=lambda: telegram_notifier.send_latencies if telegram_notifier is not None else None
+            ).start(port=metrics_port if is_exporter else None, textfile_path=metrics_textfile_path if is_exporter else None)
+    return crawler_metrics
+
+def get_concurrency_controller():
     """
-    A function that solves the recaptcha V3 using the capmonster service
+    A function that returns the concurrency controller and starts adjusting the limit if it does not exist yet
     """
-    async def solve_captcha_async(num_requests):
-        tasks = [asyncio.create_task(cap_monster_client.solve_captcha(recaptcha3request)) 
-                for _ in range(num_requests)]
-        return await asyncio.gather(*tasks, return_exceptions=True)
+    global concurrency_controller
+    with shared_services_lock:
+        if concurrency_controller is None:
+            concurrency_controller = ConcurrencyController(
+                floor=min_concurrency,
+                ceiling=max_concurrency or effective_n_jobs(parallel_jobs),
+                initial_limit=initial_concurrency,
+                adjust_interval=concurrency_adjust_interval,
+                max_error_rate=max_slip_error_rate,
+                max_captcha_rejection_rate=max_captcha_rejection_rate,
+                min_available_memory=min_available_memory,
+                on_limit_change=on_concurrency_limit_change
+            ).start()
+    get_crawler_metrics().observe_concurrency_limit(concurrency_controller.limit)
+    return concurrency_controller
 
-    key = os.getenv('CAPMONSTER_KEY')
-    client_options = ClientOptions(api_key=key)
-    cap_monster_client = CapMonsterClient(options=client_options)
+def on_concurrency_limit_change(limit):
+    """
+    A function that exports the new concurrency limit and quits the idle pooled browsers above it
+    """
+    get_crawler_metrics().observe_concurrency_limit(limit)
+    if driver_pool is not None:
+        driver_pool.trim_idle(max_live_drivers=limit)
+
+def concurrency_slot():
+    """
+    A function that returns a context manager that holds a slot of the concurrency controller, or does nothing if the adaptive concurrency is off
+    """
+    return get_concurrency_controller().slot() if use_adaptive_concurrency else nullcontext()
+
+def observe_concurrency_event(slip_status=None, is_captcha_rejected=None):
+    """
+    A function that tells the concurrency controller that a slip finished with slip_status or that a submission was (or was not) rejected with the captcha message
+    """
+    if not use_adaptive_concurrency:
+        return
+    if slip_status is not None:
+        get_concurrency_controller().observe_slip(is_failure=slip_status not in ("found", "not_found"))
+    if is_captcha_rejected is not None:
+        get_concurrency_controller().observe_submission(is_captcha_rejected=is_captcha_rejected)
+
+def get_browser_supervisor():
+    """
+    A function that returns the browser supervisor and starts sampling the browsers if it does not exist yet
+    """
+    global browser_supervisor
+    with shared_services_lock:
+        if browser_supervisor is None:
+            browser_supervisor = BrowserSupervisor(max_rss=browser_max_rss, max_lifetime=browser_max_lifetime, sample_interval=browser_sample_interval).start()
+    return browser_supervisor
+
+def get_slip_tracer():
+    """
+    A function that returns the slip tracer and opens the trace file if it is not open yet
+    """
+    global slip_tracer
+    with shared_services_lock:
+        if slip_tracer is None:
+            slip_tracer = SlipTracer(trace_path=trace_path, is_enabled=use_tracing)
+    return slip_tracer
+
+def get_retry_policy():
+    """
+    A function that returns the retry policy and creates it if it does not exist yet
+    """
+    global retry_policy
+    with shared_services_lock:
+        if retry_policy is None:
+            retry_policy = RetryPolicy(max_requeues=max_requeues, budget=RetryBudget(retry_ratio=retry_budget_ratio, min_retries=min_retry_budget))
+    return retry_policy
+
+def get_result_store():
+    """
+    A function that returns the result store and opens the database if it is not open yet
+    """
+    global result_store
+    with shared_services_lock:
+        if result_store is None:
+            result_store = ResultStore(db_path=result_store_path)
+    return result_store
+
+###-----------------------------###-----------------------------###
+
+async def solve_capmonster_token():
+    """
+    A function that solves one recaptcha V3 using the capmonster service and returns the token
+    """
+    # Create the capmonster client once and reuse it for all the solves
+    global cap_monster_client
+    if cap_monster_client is None:
+        cap_monster_client = CapMonsterClient(options=ClientOptions(api_key=os.getenv('CAPMONSTER_KEY'), service_url=capmonster_service_url))
 
     recaptcha3request = RecaptchaV3ProxylessRequest(
-        websiteUrl="https://wafid.com/medical-status-search/",
-        websiteKey="6LflPAwnAAAAAL2wBGi6tSyGUyj-xFvftINOR9xp",
+        websiteUrl=base_url,
+        websiteKey=captcha_site_key,
         min_score=0.9
     )
+    captcha_response = await cap_monster_client.solve_captcha(recaptcha3request)
+    return captcha_response["gRecaptchaResponse"]
+
+async def solve_two_captcha_recaptcha():
+    """
+    A function that solves one recaptcha V3 using the 2captcha service and returns the token
+    """
+    return await solve_two_captcha_token(
+        api_key=os.getenv("TWO_CAPTCHA_KEY"),
+        website_url=base_url,
+        website_key=captcha_site_key,
+        min_score=0.9,
+        service_url=two_captcha_service_url
+    )
+
+def get_captcha_solver_router():
+    """
+    A function that returns the captcha solver router and creates it if it does not exist yet. It lives as long as the process so that the track record of the providers is kept
+    """
+    global captcha_solver_router
+    with shared_services_lock:
+        if captcha_solver_router is None:
+            solve_funcs = {"capmonster": solve_capmonster_token, "2captcha": solve_two_captcha_recaptcha}
+            captcha_solver_router = CaptchaSolverRouter(
+                providers=[
+                    CaptchaProvider(name=name.strip(), solve_func=solve_funcs[name.strip()], cost_per_1000=captcha_costs_per_1000[name.strip()])
+                    for name in captcha_providers
+                ],
+                mode=captcha_routing_mode
+            )
+    return captcha_solver_router
+
+async def solve_captcha_token():
+    """
+    A function that solves one recaptcha V3 with the best provider (racing the next one if it is slow) and returns the token
+    """
+    started_at = time.time()
+    try:
+        captcha_response = await get_captcha_solver_router().solve()
+    except Exception:
+        get_crawler_metrics().observe_captcha_solve(duration=time.time() - started_at, is_failure=True)
+        raise
+    get_crawler_metrics().observe_captcha_solve(duration=time.time() - started_at)
+    return captcha_response
+
+def get_captcha_token_pool():
+    """
+    A function that returns the captcha token pool of the current crawling window and starts it if it does not exist yet
+    """
+    global captcha_token_pool
+    with shared_services_lock:
+        if captcha_token_pool is None:
+            captcha_token_pool = CaptchaTokenPool(
+                solve_func=solve_captcha_token,
+                max_size=captcha_pool_max_size,
+                token_ttl=captcha_token_ttl
+            ).start()
+    return captcha_token_pool
 
-    nums = 3
+def stop_captcha_token_pool():
+    """
+    A function that stops solving captcha tokens in the background (e.g., when the crawling window closes)
+    """
+    global captcha_token_pool
+    if captcha_token_pool is not None:
+        logging.info(f"Stopping the captcha token pool. {captcha_token_pool.expired_tokens} tokens expired unused and {captcha_token_pool.failed_solves} solves failed")
+        captcha_token_pool.stop()
+        captcha_token_pool = None
+        logging.info(f"Captcha provider stats: {get_captcha_solver_router().stats()}")
 
-    # Async test
-    async_responses = asyncio.run(solve_captcha_async(nums))
-    captcha_response = async_responses[0]["gRecaptchaResponse"]
-    logging.info(f"Captcha response of {slip_number}: {captcha_response}")
+def solve_recaptcha(slip_number):
+    """
+    A function that returns a recaptcha V3 token. It is taken from the pre-solved token pool or solved on the spot if the pool is disabled
+    """
+    if use_captcha_token_pool:
+        captcha_response = get_captcha_token_pool().get_token()
+    else:
+        captcha_response = asyncio.run(solve_captcha_token())
+    logging.debug(f"Got a captcha token for slip number {slip_number}", extra={"is_verbose": True, "slip_number": slip_number}) # Never log the token itself
     return captcha_response
 
 ###-----------------------------###-----------------------------###
 
-# Create a class to store the Telegram bot information
-class TelegramBot:
-    def __init__(self, wafid_bot_token, wafid_chat_id, errors_bot_token, errors_bot_chat_id):
-        self.wafid_bot_token = wafid_bot_token
-        self.wafid_chat_id = wafid_chat_id
-        self.wafid_bot_obj = Bot(token=wafid_bot_token)
-        self.errors_bot_token = errors_bot_token
-        self.errors_bot_chat_id = errors_bot_chat_id
-        self.errors_bot_obj = Bot(token=errors_bot_token)
+def get_telegram_notifier():
+    """
+    A function that returns the Telegram notifier and starts it if it is not running yet. All the workers share it through a queue
+    """
+    global telegram_notifier
+    with shared_services_lock:
+        if telegram_notifier is None:
+            telegram_notifier = TelegramNotifier(
+                channels={
+                    "wafid": (Bot(token=os.getenv("WAFID_BOT_TOKEN")), os.getenv("WAFID_BOT_CHAT_ID")),
+                    "errors": (Bot(token=os.getenv("ERRORS_BOT_TOKEN")), os.getenv("ERRORS_BOT_CHAT_ID"))
+                },
+                digest_interval=telegram_digest_interval
+            ).start()
+    return telegram_notifier
 
-    # Function to send Telegram message
-    async def send_telegram_message(self, bot, chat_id, message):
-        await bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.MARKDOWN)
+def stop_telegram_notifier():
+    """
+    A function that sends the pending digest and messages and stops the Telegram notifier
+    """
+    global telegram_notifier
+    if telegram_notifier is not None:
+        telegram_notifier.stop()
+        telegram_notifier = None
 
 ###-----------------------------###-----------------------------###
 
 # Define a function to enter the GCC slip number and click on the "Check" button
 def gcc_enter_slip_number_func(driver, slip_number, is_randomize_waiting_time):
     """
-    A function to enter the GCC slip number and click on the "Check" button
+    A function to enter the GCC slip number and click on the "Check" button. Every submission gets a fresh captcha token because a token can only be used once.
+    A failed submission is retried on the same browser (after a backoff) as long as the retry policy allows it.
+    It returns the number of submissions and the failure class of the last one (None if the form was submitted successfully)
     """
-    # Solve the captcha
-    captcha_response = solve_capmonster_captcha(slip_number=slip_number)
-    
-    # Inject the response in the InnerHTML of g-recaptcha-response
-    driver.execute_script(f"document.getElementById('g-recaptcha-response').innerHTML='{captcha_response}'")
-
-    # Do the actions you want to do on the page
-    for idx in range(recaptcha_retries):
-        # Declare a waiting time based on the iteration number
-        if idx + 1 <= 5:
-            wait_time = 5 # 5 seconds
-        elif idx + 1 > 5 and idx + 1 <= 10:
-            wait_time = 7.5 # 7.5 seconds
-        else:
-            wait_time = 10 # 10 seconds
-
-        # Extract the captcha message. Don't use driver.find_element because it is slow
-        soup1 = BeautifulSoup(markup=driver.page_source, features="html.parser")
-        captcha_msg = soup1.select_one("input.g-recaptcha+p")
-        gcc_field_content = soup1.select_one("input[placeholder='Enter GCC Slip Number']").get_attribute_list("value")[0]
-        logging.info(f"captcha_msg of gcc_slipe_number_checker iteration {idx + 1} for slip number {slip_number}: {captcha_msg}")
-        logging.info(f"gcc_field_content of gcc_slipe_number_checker iteration {idx + 1} for slip number {slip_number}: {gcc_field_content}")
-
-        # If the captcha_msg is empty and gcc_field_content contains a number, this means that the form was submitted successfully and we can break out of the loop
-        # Otherwise, we need to clear the field and try inputting the form number again
-        if captcha_msg is None and gcc_field_content is not None:
-            break
-        else:
-            # Clear the form, re-enter the slip number and re-submit the form
+    tracer = get_slip_tracer()
+    for idx in itertools.count():
+        # Solve the captcha
+        with tracer.span("captcha_solve", attempt=idx):
+            captcha_response = solve_recaptcha(slip_number=slip_number)
+
+        # Inject the response in the InnerHTML of g-recaptcha-response
+        driver.execute_script(f"document.getElementById('g-recaptcha-response').innerHTML='{captcha_response}'")
+
+        # Clear the form and enter the slip number
+        with tracer.span("type_slip_number", attempt=idx):
             driver.find_element(by=By.XPATH, value="//input[@id='id_gcc_slip_no']").clear()
-            time.sleep(2.5)
             if is_randomize_waiting_time == True:
                 for char in str(slip_number):
                     driver.find_element(by=By.XPATH, value="//input[@id='id_gcc_slip_no']").send_keys(char)
                     time.sleep(random.uniform(0.5, 0.7)) # Generate a random number between 0.5 and 0.7
             else:
                 driver.find_element(by=By.XPATH, value="//input[@id='id_gcc_slip_no']").send_keys(slip_number)
-            time.sleep(wait_time)
 
-            # Submit the form (Clicking on the 'Check' button directly using this command does not always work --> driver.execute_script("document.getElementById('med-status-form-submit').click()"))
-            # The instructions of solving the invisible captcha were taken from this link --> https://captchaforum.com/threads/how-to-automatically-solve-invisible-recaptcha-v2.2055/
-            driver.execute_script("document.getElementsByClassName('ui form')[0].submit()")
-    return idx, captcha_msg
+        # Submit the form (Clicking on the 'Check' button directly using this command does not always work --> driver.execute_script("document.getElementById('med-status-form-submit').click()"))
+        # The instructions of solving the invisible captcha were taken from this link --> https://captchaforum.com/threads/how-to-automatically-solve-invisible-recaptcha-v2.2055/
+        # Instead of sleeping for a fixed time, wait until the new page shows the result or the captcha message
+        with tracer.span("submit", attempt=idx):
+            submit_outcome = submit_form_and_wait(driver=driver, submit_script="document.getElementsByClassName('ui form')[0].submit()", timeout=page_outcome_timeout)
 
-# Define a function to extract the medical center and send a Telegram notification
-def extract_medical_center_parallel(slip, slip_numbers_list):
+        # Extract the captcha message and the content of the GCC field in the browser. Don't use driver.find_element or driver.page_source because they are slow
+        with tracer.span("parse", attempt=idx):
+            page_state = extract_page_state_in_browser(driver)
+        logging.log(
+            logging.INFO if page_state.captcha_msg is not None else logging.DEBUG, # The rejected submissions are more interesting, so more of them are kept
+            f"Submission {idx + 1} of slip number {slip_number}: captcha_msg={page_state.captcha_msg}, gcc_field_content={page_state.gcc_field_value}",
+            extra={"is_verbose": True, "slip_number": slip_number, "attempt": idx + 1}
+        )
+        observe_concurrency_event(is_captcha_rejected=page_state.captcha_msg is not None)
+
+        # If the page changed, the captcha_msg is empty and gcc_field_content contains a number, this means that the form was submitted successfully.
+        # The page of the previous slip (in a batched session) also has a number in gcc_field_content, so a submission that did not navigate is never a success
+        if submit_outcome is not None and page_state.is_form_submitted:
+            return idx + 1, None
+
+        # Otherwise, resubmit the form on this browser or give the slip back so that it can be requeued to another browser and exit IP
+        failure_class = classify_page_state(page_state=page_state, submit_outcome=submit_outcome)
+        if not get_retry_policy().should_retry_on_session(failure_class=failure_class, session_attempts=idx + 1):
+            return idx + 1, failure_class
+        get_crawler_metrics().observe_retry(failure_class=failure_class, decision="resubmit")
+        get_retry_policy().wait(failure_class=failure_class, attempt=idx)
+
+# Define a function to send the result of a slip number to Telegram
+def send_slip_result_message(slip, iterations, output_dict):
     """
-    This is a function that extracts the medical center and sends a Telegram notification after the slip number has been successfully submitted.
-    Parameters of the function:
-    - driver: Chrome web driver
-    - slip: Current slip number
+    A function that logs the result of a slip number and sends it to Telegram.
+    output_dict is None if no records were found, otherwise it contains the slip_number, country and medical_center.
+    Found records are sent right away while "No records found" lines are rolled into the periodic digest
     """
-    # Instantiate the logger
-    logging.basicConfig(
-        level="INFO",
-        filename="wafid_bot_logs.log",
-        datefmt="%Y-%m-%d %H:%M:%S",
-        format="%(levelname)s - %(asctime)s - %(message)s",
-    )
+    if output_dict is None:
+        records_not_found_message = f"No records found for slip number {slip}. It took {iterations} iterations to submit the form successfully"
 
-    # Instantiate the Telegram bot class
-    tg_bot = TelegramBot(
-        wafid_bot_token = os.getenv("WAFID_BOT_TOKEN"),
-        wafid_chat_id = os.getenv("WAFID_BOT_CHAT_ID"),
-        errors_bot_token = os.getenv("ERRORS_BOT_TOKEN"),
-        errors_bot_chat_id = os.getenv("ERRORS_BOT_CHAT_ID")
-    )
-    
-    # Global inputs (4): Proxy credentials
-    PROXY_SERVICE_USERNAME = os.getenv("PROXY_SERVICE_USERNAME")
-    PROXY_SERVICE_PASSWORD = os.getenv("PROXY_SERVICE_PASSWORD")
-    PROXY_SERVICE_ENDPOINT = os.getenv("PROXY_SERVICE_ENDPOINT")
+        # Print a message saying that there was no record found for this slip number
+        logging.info(records_not_found_message)
 
-    # Define an event loop to manage and execute async tasks such as coroutines and callbacks and assign it to the parallel process using set_event_loop 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+        # Add a line saying that there was no record found for this slip number to the Telegram digest
+        get_telegram_notifier().add_to_digest(channel="wafid", line=records_not_found_message)
+    else:
+        # Print the output
+        logging.info(output_dict)
 
-    # If the slip number = the 90th element of slip_numbers_list, send a message informing the user that it is time to change the starting slip number
-    if slip == slip_numbers_list[close_to_end_of_cycle_index]:
-        loop.run_until_complete(tg_bot.send_telegram_message(
-                bot=tg_bot.wafid_bot_obj,
-                chat_id=tg_bot.wafid_chat_id,
-                message=f"*We reached slip number {close_to_end_of_cycle_index}. Please change the slip number now before another crawling cycle starts*"
-            ))
+        # Send a Telegram message saying that a record for that slip number was found
+        if output_dict["country"] == "Saudi Arabia":
+            output_dict_message = f"Records were found for slip number {slip}. It took {iterations} iterations to submit the form successfully. Info --> *{output_dict}*" # Bold the output
+        else:
+            output_dict_message = f"Records were found for slip number {slip}. It took {iterations} iterations to submit the form successfully. Info --> {output_dict}" # Normal text
+        get_telegram_notifier().notify(channel="wafid", message=output_dict_message)
 
-    try:
-        # Instantiate the web driver and set the implicit waiting time to be 60 seconds
-        proxies = chrome_proxy(PROXY_SERVICE_USERNAME, PROXY_SERVICE_PASSWORD, PROXY_SERVICE_ENDPOINT)
-        driver = webdriver.Chrome(options=chrome_options, seleniumwire_options=proxies)
-        driver.implicitly_wait(60)
+# Define a function to open the search form
+def load_search_form(driver):
+    """
+    A function that navigates to the medical status search page and selects the "Wafid Slip Number" search variant
+    """
+    tracer = get_slip_tracer()
 
-        # Navigate to ip.oxylabs.io to get the IP address
-        driver.get("https://ip.oxylabs.io/")
-        logging.info(f'\nYour IP is: {re.search(r"[0-9].{2,}", driver.page_source).group()}')
-        
-        # Navigate to the website
+    # Navigate to the website
+    with tracer.span("page_load"):
         driver.get(base_url)
 
+    with tracer.span("radio_button_wait"):
         # Wait for the "Wafid Slip Number" radio button and click on it
         WebDriverWait(driver, webdriver_waiting_time).until(EC.element_to_be_clickable((By.XPATH, "//input[@id='id_search_variant_1']")))
         driver.execute_script("document.getElementById('id_search_variant_1').click()")
@@ -277,117 +837,440 @@ def extract_medical_center_parallel(slip, slip_numbers_list):
         # Wait until the "GCC Slip NO" selector appears
         WebDriverWait(driver, webdriver_waiting_time).until(EC.presence_of_element_located((By.XPATH, "//input[@id='id_gcc_slip_no']")))
 
-        # Extract the HTML source code of the page with BeautifulSoup
-        soup2 = BeautifulSoup(markup=driver.page_source, features="html.parser")
-
-        # Extract the status message. It could be one of three options.
-        # Option 1 (Pass - The traveled_country_name and medical center can be extracted): Selector --> input[name='traveled_country__name']
-        # Option 2 (Pass - Records not found): Selector --> div.header
-        # Option 3 (Fail - revert back to captcha on the previous page): Selector --> input.g-recaptcha+p
-        status_message = soup2.select_one(selector="input[name='traveled_country__name'], div.header, input.g-recaptcha+p")
-        logging.info(f"status_message for slip number {slip}: {status_message}")
-
-        # Invoke the "gcc_enter_slip_number_func" function
-        idx, captcha_msg = gcc_enter_slip_number_func(driver=driver, slip_number=slip, is_randomize_waiting_time=True)
-
-        # If it is the last iteration and and the form was not submitted successfuly, send a message to Telegram saying that it was not possible to submit the form for this slip number
-        if idx + 1 == recaptcha_retries and captcha_msg is not None:
-            loop.run_until_complete(tg_bot.send_telegram_message(
-                bot=tg_bot.wafid_bot_obj,
-                chat_id=tg_bot.wafid_chat_id,
-                message=f"It was not possible to submit the form successfully for slip number {slip} after {idx + 1} times"
-            ))
-        
-        # Download the HTML content of the page and extract the status message again
-        soup3 = BeautifulSoup(markup=driver.page_source, features="html.parser")
-        status_message2 = soup3.select_one(selector="input[name='traveled_country__name'], div.header, input.g-recaptcha+p")
-        
-        # The result could either be "Records not found" pr "Medical Center found". Either way, send a Telegram message
-        if status_message2.get_text(strip=True) == "Records not found":
-            records_not_found_message = f"No records found for slip number {slip}. It took {idx + 1} iterations to submit the form successfully"
-
-            # Print a message saying that there was no record found for this slip number
-            logging.info(records_not_found_message)
-
-            # Send a Telegram message saying that there was no record found for this slip number
-            loop.run_until_complete(tg_bot.send_telegram_message(bot=tg_bot.wafid_bot_obj, chat_id=tg_bot.wafid_chat_id, message=records_not_found_message))
-        if status_message2.get_attribute_list("value")[0] is not None:
-            # Extract the fields of interest
-            output_dict = {
-                "slip_number": slip,
-                "country": soup3.select_one(selector="input[name='traveled_country__name']").get_attribute_list("value")[0],
-                "medical_center": soup3.select_one(selector="input[name='medical_center']").get_attribute_list("value")[0]
-            }
-
-            # Print the output
-            logging.info(output_dict)
-
-            # Send a Telegram message saying that a record for that slip number was found
-            if output_dict["country"] == "Saudi Arabia":
-                output_dict_message = f"Records were found for slip number {slip}. It took {idx + 1} iterations to submit the form successfully. Info --> *{output_dict}*" # Bold the output
-            else:
-                output_dict_message = f"Records were found for slip number {slip}. It took {idx + 1} iterations to submit the form successfully. Info --> {output_dict}" # Normal text
-            loop.run_until_complete(tg_bot.send_telegram_message(
-                bot=tg_bot.wafid_bot_obj,
-                chat_id=tg_bot.wafid_chat_id,
-                message=output_dict_message
-            ))
-        
-        # Close the driver to save memory
-        driver.quit()
+def reset_search_form(driver):
+    """
+    A function that prepares the page of the previous slip for the next one. The result page still has the search form, but the search variant goes back to "Passport",
+    so it is switched to "Wafid Slip Number" again. The page is only loaded again if the form is missing (e.g., after an error page)
+    """
+    with get_slip_tracer().span("form_reset"):
+        is_form_ready = driver.execute_script(reset_search_form_script)
+    if not is_form_ready:
+        load_search_form(driver)
+
+# Define a function to check out a browser
+def acquire_search_driver():
+    """
+    A function that checks out a web driver from the pool or launches a new one
+    """
+    with get_slip_tracer().span("driver_acquire"):
+        return get_driver_pool().acquire() if use_driver_pool else create_chrome_driver()
+
+# Define a function to open the search form on a browser
+def open_search_page(driver):
+    """
+    A function that checks the exit IP of the proxy session of a driver and opens the search form on it.
+    The traffic meter of the slip must be started before so that the IP check and the page load (the largest share of the proxy traffic) are counted
+    """
+    # Get the exit IP of the proxy session. It is only checked once per session instead of once per slip
+    with get_slip_tracer().span("ip_check"):
+        exit_ip = get_proxy_manager().get_exit_ip(session=driver.proxy_session, fetch_func=lambda: fetch_exit_ip(driver))
+    logging.info(f'\nYour IP is: {exit_ip}')
+    load_search_form(driver)
+
+def close_search_page(driver, is_broken, uses=1):
+    """
+    A function that returns the driver to the pool or closes it to save memory. uses is the number of slips that were looked up on the page
+    """
+    with get_slip_tracer().span("driver_release"):
+        release_chrome_driver(driver, is_broken=is_broken, uses=uses)
+
+def report_slip_outcome(driver, failure_class, latency):
+    """
+    A function that reports the outcome of a slip to the proxy manager. It returns True if the proxy session was rotated, in which case the driver must not be reused
+    """
+    return get_proxy_manager().report(
+        session=driver.proxy_session,
+        is_success=failure_class is None,
+        latency=latency,
+        is_captcha_failure=failure_class == "captcha_rejected",
+        is_proxy_failure=failure_class is not None and get_retry_policy().rules[failure_class].is_proxy_rotated
+    )
+
+# Define a function to look up one slip on a page that shows the search form
+def submit_slip_on_page(driver, slip, result):
+    """
+    A function that submits a slip on a page that shows the search form and fills in the status, country, medical_center and attempts of result.
+    It returns the failure class (None if the slip was resolved)
+    """
+    # Invoke the "gcc_enter_slip_number_func" function
+    submissions, failure_class = gcc_enter_slip_number_func(driver=driver, slip_number=slip, is_randomize_waiting_time=True)
+    result["attempts"] += submissions
+    if failure_class is not None:
+        return failure_class
+
+    # Extract the status message in the browser. It could be one of three options.
+    # Option 1 (Pass - The traveled_country_name and medical center can be extracted): Selector --> input[name='traveled_country__name']
+    # Option 2 (Pass - Records not found): Selector --> div.header
+    # Option 3 (Fail - revert back to captcha on the previous page): Selector --> input.g-recaptcha+p
+    with get_slip_tracer().span("parse"):
+        page_state = extract_page_state_in_browser(driver)
+    logging.info(f"status_message for slip number {slip}: {page_state}")
+    if page_state.status not in ("found", "not_found"):
+        return "unknown"
+    result.update(status=page_state.status, country=page_state.country, medical_center=page_state.medical_center)
+    return None
+
+def add_slip_usage(result, driver, traffic_meter):
+    """
+    A function that adds the traffic a browser made for a slip to the traffic of the slip (a slip can use several browsers if it is requeued)
+    and keeps the highest peak memory of the browsers the slip used
+    """
+    bytes_in, bytes_out = traffic_meter.stop()
+    if bytes_in is not None:
+        result["bytes_in"] = (result["bytes_in"] or 0) + bytes_in
+        result["bytes_out"] = (result["bytes_out"] or 0) + bytes_out
+    peak_rss = get_browser_supervisor().take_peak_rss(driver)
+    if peak_rss is not None:
+        result["browser_peak_rss"] = max(result["browser_peak_rss"] or 0, peak_rss)
+
+def add_page_load_share(result, page_load, is_page_closed):
+    """
+    A function that adds a share of the traffic of the IP check and the page load of a batched session to the traffic of a slip that was looked up on the page.
+    The traffic is split evenly across the slips of the chunk that are left, and the slip after which the page is closed takes the rest, so that the cycle total stays exact
+    """
+    if page_load["bytes_in"] is None:
+        return
+    slips = 1 if is_page_closed else max(page_load["slips_left"], 1)
+    bytes_in, bytes_out = page_load["bytes_in"] // slips, page_load["bytes_out"] // slips
+    page_load.update(bytes_in=page_load["bytes_in"] - bytes_in, bytes_out=page_load["bytes_out"] - bytes_out, slips_left=page_load["slips_left"] - 1)
+    result["bytes_in"] = (result["bytes_in"] or 0) + bytes_in
+    result["bytes_out"] = (result["bytes_out"] or 0) + bytes_out
+
+# Define a function to crawl a slip on one browser
+def crawl_slip_on_driver(slip, result):
+    """
+    A function that crawls a slip on one browser (checked out from the pool or launched) behind its proxy session and fills in the status, country, medical_center, attempts and traffic of result.
+    It returns the failure class of the attempt (None if the slip was resolved) and the exception that caused it (if any)
+    """
+    started_at = time.time()
+    driver = None
+    traffic_meter = None
+    failure_class = None
+    error = None
+    try:
+        driver = acquire_search_driver()
+        traffic_meter = SlipTrafficMeter(driver).start()
+        open_search_page(driver)
+        failure_class = submit_slip_on_page(driver=driver, slip=slip, result=result)
     except Exception as e:
-        # Quit the driver to not take up memory
-        driver.quit()
+        failure_class = classify_exception(e)
+        error = e
+        logging.exception(f"A {failure_class} error occurred while crawling the wafid bot for slip number {slip}: {e}")
+
+    # Add the traffic of this browser to the traffic of the slip and report the outcome to the proxy manager. The driver does not exist if the error occurred while launching it
+    if traffic_meter is not None:
+        add_slip_usage(result=result, driver=driver, traffic_meter=traffic_meter)
+    if driver is not None:
+        is_session_rotated = report_slip_outcome(driver=driver, failure_class=failure_class, latency=time.time() - started_at)
+        close_search_page(driver=driver, is_broken=failure_class is not None or is_session_rotated) # A browser that failed is not reused
+    return failure_class, error
+
+def requeue_failed_slip(slip, result, failure_class, error):
+    """
+    A function that crawls a failed slip again on other browsers (and exit IPs) as long as the retry policy and the retry budget of the cycle allow it.
+    It returns the failure class and the exception of the last attempt, and the number of times the slip was requeued
+    """
+    requeues = 0
+    while failure_class is not None:
+        if not get_retry_policy().should_requeue(failure_class=failure_class, requeues=requeues):
+            get_crawler_metrics().observe_retry(failure_class=failure_class, decision="give_up")
+            break
+        get_crawler_metrics().observe_retry(failure_class=failure_class, decision="requeue")
+        logging.info(f"Requeuing slip number {slip} to another browser after a {failure_class} failure")
+        get_retry_policy().wait(failure_class=failure_class, attempt=requeues)
+        requeues += 1
+        failure_class, error = crawl_slip_on_driver(slip=slip, result=result)
+    return failure_class, error, requeues
+
+def start_slip(slip, slip_numbers_list, cycle_id):
+    """
+    A function that sends the reminder to change the starting slip number if it is due, marks the slip as being crawled, and returns its empty result
+    """
+    # If the slip number = the 90th element of slip_numbers_list, send a message informing the user that it is time to change the starting slip number
+    if is_close_to_end_of_cycle(slip=slip, slip_numbers_list=slip_numbers_list):
+        get_telegram_notifier().notify(channel="wafid", message=f"*We reached slip number {close_to_end_of_cycle_index}. Please change the slip number now before another crawling cycle starts*")
+
+    # Mark the slip as being crawled so that it is crawled again if the process dies before it finishes
+    if cycle_id is not None:
+        get_result_store().record_started(slip_number=slip, cycle_id=cycle_id)
+    get_retry_policy().budget.record_slip()
+    return {"slip_number": slip, "status": "error", "country": None, "medical_center": None, "attempts": 0, "bytes_in": None, "bytes_out": None, "browser_peak_rss": None}
+
+def finish_slip(result, failure_class, error, requeues, started_at, cycle_id, slip_span):
+    """
+    A function that sends the result of a slip to Telegram, records it in the metrics and the trace, and stores it in the result store
+    """
+    slip = result["slip_number"]
+    tracer = get_slip_tracer()
 
+    # The result could either be "Records not found" pr "Medical Center found". Either way, send a Telegram message
+    if result["status"] == "not_found":
+        with tracer.span("notify"):
+            send_slip_result_message(slip=slip, iterations=result["attempts"], output_dict=None)
+    elif result["status"] == "found":
+        # Extract the fields of interest
+        output_dict = {
+            "slip_number": slip,
+            "country": result["country"],
+            "medical_center": result["medical_center"]
+        }
+        with tracer.span("notify"):
+            send_slip_result_message(slip=slip, iterations=result["attempts"], output_dict=output_dict)
+    elif failure_class == "captcha_rejected":
+        # Send a message to Telegram saying that it was not possible to submit the form for this slip number
+        result["status"] = "captcha_failure"
+        with tracer.span("notify"):
+            get_telegram_notifier().notify(channel="wafid", message=f"It was not possible to submit the form successfully for slip number {slip} after {result['attempts']} times")
+    else:
         # Send a message to the Telegram bot saying that an error occurred
-        logging.exception(f"An error occurred while crawling the wafid bot for slip number {slip}: {e}")
-        loop.run_until_complete(tg_bot.send_telegram_message(bot=tg_bot.errors_bot_obj, chat_id=tg_bot.errors_bot_chat_id, message=f"An error occurred while crawling the wafid bot: {e}"))
+        # Escape the failure class and the error text since they contain the "_", "*" and "[" characters of the Markdown syntax
+        get_telegram_notifier().notify(channel="errors", message=escape_markdown(f"An error occurred while crawling the wafid bot for slip number {slip} ({failure_class}): {error}"))
+    logging.info(f"Slip number {slip} downloaded {result['bytes_in']} bytes and uploaded {result['bytes_out']} bytes. The peak memory of its browser was {result['browser_peak_rss']} bytes")
+
+    # Store the result of the slip
+    finished_at = time.time()
+    slip_span.update(outcome=result["status"], attempts=result["attempts"], requeues=requeues)
+    get_crawler_metrics().observe_slip(status=result["status"], attempts=result["attempts"], duration=finished_at - started_at, browser_peak_rss=result["browser_peak_rss"])
+    observe_concurrency_event(slip_status=result["status"])
+    if cycle_id is not None:
+        get_result_store().record_result(cycle_id=cycle_id, started_at=started_at, finished_at=finished_at, **result)
+        if use_result_sink and parallel_backend == "threading": # With the loky backend, the workers are other processes, so the parent adds the results they return (see execute_all)
+            get_result_sink().add(result=result, finished_at=finished_at)
+
+# Define a function to extract the medical center and send a Telegram notification
+def extract_medical_center_parallel(slip, slip_numbers_list, cycle_id=None):
+    """
+    This is a function that extracts the medical center and sends a Telegram notification after the slip number has been successfully submitted.
+    If the slip fails on a browser, it is requeued to another browser (and exit IP) as long as the retry policy and the retry budget of the cycle allow it.
+    Parameters of the function:
+    - slip: Current slip number
+    - slip_numbers_list: The slip numbers of the current crawling cycle
+    - cycle_id: The ID of the crawling cycle in the result store. The result is not stored if it is None
+    It returns a dictionary with the slip_number, status, country, medical_center, attempts, bytes_in and bytes_out
+    """
+    # Send the log records of this worker to the log writer
+    setup_logging()
+
+    # Wait for a slot of the concurrency controller, and tag all the trace spans of this thread with the slip number until the slip is finished
+    tracer = get_slip_tracer()
+    with concurrency_slot(), tracer.slip_context(slip_number=slip, cycle_id=cycle_id), tracer.span("slip") as slip_span:
+        started_at = time.time()
+        result = start_slip(slip=slip, slip_numbers_list=slip_numbers_list, cycle_id=cycle_id)
+
+        # Crawl the slip and requeue it to another browser after a failure
+        failure_class, error = crawl_slip_on_driver(slip=slip, result=result)
+        failure_class, error, requeues = requeue_failed_slip(slip=slip, result=result, failure_class=failure_class, error=error)
+        finish_slip(result=result, failure_class=failure_class, error=error, requeues=requeues, started_at=started_at, cycle_id=cycle_id, slip_span=slip_span)
+        return result
 
-def execute_all():
+# Define a function to extract the medical centers of a chunk of slips on one loaded search page
+def extract_medical_centers_batched(slips, slip_numbers_list, cycle_id=None):
+    """
+    This is a function that looks up a chunk of slips one after the other on the same browser. The page is loaded and the search variant is selected once,
+    and every slip only clears, types, injects a token, submits, extracts, and resets the form. The result of every slip is stored and sent to Telegram as soon as it is known.
+    A slip that fails poisons the page, so the browser is replaced for the rest of the chunk and the failed slip is requeued on its own.
+    Parameters of the function:
+    - slips: The slip numbers of the chunk
+    - slip_numbers_list: The slip numbers of the current crawling cycle
+    - cycle_id: The ID of the crawling cycle in the result store. The results are not stored if it is None
+    It returns the list of the results of the slips (see extract_medical_center_parallel)
+    """
+    # Send the log records of this worker to the log writer
+    setup_logging()
+
+    tracer = get_slip_tracer()
+    results = []
+    driver = None
+    page_load = None # The traffic of the IP check and the page load of the current page that is not attributed to a slip yet, and the number of slips left to split it across
+    page_uses = 0 # The number of slips that were looked up on the current page. Every slip counts as one use of the driver in the pool
+
+    # Hold one slot of the concurrency controller for the whole chunk since the chunk uses one browser at a time
+    with concurrency_slot():
+        for index, slip in enumerate(slips):
+            # Tag all the trace spans of this thread with the slip number until the slip is finished
+            with tracer.slip_context(slip_number=slip, cycle_id=cycle_id), tracer.span("slip") as slip_span:
+                started_at = time.time()
+                result = start_slip(slip=slip, slip_numbers_list=slip_numbers_list, cycle_id=cycle_id)
+                page_meter = None
+                traffic_meter = None
+                error = None
+                try:
+                    # Open the search page for the first slip (or after a failure) and measure its traffic on its own. Otherwise, reuse the page of the previous slip
+                    if driver is None:
+                        driver = acquire_search_driver()
+                        page_uses = 0
+                        page_meter = SlipTrafficMeter(driver).start()
+                        open_search_page(driver)
+                        bytes_in, bytes_out = page_meter.stop()
+                        page_meter = None
+                        page_load = {"bytes_in": bytes_in, "bytes_out": bytes_out, "slips_left": len(slips) - index}
+                        traffic_meter = SlipTrafficMeter(driver).start()
+                    else:
+                        traffic_meter = SlipTrafficMeter(driver).start()
+                        reset_search_form(driver)
+                    page_uses += 1
+                    failure_class = submit_slip_on_page(driver=driver, slip=slip, result=result)
+                except Exception as e:
+                    failure_class = classify_exception(e)
+                    error = e
+                    logging.exception(f"A {failure_class} error occurred while crawling the wafid bot for slip number {slip}: {e}")
+                if page_meter is not None: # The page could not be opened, so its traffic belongs to this slip alone
+                    add_slip_usage(result=result, driver=driver, traffic_meter=page_meter)
+                if traffic_meter is not None:
+                    add_slip_usage(result=result, driver=driver, traffic_meter=traffic_meter)
+
+                # Report the outcome of the slip to the proxy manager. After a failure, the browser is replaced and the slip is requeued to another browser
+                if driver is not None:
+                    is_session_rotated = report_slip_outcome(driver=driver, failure_class=failure_class, latency=time.time() - started_at)
+                    is_page_closed = failure_class is not None or is_session_rotated
+                    if page_load is not None:
+                        add_page_load_share(result=result, page_load=page_load, is_page_closed=is_page_closed)
+                    if is_page_closed:
+                        close_search_page(driver=driver, is_broken=True, uses=max(page_uses, 1))
+                        driver = None
+                        page_load = None
+                failure_class, error, requeues = requeue_failed_slip(slip=slip, result=result, failure_class=failure_class, error=error)
+                finish_slip(result=result, failure_class=failure_class, error=error, requeues=requeues, started_at=started_at, cycle_id=cycle_id, slip_span=slip_span)
+                results.append(result)
+
+        # Return the driver to the pool or close it to save memory
+        if driver is not None:
+            close_search_page(driver=driver, is_broken=False, uses=page_uses)
+    return results
+
+def lookup_slips_with_http(slip_numbers_list, cycle_id=None):
+    """
+    A function that looks up the slip numbers with the browserless HTTP engine, sends the Telegram messages of the resolved slips,
+    and returns the slips that could not be resolved so that they are crawled with Selenium
+    """
+    # Route the HTTP requests through the best proxy session
+    proxy_session = get_proxy_manager().acquire()
+    started_at = time.time()
+    try:
+        http_results = asyncio.run(lookup_slips_http(
+            slip_numbers_list=slip_numbers_list,
+            solve_captcha_func=solve_recaptcha,
+            url=base_url,
+            proxy=proxy_session.url if proxy_mode != "direct" else None,
+            concurrency=http_lookup_concurrency
+        ))
+    finally:
+        get_proxy_manager().release(proxy_session)
+
+    unresolved_slips = []
+    for result in http_results:
+        slip = result["slip_number"]
+        if result["status"] not in ("found", "not_found"):
+            unresolved_slips.append(slip)
+            continue
+        get_crawler_metrics().observe_slip(status=result["status"], attempts=1)
+        if cycle_id is not None:
+            finished_at = time.time()
+            get_result_store().record_result(cycle_id=cycle_id, attempts=1, started_at=started_at, finished_at=finished_at, **result)
+            if use_result_sink:
+                get_result_sink().add(result={**result, "attempts": 1}, finished_at=finished_at)
+
+        # The Selenium path sends this reminder when it reaches the slip, so send it here for the slips that were resolved over HTTP
+        if is_close_to_end_of_cycle(slip=slip, slip_numbers_list=slip_numbers_list):
+            get_telegram_notifier().notify(channel="wafid", message=f"*We reached slip number {close_to_end_of_cycle_index}. Please change the slip number now before another crawling cycle starts*")
+
+        output_dict = {"slip_number": slip, "country": result["country"], "medical_center": result["medical_center"]} if result["status"] == "found" else None
+        send_slip_result_message(slip=slip, iterations=1, output_dict=output_dict)
+
+    logging.info(f"The HTTP engine resolved {len(slip_numbers_list) - len(unresolved_slips)} slips. Falling back to Selenium for {len(unresolved_slips)} slips")
+    return unresolved_slips
+
+def execute_all(slip_numbers_list=None):
     """
     A function to execute the functions defined above
     """
-    # Execute the google_sheet_reader function to get the slip number list
-    slip_numbers_list = google_sheet_reader()[0]
-    Parallel(n_jobs=parallel_jobs, verbose=13)(delayed(extract_medical_center_parallel)(slip=slip, slip_numbers_list=slip_numbers_list) for slip in slip_numbers_list)
+    # Start the log writer and the metrics exporter in this process before the workers (which may be other processes) need them
+    setup_logging()
+    get_crawler_metrics()
 
-if __name__ == "__main__":
+    # Get the slip number list from the Google Sheet (or the slip frontier) if it was not passed and no interrupted cycle is waiting to be resumed
+    if slip_numbers_list is None:
+        slip_numbers_list = get_result_store().unfinished_cycle_slips() or plan_slip_numbers()
+
+    # Start a new crawling cycle (or resume the one that was interrupted with the slips it planned) and skip the slips that are already resolved
+    cycle_id, slip_numbers_list = get_result_store().start_cycle(slip_numbers_list)
+    get_retry_policy().budget.reset()
+    slips_to_crawl = get_result_store().slips_to_crawl(cycle_id=cycle_id, slip_numbers_list=slip_numbers_list)
+
+    # If the HTTP lookup engine is selected, look up all the slips over HTTP first and only crawl the unresolved ones with Selenium
+    if lookup_engine == "http" and slips_to_crawl:
+        slips_to_crawl = lookup_slips_with_http(slip_numbers_list=slips_to_crawl, cycle_id=cycle_id)
+
+    # Crawl the slips in chunks on one loaded search page per worker, or one by one
+    if use_batched_sessions:
+        slip_chunks = [slips_to_crawl[i:i + session_batch_size] for i in range(0, len(slips_to_crawl), session_batch_size)]
+        chunk_results = Parallel(n_jobs=parallel_jobs, backend=parallel_backend, verbose=13)(delayed(extract_medical_centers_batched)(slips=slips, slip_numbers_list=slip_numbers_list, cycle_id=cycle_id) for slips in slip_chunks)
+        results = [result for results_of_chunk in chunk_results for result in results_of_chunk]
+    else:
+        results = Parallel(n_jobs=parallel_jobs, backend=parallel_backend, verbose=13)(delayed(extract_medical_center_parallel)(slip=slip, slip_numbers_list=slip_numbers_list, cycle_id=cycle_id) for slip in slips_to_crawl)
+
+    # The result sinks of loky worker processes would be lost when the workers are torn down, and they would race on the history files, so only this process writes the results
+    if use_result_sink and parallel_backend != "threading":
+        for result in results:
+            get_result_sink().add(result=result)
+    cycle_traffic = get_result_store().finish_cycle(cycle_id)
+    logging.info(f"Crawling cycle {cycle_id} downloaded {cycle_traffic['bytes_in']} bytes and uploaded {cycle_traffic['bytes_out']} bytes through the proxy")
+    logging.info(f"Retries of crawling cycle {cycle_id}: {get_retry_policy().stats()}")
+
+    # Kill the browsers that outlived their driver so that they don't pile up over the cycles
+    get_browser_supervisor().reap_orphans()
+    logging.info(f"Browsers at the end of crawling cycle {cycle_id}: {get_browser_supervisor().stats()}")
+
+def release_idle_resources():
+    """
+    A function that quits the pooled browsers, stops solving captcha tokens, and stops the Telegram notifier and the result sink (after sending the pending messages and results) while the bot is sleeping
+    """
+    shutdown_driver_pool()
+    get_browser_supervisor().reap_orphans()
+    stop_captcha_token_pool()
+    stop_telegram_notifier()
+    stop_result_sink()
+
+def run_forever(execute_cycle_func=execute_all):
+    """
+    A function that runs crawling cycles with execute_cycle_func (execute_all, or the coordinator of the distributed mode) whenever the crawling calendar allows it, and sleeps otherwise
+    """
+    # Start the log writer before the first cycle so that the lines of the scheduler and the planning are written too, and claim the metrics exporter for this process
+    setup_logging()
+    get_crawler_metrics()
+    crawl_scheduler = CrawlScheduler(
+        calendar=crawl_calendar,
+        timezone=crawl_timezone,
+        default_cycle_duration=default_cycle_duration,
+        safety_factor=cycle_duration_safety_factor
+    )
+    is_crawling = False
     while True:
-        # Get the current time in Dhaka
-        tz_Dhaka = pytz.timezone('Asia/Dhaka')
-        datetime_Dhaka = datetime.now(tz_Dhaka).strftime("%H")
-        if int(datetime_Dhaka) >= starting_local_time and int(datetime_Dhaka) <= ending_local_time:
-            # Execute the google_sheet_reader function to get the starting slip number
-            starting_slip_number = google_sheet_reader()[1]
-
-            # Instantiate the Telegram bot class
-            tg_bot = TelegramBot(
-                wafid_bot_token = os.getenv("WAFID_BOT_TOKEN"),
-                wafid_chat_id = os.getenv("WAFID_BOT_CHAT_ID"),
-                errors_bot_token = os.getenv("ERRORS_BOT_TOKEN"),
-                errors_bot_chat_id = os.getenv("ERRORS_BOT_CHAT_ID")
-            )
+        # Only start a cycle if the crawling window is open long enough for it to finish, based on how long the recent cycles took
+        estimated_cycle_duration = crawl_scheduler.estimate_cycle_duration(get_result_store().recent_cycle_durations(limit=cycle_history_len))
+        if crawl_scheduler.can_start_cycle(estimated_cycle_duration):
+            is_crawling = True
 
-            # Define the current event loop to manage and execute async tasks such as coroutines and callbacks
-            loop = asyncio.get_event_loop()
+            # Get the slip numbers of this cycle. A cycle that was interrupted (e.g., by a crash) is resumed with the slips it planned instead of a new plan
+            slip_numbers_list = get_result_store().unfinished_cycle_slips()
+            if slip_numbers_list is None:
+                slip_numbers_list = plan_slip_numbers()
 
-            # Send a message to the Telegram channel informing the user that a new crawling cycle has started
-            loop.run_until_complete(tg_bot.send_telegram_message(
-                bot=tg_bot.wafid_bot_obj,
-                chat_id=tg_bot.wafid_chat_id,
-                message=f"*A new crawling cycle is starting for slip {starting_slip_number}*"
-            ))
+                # Send a message to the Telegram channel informing the user that a new crawling cycle has started
+                get_telegram_notifier().notify(channel="wafid", message=f"*A new crawling cycle is starting for slip {slip_numbers_list[0]}*")
 
             # Execute the crawling
-            execute_all()
-
-            # If the crawling time frame passed, send a message to the channel informing that the bot will sleep until the next crawling window opens
-            if datetime_Dhaka in outside_crawling_hrs:
-                loop.run_until_complete(tg_bot.send_telegram_message(
-                    bot=tg_bot.wafid_bot_obj,
-                    chat_id=tg_bot.wafid_chat_id,
-                    message=f"*The crawling cycle of today finished. The bot will sleep until the next day*"
-                ))
-        else:
-            # Don't do anything
-            pass
+            execute_cycle_func(slip_numbers_list=slip_numbers_list)
+            continue
+
+        # The window closed (or there is not enough time left for another cycle). Send a message to the channel informing that the bot will sleep until the next crawling window opens
+        if is_crawling:
+            get_telegram_notifier().notify(channel="wafid", message=f"*The crawling cycles of this window finished. The bot will sleep until {crawl_scheduler.next_window_start():%A %H:%M}*")
+            is_crawling = False
+
+        # Make sure that no pooled browsers are left running and no captcha tokens are solved while sleeping
+        release_idle_resources()
+        crawl_scheduler.sleep_until_next_window()
+
+if __name__ == "__main__":
+    run_forever()
@@ -0,0 +1,305 @@
+# Import packages
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+# psutil is optional. Without it the browsers are not supervised and the memory of the slips is not measured
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# The command line switch that is added to every Chrome the bot launches, so that the browsers of a process can be told apart from other Chrome instances on the host
+owner_switch = "--wafid-owner-pid"
+
+def owner_argument(pid=None):
+    return f"{owner_switch}={pid or os.getpid()}"
+
+###-----------------------------###-----------------------------###
+
+# Create a class to store the processes of one supervised browser (chromedriver, Chrome and all their children)
+class SupervisedBrowser:
+    def __init__(self, root_pid):
+        self.root_pid = root_pid # The PID of chromedriver
+        self.registered_at = time.time()
+        self.processes = {} # PID --> psutil.Process. The objects are kept so that cpu_percent() measures the CPU time since the previous sample
+        self.rss = 0
+        self.peak_rss = 0 # The peak since the last call of take_peak_rss()
+        self.cpu_percent = 0.0
+        self.kill_reason = None
+
+# Create a class that tracks the process tree of every browser the bot launches, samples its memory (RSS) and CPU, kills the browsers that exceed
+# the memory ceiling or the wall-clock limit, and reaps the Chrome and chromedriver processes that outlived their driver
+class BrowserSupervisor:
+    def __init__(self, max_rss=1.5 * 1024 ** 3, max_lifetime=1800, sample_interval=5, profile_prefix="wafid-profile"):
+        """
+        - max_rss: The maximum resident memory in bytes of the process tree of one browser. A browser that uses more is killed
+        - max_lifetime: The maximum number of seconds a browser may run. A browser that runs longer (e.g., a hung renderer) is killed
+        - sample_interval: The number of seconds between two samples of the browsers
+        - profile_prefix: The prefix of the profile clones of ChromeProfileTemplate (<prefix>-<pid>-...). The Chrome processes that run on the clone of a process
+          that is not running anymore are reaped
+        """
+        self.max_rss = max_rss
+        self.max_lifetime = max_lifetime
+        self.sample_interval = sample_interval
+        self.profile_prefix = profile_prefix
+        self.is_enabled = psutil is not None
+        self.kills = Counter() # Reason --> the number of browsers killed for it
+        self.reaped_processes = 0
+        self._browsers = {} # id(driver) --> SupervisedBrowser
+        self._lock = threading.Lock()
+        self._is_stopped = threading.Event()
+        self._sampler_thread = None
+        if not self.is_enabled:
+            logging.warning("psutil is not installed. The browsers will not be supervised")
+
+    ###-----------------------------###-----------------------------###
+    # Browsers
+
+    def register(self, driver):
+        """
+        A function that starts supervising the process tree of a driver that was just launched
+        """
+        if not self.is_enabled:
+            return
+        browser = SupervisedBrowser(root_pid=driver.service.process.pid)
+        self._sample_browser(browser)
+        with self._lock:
+            self._browsers[id(driver)] = browser
+
+    def unregister(self, driver):
+        """
+        A function that stops supervising a driver after it was quit and kills the processes of its tree that are still running (e.g., a Chrome that did not exit)
+        """
+        if not self.is_enabled:
+            return
+        with self._lock:
+            browser = self._browsers.pop(id(driver), None)
+        if browser is None:
+            return
+        survivors = [process for process in browser.processes.values() if is_running(process)]
+        if survivors:
+            logging.warning(f"Killing {len(survivors)} processes of the browser {browser.root_pid} that were still running after it was quit")
+            kill_processes(survivors)
+            self.reaped_processes += len(survivors)
+
+    def take_peak_rss(self, driver):
+        """
+        A function that returns the peak memory in bytes of the process tree of a driver since the last call (i.e., during the current slip), or None if it is not supervised
+        """
+        with self._lock:
+            browser = self._browsers.get(id(driver))
+        if browser is None:
+            return None
+        self._sample_browser(browser)
+        with self._lock:
+            peak_rss = browser.peak_rss
+            browser.peak_rss = browser.rss
+        return peak_rss
+
+    # Function to refresh the process tree of a browser and sum its memory and CPU. Processes that exited since the previous sample are dropped
+    def _sample_browser(self, browser):
+        try:
+            root_process = browser.processes.get(browser.root_pid) or psutil.Process(browser.root_pid)
+            tree = [root_process] + root_process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            tree = []
+        processes = {process.pid: browser.processes.get(process.pid, process) for process in tree} # Keep the known objects for cpu_percent()
+        rss = 0
+        cpu_percent = 0.0
+        for process in processes.values():
+            try:
+                rss += process.memory_info().rss
+                cpu_percent += process.cpu_percent()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        with self._lock:
+            # Keep the processes of the previous samples that are still running so that they can be killed even if they were re-parented (e.g., after chromedriver died)
+            browser.processes = {**{pid: process for pid, process in browser.processes.items() if is_running(process)}, **processes}
+            browser.rss = rss
+            browser.peak_rss = max(browser.peak_rss, rss)
+            browser.cpu_percent = cpu_percent
+
+    def sample(self):
+        """
+        A function that samples every browser and kills the ones that use more than max_rss bytes or run longer than max_lifetime seconds.
+        The driver of a killed browser fails on its next command, so the slip it was crawling is classified as a WebDriver crash and requeued
+        """
+        with self._lock:
+            browsers = list(self._browsers.values())
+        for browser in browsers:
+            if browser.kill_reason is not None:
+                continue
+            self._sample_browser(browser)
+            if browser.rss > self.max_rss:
+                browser.kill_reason = "memory"
+            elif time.time() - browser.registered_at > self.max_lifetime:
+                browser.kill_reason = "lifetime"
+            else:
+                continue
+            logging.warning(f"Killing the browser {browser.root_pid} because of its {browser.kill_reason}: {browser.rss / 1024 ** 2:.0f} MB, {browser.cpu_percent:.0f}% CPU, "
+                            f"running for {time.time() - browser.registered_at:.0f} seconds")
+            kill_processes(list(browser.processes.values()))
+            with self._lock:
+                self.kills[browser.kill_reason] += 1
+
+    def reap_orphans(self):
+        """
+        A function that kills the Chrome processes of this bot that no supervised driver owns, and the chromedriver processes whose parent died that launched one of them.
+        Only the main Chrome process has the owner switch, so its renderer, GPU and utility processes are matched by the process tree (a descendant of an orphaned
+        Chrome) or by the profile directory in their command line (a clone of a process that is not running anymore, or the profile of an orphaned Chrome).
+        Chrome processes of other bot processes on the same host are only killed if the process that launched them is not running anymore
+        """
+        if not self.is_enabled:
+            return 0
+        # Sample the browsers first so that the children they launched since the last sample count as supervised
+        with self._lock:
+            browsers = list(self._browsers.values())
+        for browser in browsers:
+            self._sample_browser(browser)
+        with self._lock:
+            supervised_pids = {pid for browser in self._browsers.values() for pid in browser.processes}
+
+        username = psutil.Process().username()
+        processes = {} # PID --> psutil.Process of the processes of this user
+        for process in psutil.process_iter(["pid", "name", "ppid", "username", "cmdline"]):
+            if process.info["username"] == username:
+                processes[process.info["pid"]] = process
+
+        def is_dead_or_own(pid):
+            return pid is not None and (pid == os.getpid() or not psutil.pid_exists(pid))
+
+        def ancestors(pid):
+            seen = set()
+            while pid in processes and pid not in seen:
+                seen.add(pid)
+                yield processes[pid]
+                pid = processes[pid].info["ppid"]
+
+        # The main Chrome processes that lost their driver, and the profiles they run on
+        orphaned_roots = set()
+        orphaned_profiles = set()
+        for pid, process in processes.items():
+            cmdline = process.info["cmdline"] or []
+            if pid not in supervised_pids and "chrom" in (process.info["name"] or "").lower() and is_dead_or_own(find_owner_pid(cmdline)):
+                orphaned_roots.add(pid)
+                orphaned_profiles.add(find_profile_dir(cmdline))
+        orphaned_profiles.discard(None)
+
+        orphaned_browsers = []
+        for pid, process in processes.items():
+            name = (process.info["name"] or "").lower()
+            if pid in supervised_pids or "chrom" not in name or name == "chromedriver":
+                continue
+            tree = list(ancestors(pid))
+            if any(ancestor.pid in supervised_pids for ancestor in tree):
+                continue
+            profile_dir = find_profile_dir(process.info["cmdline"] or [])
+            if (any(ancestor.pid in orphaned_roots for ancestor in tree) or profile_dir in orphaned_profiles
+                    or is_dead_or_own(find_profile_owner_pid(profile_dir, self.profile_prefix))):
+                orphaned_browsers.append(process)
+
+        # A chromedriver whose parent died is only reaped if it launched one of the orphaned browsers. The other ones may belong to other tools or test runs on the host
+        orphaned_browser_pids = {process.pid for process in orphaned_browsers}
+        orphaned_drivers = [
+            process for pid, process in processes.items()
+            if pid not in supervised_pids and (process.info["name"] or "").lower() == "chromedriver" and process.info["ppid"] == 1
+            and any(child.info["ppid"] == pid and child.pid in orphaned_browser_pids for child in processes.values())
+        ]
+        orphans = orphaned_browsers + orphaned_drivers
+        if orphans:
+            logging.warning(f"Reaping {len(orphans)} orphaned Chrome and chromedriver processes")
+            kill_processes(orphans)
+            self.reaped_processes += len(orphans)
+        return len(orphans)
+
+    def stats(self):
+        """
+        A function that returns the number of supervised browsers, their total memory, and the number of browsers and processes that were killed
+        """
+        with self._lock:
+            browsers = list(self._browsers.values())
+        return {
+            "browsers": len(browsers),
+            "browser_rss": sum(browser.rss for browser in browsers),
+            "browser_cpu_percent": sum(browser.cpu_percent for browser in browsers),
+            "killed_for_memory": self.kills["memory"],
+            "killed_for_lifetime": self.kills["lifetime"],
+            "reaped_processes": self.reaped_processes
+        }
+
+    ###-----------------------------###-----------------------------###
+    # Background sampling
+
+    def start(self):
+        if not self.is_enabled:
+            return self
+        self._sampler_thread = threading.Thread(target=self._sample_periodically, name="browser-supervisor", daemon=True)
+        self._sampler_thread.start()
+        return self
+
+    def _sample_periodically(self):
+        while not self._is_stopped.wait(timeout=self.sample_interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logging.warning(f"Sampling the browsers failed: {e}")
+
+    def stop(self):
+        self._is_stopped.set()
+        if self._sampler_thread is not None:
+            self._sampler_thread.join(timeout=5)
+
+###-----------------------------###-----------------------------###
+
+def find_owner_pid(cmdline):
+    """
+    A function that returns the PID in the owner switch of a Chrome command line, or None if it is not a browser of the bot
+    """
+    for argument in cmdline:
+        if argument.startswith(f"{owner_switch}="):
+            try:
+                return int(argument.split("=", 1)[1])
+            except ValueError:
+                return None
+    return None
+
+def find_profile_dir(cmdline):
+    """
+    A function that returns the profile directory (--user-data-dir) of a Chrome command line, or None if it has none
+    """
+    for argument in cmdline:
+        if argument.startswith("--user-data-dir="):
+            return os.path.normpath(argument.split("=", 1)[1])
+    return None
+
+def find_profile_owner_pid(profile_dir, profile_prefix):
+    """
+    A function that returns the PID of the process that created a profile clone (named <profile_prefix>-<pid>-<id>), or None if the directory is not a clone
+    """
+    name = os.path.basename(profile_dir or "")
+    if not name.startswith(f"{profile_prefix}-"):
+        return None
+    try:
+        return int(name[len(profile_prefix) + 1:].split("-")[0])
+    except ValueError:
+        return None
+
+def is_running(process):
+    try:
+        return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+def kill_processes(processes, timeout=5):
+    """
+    A function that kills processes (SIGKILL, since a browser that is over its limits may not react to SIGTERM) and waits until they are gone
+    """
+    for process in processes:
+        try:
+            process.kill()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    psutil.wait_procs(processes, timeout=timeout)
@@ -0,0 +1,136 @@
+# Import packages
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+###-----------------------------###-----------------------------###
+
+# Create a class that keeps a bounded pool of pre-solved reCAPTCHA tokens that the workers can take instantly
+class CaptchaTokenPool:
+    def __init__(self, solve_func, min_size=1, max_size=10, token_ttl=100, max_parallel_solves=5, consumption_window=300):
+        """
+        - solve_func: An async function without arguments that solves one reCAPTCHA and returns the token
+        - min_size: The number of tokens that are kept ready even when nobody is consuming them
+        - max_size: The maximum number of tokens (ready + being solved) so that we don't pay for tokens that will expire unused
+        - token_ttl: The number of seconds after which a token is evicted. reCAPTCHA tokens expire after 120 seconds, so keep a safety margin
+        - max_parallel_solves: The maximum number of captcha tasks that run at the same time
+        - consumption_window: The number of seconds over which the consumption rate is measured
+        """
+        self.solve_func = solve_func
+        self.min_size = min_size
+        self.max_size = max_size
+        self.token_ttl = token_ttl
+        self.max_parallel_solves = max_parallel_solves
+        self.consumption_window = consumption_window
+        self._tokens = deque() # (solved_at, token) pairs with the oldest token on the left
+        self._consumed_at = deque() # Timestamps of the tokens that were handed out
+        self._solve_latencies = deque(maxlen=20) # The durations of the most recent solves
+        self._waiting_workers = 0
+        self._in_flight_solves = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._is_stopped = threading.Event()
+        self.expired_tokens = 0 # The number of paid tokens that expired before being used
+        self.failed_solves = 0
+
+    def start(self):
+        """
+        A function that starts the background token producer
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=lambda: asyncio.run(self._produce()), name="captcha-token-pool", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        A function that stops the background token producer and drops the tokens that are left in the pool
+        """
+        self._is_stopped.set()
+        with self._condition:
+            self._tokens.clear()
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def get_token(self, timeout=180):
+        """
+        A function that returns the freshest valid token. It blocks until a token is solved if the pool is empty
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            self._waiting_workers += 1
+            try:
+                while True:
+                    self._evict_expired_tokens()
+                    if self._tokens:
+                        solved_at, token = self._tokens.pop() # The freshest token has the most time left before it expires
+                        self._consumed_at.append(time.time())
+                        return token
+                    if self._is_stopped.is_set():
+                        raise RuntimeError("The captcha token pool was stopped")
+                    remaining_time = deadline - time.time()
+                    if remaining_time <= 0:
+                        raise TimeoutError(f"No captcha token was solved within {timeout} seconds")
+                    self._condition.wait(timeout=min(remaining_time, 1))
+            finally:
+                self._waiting_workers -= 1
+
+    # Function to drop the tokens that reCAPTCHA will reject soon. Must be called while holding the condition
+    def _evict_expired_tokens(self):
+        now = time.time()
+        while self._tokens and now - self._tokens[0][0] > self.token_ttl:
+            self._tokens.popleft()
+            self.expired_tokens += 1
+        while self._consumed_at and now - self._consumed_at[0] > self.consumption_window:
+            self._consumed_at.popleft()
+
+    # Function to decide how many tokens should be ready or in flight based on the observed consumption rate. Must be called while holding the condition
+    def _target_size(self):
+        consumption_rate = len(self._consumed_at) / self.consumption_window # Tokens per second
+        solve_latency = sum(self._solve_latencies) / len(self._solve_latencies) if self._solve_latencies else 20
+
+        # Keep enough tokens to cover the consumption during one solve, but not more than can be consumed before they expire
+        target_size = math.ceil(consumption_rate * solve_latency * 1.5)
+        target_size = min(target_size, math.ceil(consumption_rate * self.token_ttl))
+        target_size = max(target_size, self.min_size, self._waiting_workers)
+        return min(target_size, self.max_size)
+
+    async def _solve_one(self):
+        started_at = time.time()
+        try:
+            token = await self.solve_func()
+        except Exception as e:
+            self.failed_solves += 1
+            logging.warning(f"Pre-solving a captcha token failed: {e}")
+            await asyncio.sleep(1) # Don't hammer the captcha service if it is down
+            with self._condition:
+                self._in_flight_solves -= 1
+            return
+
+        with self._condition:
+            self._in_flight_solves -= 1
+            self._solve_latencies.append(time.time() - started_at)
+            self._tokens.append((time.time(), token))
+            self._condition.notify()
+
+    async def _produce(self):
+        tasks = set()
+        while not self._is_stopped.is_set():
+            with self._condition:
+                self._evict_expired_tokens()
+                missing_tokens = self._target_size() - len(self._tokens) - self._in_flight_solves
+                new_solves = max(0, min(missing_tokens, self.max_parallel_solves - self._in_flight_solves))
+                self._in_flight_solves += new_solves
+            for _ in range(new_solves):
+                task = asyncio.create_task(self._solve_one())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.sleep(0.2)
+
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,220 @@
+# Import packages
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+import aiohttp
+import numpy as np
+
+###-----------------------------###-----------------------------###
+
+async def solve_two_captcha_token(api_key, website_url, website_key, min_score=0.9, service_url="https://api.2captcha.com", poll_interval=3, timeout=180):
+    """
+    A function that solves one reCAPTCHA V3 with the createTask/getTaskResult API of 2Captcha and returns the token.
+    It is async (unlike the twocaptcha package) so that the task can be cancelled when another provider wins the race
+    """
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+        task = {"type": "RecaptchaV3TaskProxyless", "websiteURL": website_url, "websiteKey": website_key, "minScore": min_score}
+        async with session.post(f"{service_url}/createTask", json={"clientKey": api_key, "task": task}) as response:
+            created_task = await response.json(content_type=None)
+        if created_task.get("errorId") != 0:
+            raise RuntimeError(f"2Captcha could not create the task: [{created_task.get('errorCode')}] {created_task.get('errorDescription')}")
+
+        while time.time() < deadline:
+            await asyncio.sleep(poll_interval)
+            async with session.post(f"{service_url}/getTaskResult", json={"clientKey": api_key, "taskId": created_task["taskId"]}) as response:
+                task_result = await response.json(content_type=None)
+            if task_result.get("errorId") != 0:
+                raise RuntimeError(f"2Captcha could not solve the task: [{task_result.get('errorCode')}] {task_result.get('errorDescription')}")
+            if task_result.get("status") == "ready":
+                return task_result["solution"]["gRecaptchaResponse"]
+    raise TimeoutError(f"2Captcha did not solve the task within {timeout} seconds")
+
+###-----------------------------###-----------------------------###
+
+# Create a class that wraps one captcha service and keeps its track record (latency, failure rate and cost)
+class CaptchaProvider:
+    def __init__(self, name, solve_func, cost_per_1000=1.0, history_len=50):
+        """
+        - name: The name of the provider (e.g., "capmonster")
+        - solve_func: An async function without arguments that solves one reCAPTCHA V3 and returns the token
+        - cost_per_1000: The price of 1000 reCAPTCHA V3 tokens in USD
+        - history_len: The number of recent solves the latency and the failure rate are computed from
+        """
+        self.name = name
+        self.solve_func = solve_func
+        self.cost_per_1000 = cost_per_1000
+        self.latencies = deque(maxlen=history_len) # The durations of the recent successful solves
+        self.outcomes = deque(maxlen=history_len) # True for a success and False for a failure
+        self.started_tasks = 0
+        self.won_races = 0
+        self.cancelled_tasks = 0
+        self._lock = threading.Lock()
+
+    @property
+    def failure_rate(self):
+        """
+        The failure rate of the recent solves, with one prior success and one prior failure so that a new provider is neither trusted nor written off
+        """
+        with self._lock:
+            return (self.outcomes.count(False) + 1) / (len(self.outcomes) + 2)
+
+    def latency_percentile(self, percentile, default=20):
+        """
+        A function that returns the percentile of the latencies of the recent solves in seconds, or default if the provider did not solve any captcha yet
+        """
+        with self._lock:
+            return float(np.percentile(self.latencies, percentile)) if self.latencies else default
+
+    @property
+    def estimated_spend(self):
+        """
+        An upper bound of the money spent in USD. Every started task is counted because a cancelled task may still be solved and billed by the provider
+        """
+        return self.started_tasks * self.cost_per_1000 / 1000
+
+    def score(self, cost_weight):
+        """
+        The expected number of seconds to get one valid token (median latency divided by the success rate) plus cost_weight seconds per USD cent of one token. Lower is better
+        """
+        return self.latency_percentile(50) / (1 - self.failure_rate) + cost_weight * self.cost_per_1000 / 10
+
+    def count(self, event):
+        """
+        A function that counts a "started", "won" or "cancelled" task
+        """
+        with self._lock:
+            if event == "started":
+                self.started_tasks += 1
+            elif event == "won":
+                self.won_races += 1
+            elif event == "cancelled":
+                self.cancelled_tasks += 1
+
+    def record(self, is_success, latency=None):
+        with self._lock:
+            self.outcomes.append(is_success)
+            if is_success and latency is not None:
+                self.latencies.append(latency)
+
+    def stats(self):
+        return {
+            "p50_latency": self.latency_percentile(50),
+            "p90_latency": self.latency_percentile(90),
+            "failure_rate": self.failure_rate,
+            "started_tasks": self.started_tasks,
+            "won_races": self.won_races,
+            "cancelled_tasks": self.cancelled_tasks,
+            "estimated_spend": self.estimated_spend
+        }
+
+    def __repr__(self):
+        return f"CaptchaProvider(name={self.name}, p50_latency={self.latency_percentile(50):.1f}, failure_rate={self.failure_rate:.2f})"
+
+# Create a class that routes every captcha job to the best provider and hedges with the next best provider when the favoured one is slow.
+# The first valid token wins and the tasks of the other providers are cancelled. If a provider fails, the next one is started right away
+class CaptchaSolverRouter:
+    def __init__(self, providers, mode="hedge", hedge_percentile=90, min_hedge_delay=5, cost_weight=1.0):
+        """
+        - providers: The CaptchaProvider objects
+        - mode: "hedge" starts the next provider only when the favoured one takes longer than its usual latency, "race" starts all the providers at once, "single" never hedges (but still fails over)
+        - hedge_percentile: The percentile of the favoured provider's latency after which the next provider is started
+        - min_hedge_delay: The minimum number of seconds to wait before hedging so that the second provider is not paid for too often
+        - cost_weight: How many seconds of latency one USD cent per token is worth when ranking the providers
+        """
+        if not providers:
+            raise ValueError("At least one captcha provider is needed")
+        self.providers = providers
+        self.mode = mode
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.cost_weight = cost_weight
+
+    def ranked_providers(self):
+        """
+        A function that returns the providers from the best to the worst score
+        """
+        return sorted(self.providers, key=lambda provider: provider.score(self.cost_weight))
+
+    async def _solve_with(self, provider):
+        provider.count("started")
+        started_at = time.time()
+        try:
+            token = await provider.solve_func()
+        except asyncio.CancelledError:
+            provider.count("cancelled")
+            raise
+        except Exception:
+            provider.record(is_success=False)
+            raise
+        if not token:
+            provider.record(is_success=False)
+            raise ValueError(f"{provider.name} returned an empty token")
+        provider.record(is_success=True, latency=time.time() - started_at)
+        return token
+
+    async def solve(self):
+        """
+        A function that returns one reCAPTCHA V3 token from whichever provider delivers a valid one first
+        """
+        waiting_providers = deque(self.ranked_providers())
+        running_tasks = {} # task --> provider
+        errors = []
+        hedge_at = None # The time the next provider is started if nothing was solved until then. It counts from the start of the last provider
+
+        def start_next_provider():
+            nonlocal hedge_at
+            provider = waiting_providers.popleft()
+            running_tasks[asyncio.ensure_future(self._solve_with(provider))] = provider
+            # A provider without history hedges after min_hedge_delay instead of the default latency, so that the next provider gets solves to build its history from
+            hedge_delay = max(provider.latency_percentile(self.hedge_percentile, default=self.min_hedge_delay), self.min_hedge_delay)
+            hedge_at = time.time() + hedge_delay
+
+        start_next_provider()
+        if self.mode == "race":
+            while waiting_providers:
+                start_next_provider()
+        try:
+            while running_tasks:
+                timeout = max(hedge_at - time.time(), 0) if self.mode == "hedge" and waiting_providers else None
+                done_tasks, pending_tasks = await asyncio.wait(running_tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                # Hedge: the last provider is slower than usual, so start the next provider in parallel
+                if not done_tasks:
+                    logging.info(f"{list(running_tasks.values())[-1].name} did not solve the captcha in time. Racing it with {waiting_providers[0].name}")
+                    start_next_provider()
+                    continue
+
+                # Retrieve the result or the exception of every finished task (so that asyncio does not log "Task exception was never retrieved") before returning the winner
+                token = None
+                for task in done_tasks:
+                    provider = running_tasks.pop(task)
+                    if task.exception() is None:
+                        if token is None:
+                            provider.count("won")
+                            token = task.result()
+                        continue
+                    errors.append(f"{provider.name}: {task.exception()}")
+                    logging.warning(f"Solving the captcha with {provider.name} failed: {task.exception()}")
+                if token is not None:
+                    return token
+
+                # Fail over: the provider failed, so start the next one right away if nothing else is running
+                if not running_tasks and waiting_providers:
+                    start_next_provider()
+        finally:
+            # Cancel the tasks that lost the race and wait until they are cancelled
+            for task in running_tasks:
+                task.cancel()
+            if running_tasks:
+                await asyncio.gather(*running_tasks, return_exceptions=True)
+        raise RuntimeError(f"All the captcha providers failed: {errors}")
+
+    def stats(self):
+        """
+        A function that returns the track record of every provider as a dictionary of name --> stats
+        """
+        return {provider.name: provider.stats() for provider in self.providers}
@@ -0,0 +1,148 @@
+# Import packages
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+# The Chrome switches that keep a profile warm. The first-run dialogs, the default browser check and the component updates (which download and unpack
+# components at every startup of a fresh profile) are turned off
+warm_profile_arguments = [
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-component-update",
+    "--disable-sync",
+    "--disable-default-apps"
+]
+
+# The files that are not copied into a clone. The Singleton* files lock a profile to one running Chrome, and the rest is rebuilt by Chrome or is not needed to start fast
+clone_ignore_patterns = ("Singleton*", "*.lock", "lockfile", "Crashpad", "BrowserMetrics*", "GrShaderCache", "ShaderCache", "GraphiteDawnCache", "component_crx_cache", "optimization_guide_model_store")
+
+def default_clone_root():
+    """
+    A function that returns /dev/shm (tmpfs, so the clones live in memory and never touch the disk) if it exists, or the temporary directory otherwise
+    """
+    return "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+
+###-----------------------------###-----------------------------###
+
+# Create a class that builds a warmed Chrome user data directory once (first run done, component updates off, the static assets of the site in the HTTP cache)
+# and hands out a throwaway copy of it on tmpfs for every new browser, so that the browsers don't start from an empty profile
+class ChromeProfileTemplate:
+    def __init__(self, template_dir, warm_func, clone_root=None, max_age=86400, clone_prefix="wafid-profile"):
+        """
+        - template_dir: The directory the warmed profile is kept in between runs
+        - warm_func: A function that takes a user data directory, launches Chrome on it, loads the pages whose assets should be cached, and quits Chrome
+        - clone_root: The directory the clones are created in (/dev/shm by default)
+        - max_age: The number of seconds after which the template is built again so that the cached assets don't go stale
+        - clone_prefix: The prefix of the names of the clones. The process ID is added so that the clones of crashed processes can be found and deleted
+        """
+        self.template_dir = template_dir
+        self.warm_func = warm_func
+        self.clone_root = clone_root or default_clone_root()
+        self.max_age = max_age
+        self.clone_prefix = clone_prefix
+        self._lock = threading.Lock()
+
+    @property
+    def built_at(self):
+        """
+        The time the template was built, or None if there is no complete template
+        """
+        try:
+            with open(os.path.join(self.template_dir, ".wafid_built_at")) as file:
+                return float(file.read())
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self):
+        return self.built_at is not None and time.time() - self.built_at < self.max_age
+
+    def build(self):
+        """
+        A function that warms a new profile in a temporary directory next to template_dir and swaps it in, so that other processes never see a half-built template
+        """
+        started_at = time.time()
+        parent_dir = os.path.dirname(os.path.abspath(self.template_dir))
+        os.makedirs(parent_dir, exist_ok=True)
+        building_dir = tempfile.mkdtemp(prefix=".building-", dir=parent_dir)
+        try:
+            self.warm_func(building_dir)
+
+            # Drop the files a clone does not need so that cloning copies as little as possible
+            for root, dir_names, file_names in os.walk(building_dir, topdown=True):
+                ignored_names = shutil.ignore_patterns(*clone_ignore_patterns)(root, dir_names + file_names)
+                for name in ignored_names:
+                    path = os.path.join(root, name)
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+                dir_names[:] = [name for name in dir_names if name not in ignored_names]
+            with open(os.path.join(building_dir, ".wafid_built_at"), "w") as file:
+                file.write(str(time.time()))
+
+            # Swap the new template in. The old one is renamed first because a directory cannot be replaced by a rename if it is not empty
+            old_template_dir = f"{building_dir}.old"
+            if os.path.exists(self.template_dir):
+                os.rename(self.template_dir, old_template_dir)
+            os.rename(building_dir, self.template_dir)
+            shutil.rmtree(old_template_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(building_dir, ignore_errors=True)
+            raise
+        logging.info(f"Built the Chrome profile template in {self.template_dir} in {time.time() - started_at:.1f} seconds ({directory_size(self.template_dir) / 1024 ** 2:.1f} MB)")
+
+    def ensure_built(self):
+        """
+        A function that builds the template if it does not exist or is too old. Only one thread builds it, the others wait
+        """
+        with self._lock:
+            if not self.is_fresh():
+                self.build()
+
+    def clone(self):
+        """
+        A function that copies the template into a new directory under clone_root and returns its path. The clone must be deleted with remove() after Chrome quit
+        """
+        self.ensure_built()
+        clone_dir = os.path.join(self.clone_root, f"{self.clone_prefix}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        shutil.copytree(self.template_dir, clone_dir, symlinks=True, ignore=shutil.ignore_patterns(*clone_ignore_patterns))
+        return clone_dir
+
+    def remove(self, clone_dir):
+        shutil.rmtree(clone_dir, ignore_errors=True)
+
+    def remove_stale_clones(self):
+        """
+        A function that deletes the clones that were left behind by processes that are not running anymore (e.g., after a crash)
+        """
+        for name in os.listdir(self.clone_root):
+            if not name.startswith(f"{self.clone_prefix}-"):
+                continue
+            try:
+                pid = int(name[len(self.clone_prefix) + 1:].split("-")[0])
+            except ValueError:
+                continue
+            if not is_process_alive(pid):
+                logging.info(f"Deleting the Chrome profile {name} that was left behind by process {pid}")
+                self.remove(os.path.join(self.clone_root, name))
+
+###-----------------------------###-----------------------------###
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def directory_size(path):
+    """
+    A function that returns the number of bytes of all the files under path
+    """
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, file_names in os.walk(path) for name in file_names if not os.path.islink(os.path.join(root, name)))
@@ -0,0 +1,161 @@
+# Import packages
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# psutil is optional. Without it the host memory is not taken into account
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+###-----------------------------###-----------------------------###
+
+# Create a class that limits the number of slips (or chunks of slips) that are crawled at the same time and adjusts the limit at runtime with AIMD
+# (additive increase, multiplicative decrease). Every adjust_interval seconds it looks at what happened since the previous adjustment:
+# - The limit is cut by decrease_factor if the host is short of memory, or if too many slips failed or too many submissions were rejected with the captcha message
+# - It goes back down by one if the previous increase made the throughput drop although all the slots were used (and not because the work ran out)
+# - It goes up by one if all the slots were in use (so more parallelism could help)
+# The workers run as threads that are started with the ceiling and wait for a slot in slot()
+class ConcurrencyController:
+    def __init__(self, floor=1, ceiling=8, initial_limit=None, adjust_interval=30, decrease_factor=0.7, max_error_rate=0.2, max_captcha_rejection_rate=0.3,
+                 min_available_memory=1024 ** 3, min_samples=5, on_limit_change=None):
+        """
+        - floor, ceiling: The minimum and maximum number of slips in flight
+        - initial_limit: The limit to start with (the floor by default)
+        - adjust_interval: The number of seconds between two adjustments
+        - decrease_factor: The limit is multiplied by this factor when it is cut
+        - max_error_rate: The share of finished slips that may fail before the limit is cut
+        - max_captcha_rejection_rate: The share of form submissions that may be rejected with the captcha message before the limit is cut
+        - min_available_memory: The number of bytes of available host memory below which the limit is cut (and never increased)
+        - min_samples: The minimum number of finished slips or submissions before the rates are trusted
+        - on_limit_change: An optional function that is called with the new limit after every change (e.g., to quit the idle browsers above the limit)
+        """
+        self.floor = floor
+        self.ceiling = max(ceiling, floor)
+        self.limit = min(max(initial_limit or floor, floor), self.ceiling)
+        self.adjust_interval = adjust_interval
+        self.decrease_factor = decrease_factor
+        self.max_error_rate = max_error_rate
+        self.max_captcha_rejection_rate = max_captcha_rejection_rate
+        self.min_available_memory = min_available_memory
+        self.min_samples = min_samples
+        self.on_limit_change = on_limit_change
+        self.in_flight = 0
+        self._peak_in_flight = 0 # The highest number of slips in flight since the previous adjustment
+        self._events = Counter() # The finished slips, failed slips, submissions and captcha rejections since the previous adjustment
+        self._window_started_at = time.time()
+        self._previous_throughput = None
+        self._last_action = None
+        self._condition = threading.Condition()
+        self._is_stopped = threading.Event()
+        self._adjust_thread = None
+
+    ###-----------------------------###-----------------------------###
+    # Slots
+
+    @contextmanager
+    def slot(self):
+        """
+        A context manager that waits until fewer than limit slips are in flight and holds a slot while the block runs
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify()
+
+    def observe_slip(self, is_failure):
+        """
+        A function that records a finished slip
+        """
+        with self._condition:
+            self._events["slips"] += 1
+            if is_failure:
+                self._events["failed_slips"] += 1
+
+    def observe_submission(self, is_captcha_rejected):
+        """
+        A function that records a form submission
+        """
+        with self._condition:
+            self._events["submissions"] += 1
+            if is_captcha_rejected:
+                self._events["captcha_rejections"] += 1
+
+    ###-----------------------------###-----------------------------###
+    # Adjustments
+
+    def is_short_of_memory(self):
+        return psutil is not None and psutil.virtual_memory().available < self.min_available_memory
+
+    def _set_limit(self, limit, reason):
+        limit = min(max(limit, self.floor), self.ceiling)
+        if limit == self.limit:
+            return
+        logging.info(f"Changing the concurrency limit from {self.limit} to {limit} ({reason})")
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+        if self.on_limit_change is not None:
+            self.on_limit_change(limit)
+
+    def adjust(self):
+        """
+        A function that looks at the slips and submissions since the previous adjustment and changes the limit. It returns the action that was taken
+        """
+        with self._condition:
+            events = self._events
+            peak_in_flight = self._peak_in_flight
+            elapsed = time.time() - self._window_started_at
+            self._events = Counter()
+            self._peak_in_flight = self.in_flight
+            self._window_started_at = time.time()
+        throughput = events["slips"] / elapsed * 60 if elapsed > 0 else 0 # Slips per minute
+        error_rate = events["failed_slips"] / events["slips"] if events["slips"] >= self.min_samples else 0
+        captcha_rejection_rate = events["captcha_rejections"] / events["submissions"] if events["submissions"] >= self.min_samples else 0
+
+        if self.is_short_of_memory():
+            action = "decrease"
+            self._set_limit(int(self.limit * self.decrease_factor), reason="the host is short of memory")
+        elif error_rate > self.max_error_rate:
+            action = "decrease"
+            self._set_limit(int(self.limit * self.decrease_factor), reason=f"{error_rate:.0%} of the slips failed")
+        elif captcha_rejection_rate > self.max_captcha_rejection_rate:
+            action = "decrease"
+            self._set_limit(int(self.limit * self.decrease_factor), reason=f"{captcha_rejection_rate:.0%} of the submissions were rejected with the captcha message")
+        elif self._last_action == "increase" and peak_in_flight >= self.limit and self._previous_throughput and throughput < 0.95 * self._previous_throughput:
+            action = "step_back"
+            self._set_limit(self.limit - 1, reason=f"the throughput dropped from {self._previous_throughput:.1f} to {throughput:.1f} slips per minute")
+        elif peak_in_flight >= self.limit:
+            action = "increase"
+            self._set_limit(self.limit + 1, reason=f"all the slots were used at {throughput:.1f} slips per minute")
+        else:
+            action = "hold"
+        self._previous_throughput = throughput
+        self._last_action = action
+        return action
+
+    def start(self):
+        self._adjust_thread = threading.Thread(target=self._adjust_periodically, name="concurrency-controller", daemon=True)
+        self._adjust_thread.start()
+        return self
+
+    def _adjust_periodically(self):
+        while not self._is_stopped.wait(timeout=self.adjust_interval):
+            try:
+                self.adjust()
+            except Exception as e:
+                logging.warning(f"Adjusting the concurrency limit failed: {e}")
+
+    def stop(self):
+        self._is_stopped.set()
+        if self._adjust_thread is not None:
+            self._adjust_thread.join(timeout=5)
@@ -0,0 +1,113 @@
+# Import packages
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+weekday_names = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+###-----------------------------###-----------------------------###
+
+def parse_calendar(calendar_spec):
+    """
+    A function that turns a JSON calendar into a dictionary of weekday (0 = Monday) --> list of (start, end) windows as "HH:MM" strings.
+    The keys are weekday names ("mon", ..., "sun") or "default" for the days that are not listed, e.g.,
+    {"default": [["10:00", "22:00"]], "fri": [["14:00", "18:00"], ["19:00", "22:00"]], "sun": []}.
+    A window whose end is not after its start (e.g., ["22:00", "02:00"]) ends on the next day
+    """
+    calendar_spec = json.loads(calendar_spec) if isinstance(calendar_spec, str) else calendar_spec
+    unknown_days = set(calendar_spec) - set(weekday_names) - {"default"}
+    if unknown_days:
+        raise ValueError(f"Unknown days in the crawling calendar: {sorted(unknown_days)}")
+    default_windows = calendar_spec.get("default", [])
+    return {weekday: [tuple(window) for window in calendar_spec.get(day_name, default_windows)] for weekday, day_name in enumerate(weekday_names)}
+
+# Create a class that decides when the bot may crawl. It knows the crawling windows of every weekday in the local time zone,
+# only lets a cycle start if it is expected to finish before the window closes, and sleeps until the next window opens
+class CrawlScheduler:
+    def __init__(self, calendar, timezone="Asia/Dhaka", default_cycle_duration=900, safety_factor=1.2, max_sleep_chunk=300):
+        """
+        - calendar: The output of parse_calendar
+        - timezone: The time zone the windows are in
+        - default_cycle_duration: The number of seconds a cycle is assumed to take when there is no history yet
+        - safety_factor: The estimated cycle duration is multiplied by this factor before it is compared with the time left in the window
+        - max_sleep_chunk: The sleep is split into chunks of at most this many seconds so that clock changes (e.g., after a suspend) are noticed
+        """
+        self.calendar = calendar
+        self.timezone = pytz.timezone(timezone)
+        self.default_cycle_duration = default_cycle_duration
+        self.safety_factor = safety_factor
+        self.max_sleep_chunk = max_sleep_chunk
+
+    def now(self):
+        return datetime.now(self.timezone)
+
+    # Function to return the windows of the day of `day` (and the ones of the day before that run past midnight) as (start, end) datetimes
+    def _windows_around(self, day):
+        windows = []
+        for offset in (-1, 0):
+            window_day = day + timedelta(days=offset)
+            for start, end in self.calendar[window_day.weekday()]:
+                start_at = self.timezone.localize(datetime.combine(window_day, datetime.strptime(start, "%H:%M").time()))
+                end_at = self.timezone.localize(datetime.combine(window_day, datetime.strptime(end, "%H:%M").time()))
+                if end_at <= start_at:
+                    end_at = self.timezone.localize(datetime.combine(window_day + timedelta(days=1), datetime.strptime(end, "%H:%M").time()))
+                windows.append((start_at, end_at))
+        return sorted(windows)
+
+    def current_window(self, now=None):
+        """
+        A function that returns the (start, end) of the window that is open now, or None if the bot is outside the crawling windows
+        """
+        now = now or self.now()
+        for start_at, end_at in self._windows_around(now.date()):
+            if start_at <= now < end_at:
+                return start_at, end_at
+        return None
+
+    def next_window_start(self, now=None):
+        """
+        A function that returns the start of the next window that opens after now
+        """
+        now = now or self.now()
+        for offset in range(8):
+            for start_at, end_at in self._windows_around(now.date() + timedelta(days=offset)):
+                if start_at > now:
+                    return start_at
+        raise ValueError("The crawling calendar does not have any window")
+
+    def estimate_cycle_duration(self, recent_cycle_durations):
+        """
+        A function that estimates how long the next cycle takes from the durations (in seconds) of the recent cycles. The 90th percentile is used so that a slow cycle is rarely underestimated
+        """
+        if not recent_cycle_durations:
+            return self.default_cycle_duration
+        return float(np.percentile(recent_cycle_durations, 90))
+
+    def can_start_cycle(self, estimated_cycle_duration, now=None):
+        """
+        A function that checks whether a window is open and has enough time left for a cycle of estimated_cycle_duration seconds.
+        A cycle that is longer than the whole window may still start during the first 10% of the window
+        """
+        now = now or self.now()
+        window = self.current_window(now)
+        if window is None:
+            return False
+        start_at, end_at = window
+        required_time = min(estimated_cycle_duration * self.safety_factor, 0.9 * (end_at - start_at).total_seconds())
+        return (end_at - now).total_seconds() >= required_time
+
+    def sleep_until_next_window(self):
+        """
+        A function that sleeps until the next window opens
+        """
+        next_window_start = self.next_window_start()
+        logging.info(f"Sleeping until the next crawling window opens at {next_window_start}")
+        while True:
+            seconds_left = (next_window_start - self.now()).total_seconds()
+            if seconds_left <= 0:
+                return
+            time.sleep(min(seconds_left, self.max_sleep_chunk))
@@ -0,0 +1,356 @@
+# Import packages
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List
+
+create_tables_sql = """
+CREATE TABLE IF NOT EXISTS shards (
+    shard_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cycle_id INTEGER NOT NULL,
+    slip_numbers TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker_id TEXT,
+    lease_expires_at REAL,
+    claims INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shards_status ON shards (status, lease_expires_at);
+CREATE INDEX IF NOT EXISTS shards_cycle_id ON shards (cycle_id, status);
+CREATE TABLE IF NOT EXISTS shard_results (
+    cycle_id INTEGER NOT NULL,
+    slip_number INTEGER NOT NULL,
+    shard_id INTEGER NOT NULL,
+    worker_id TEXT NOT NULL,
+    result TEXT NOT NULL,
+    reported_at REAL NOT NULL,
+    is_collected INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (cycle_id, slip_number)
+);
+"""
+
+###-----------------------------###-----------------------------###
+
+def connect(db_path):
+    """
+    A function that opens the shard database. It uses the default rollback journal instead of WAL because WAL does not work on network file systems (e.g., NFS)
+    """
+    connection = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False) # isolation_level=None so that the transactions are started explicitly
+    connection.executescript(create_tables_sql)
+    return connection
+
+@contextmanager
+def immediate_transaction(connection):
+    """
+    A context manager that takes the write lock of the database right away so that two hosts cannot claim the same shard
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+# Create a class to store a shard a worker claimed
+@dataclass
+class Shard:
+    shard_id: int
+    cycle_id: int
+    slip_numbers: List[int]
+
+###-----------------------------###-----------------------------###
+
+# Create a class that splits the slips of a cycle into shards in a SQLite database on shared storage, waits for the workers to crawl them, and collects the results.
+# A shard is leased to one worker at a time. If the worker stops sending heartbeats, the lease expires and another worker claims the shard
+class ShardCoordinator:
+    def __init__(self, db_path, shard_size=5, max_claims=3):
+        """
+        - db_path: The path of the shard database. All the hosts must see the same file
+        - shard_size: The number of slips in one shard
+        - max_claims: A shard is marked as failed after it was claimed this many times without being completed (e.g., it crashes every worker)
+        """
+        self.db_path = db_path
+        self.shard_size = shard_size
+        self.max_claims = max_claims
+        self._connection = connect(db_path)
+        self._lock = threading.Lock()
+
+    def publish_cycle(self, cycle_id, slip_numbers_list):
+        """
+        A function that splits the slips of a cycle into shards. The slips that are already in a shard of the cycle (i.e., the cycle is being resumed) are not published again
+        """
+        with self._lock, immediate_transaction(self._connection):
+            published_slips = set()
+            for (slip_numbers,) in self._connection.execute("SELECT slip_numbers FROM shards WHERE cycle_id = ?", (cycle_id,)):
+                published_slips.update(json.loads(slip_numbers))
+            new_slips = [int(slip) for slip in slip_numbers_list if int(slip) not in published_slips]
+            for i in range(0, len(new_slips), self.shard_size):
+                self._connection.execute(
+                    "INSERT INTO shards (cycle_id, slip_numbers, updated_at) VALUES (?, ?, ?)",
+                    (cycle_id, json.dumps(new_slips[i:i + self.shard_size]), time.time())
+                )
+        logging.info(f"Published {len(new_slips)} slips of cycle {cycle_id} in shards of {self.shard_size}")
+
+    def reassign_expired_leases(self):
+        """
+        A function that gives the shards whose lease expired back to the other workers, or marks them as failed after max_claims claims. It returns the number of reassigned shards
+        """
+        with self._lock, immediate_transaction(self._connection):
+            expired_shards = self._connection.execute(
+                "SELECT shard_id, worker_id, claims FROM shards WHERE status = 'leased' AND lease_expires_at < ?", (time.time(),)
+            ).fetchall()
+            for shard_id, worker_id, claims in expired_shards:
+                status = "failed" if claims >= self.max_claims else "pending"
+                logging.warning(f"The lease of shard {shard_id} held by {worker_id} expired. The shard is now {status}")
+                self._connection.execute(
+                    "UPDATE shards SET status = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ? WHERE shard_id = ?",
+                    (status, time.time(), shard_id)
+                )
+        return len(expired_shards)
+
+    def cancel_pending_shards(self, cycle_id):
+        """
+        A function that cancels the shards of a cycle that no worker claimed yet (e.g., when the crawling window closes). It returns their slips
+        """
+        with self._lock, immediate_transaction(self._connection):
+            rows = self._connection.execute("SELECT slip_numbers FROM shards WHERE cycle_id = ? AND status = 'pending'", (cycle_id,)).fetchall()
+            self._connection.execute("UPDATE shards SET status = 'cancelled', updated_at = ? WHERE cycle_id = ? AND status = 'pending'", (time.time(), cycle_id))
+        return [slip for (slip_numbers,) in rows for slip in json.loads(slip_numbers)]
+
+    def is_cycle_done(self, cycle_id):
+        """
+        A function that checks whether all the shards of a cycle were completed or failed
+        """
+        with self._lock:
+            open_shards = self._connection.execute(
+                "SELECT COUNT(*) FROM shards WHERE cycle_id = ? AND status IN ('pending', 'leased')", (cycle_id,)
+            ).fetchone()[0]
+        return open_shards == 0
+
+    def collect_results(self, cycle_id):
+        """
+        A function that returns the results of a cycle that were reported since the last call, as dictionaries
+        """
+        with self._lock, immediate_transaction(self._connection):
+            rows = self._connection.execute(
+                "SELECT slip_number, result, reported_at FROM shard_results WHERE cycle_id = ? AND is_collected = 0", (cycle_id,)
+            ).fetchall()
+            self._connection.execute("UPDATE shard_results SET is_collected = 1 WHERE cycle_id = ? AND is_collected = 0", (cycle_id,))
+        return [{**json.loads(result), "reported_at": reported_at} for slip_number, result, reported_at in rows]
+
+    def failed_slips(self, cycle_id):
+        """
+        A function that returns the slips of the failed shards of a cycle that no worker reported a result for
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT slip_numbers FROM shards WHERE cycle_id = ? AND status = 'failed'", (cycle_id,)).fetchall()
+            reported_slips = {row[0] for row in self._connection.execute("SELECT slip_number FROM shard_results WHERE cycle_id = ?", (cycle_id,))}
+        return [slip for (slip_numbers,) in rows for slip in json.loads(slip_numbers) if slip not in reported_slips]
+
+# Create a class that claims shards from the shard database, keeps their lease alive with heartbeats, and reports the result of every slip
+class ShardWorker:
+    def __init__(self, db_path, worker_id=None, lease_duration=180, max_claims=3):
+        """
+        - db_path: The path of the shard database. All the hosts must see the same file
+        - worker_id: A unique name of the worker. The host name and the PID are used by default
+        - lease_duration: The number of seconds a claim is valid without a heartbeat. The heartbeats are sent every third of it
+        - max_claims: A shard whose lease expired is marked as failed instead of being claimed again after it was claimed this many times (see ShardCoordinator)
+        """
+        self.db_path = db_path
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_duration = lease_duration
+        self.max_claims = max_claims
+        self._connection = connect(db_path)
+        self._lock = threading.Lock()
+
+    def claim_shard(self):
+        """
+        A function that leases the oldest pending shard (or a shard whose lease expired) to this worker. It returns None if there is nothing to crawl.
+        The expired shards that were already claimed max_claims times are marked as failed first, so that a shard that crashes every worker is not retried forever
+        """
+        with self._lock, immediate_transaction(self._connection):
+            self._connection.execute(
+                "UPDATE shards SET status = 'failed', worker_id = NULL, lease_expires_at = NULL, updated_at = ? WHERE status = 'leased' AND lease_expires_at < ? AND claims >= ?",
+                (time.time(), time.time(), self.max_claims)
+            )
+            row = self._connection.execute(
+                """
+                SELECT shard_id, cycle_id, slip_numbers FROM shards
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_expires_at < ?)) AND claims < ?
+                ORDER BY shard_id LIMIT 1
+                """,
+                (time.time(), self.max_claims)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE shards SET status = 'leased', worker_id = ?, lease_expires_at = ?, claims = claims + 1, updated_at = ? WHERE shard_id = ?",
+                (self.worker_id, time.time() + self.lease_duration, time.time(), row[0])
+            )
+        logging.info(f"Worker {self.worker_id} claimed shard {row[0]} of cycle {row[1]}")
+        return Shard(shard_id=row[0], cycle_id=row[1], slip_numbers=json.loads(row[2]))
+
+    def heartbeat(self, shard):
+        """
+        A function that extends the lease of a shard. It returns False if the lease was lost (i.e., the shard was given to another worker)
+        """
+        with self._lock, immediate_transaction(self._connection):
+            cursor = self._connection.execute(
+                "UPDATE shards SET lease_expires_at = ?, updated_at = ? WHERE shard_id = ? AND worker_id = ? AND status = 'leased'",
+                (time.time() + self.lease_duration, time.time(), shard.shard_id, self.worker_id)
+            )
+        return cursor.rowcount == 1
+
+    @contextmanager
+    def keep_lease(self, shard):
+        """
+        A context manager that sends heartbeats for a shard in a background thread. The event it yields is set if the lease was lost
+        """
+        is_stopped, is_lease_lost = threading.Event(), threading.Event()
+
+        def send_heartbeats():
+            while not is_stopped.wait(timeout=self.lease_duration / 3):
+                try:
+                    if not self.heartbeat(shard):
+                        logging.warning(f"Worker {self.worker_id} lost the lease of shard {shard.shard_id}")
+                        is_lease_lost.set()
+                        return
+                except sqlite3.Error as e:
+                    logging.warning(f"The heartbeat of shard {shard.shard_id} failed: {e}")
+
+        heartbeat_thread = threading.Thread(target=send_heartbeats, name=f"shard-{shard.shard_id}-heartbeat", daemon=True)
+        heartbeat_thread.start()
+        try:
+            yield is_lease_lost
+        finally:
+            is_stopped.set()
+            heartbeat_thread.join(timeout=5)
+
+    def report_result(self, shard, result):
+        """
+        A function that reports the result dictionary of one slip (as returned by extract_medical_center_parallel)
+        """
+        with self._lock, immediate_transaction(self._connection):
+            self._connection.execute(
+                """
+                INSERT INTO shard_results (cycle_id, slip_number, shard_id, worker_id, result, reported_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (cycle_id, slip_number) DO UPDATE SET
+                    shard_id = excluded.shard_id, worker_id = excluded.worker_id, result = excluded.result, reported_at = excluded.reported_at, is_collected = 0
+                """,
+                (shard.cycle_id, int(result["slip_number"]), shard.shard_id, self.worker_id, json.dumps(result, default=str), time.time())
+            )
+
+    def complete_shard(self, shard):
+        """
+        A function that marks a shard as done if this worker still holds its lease
+        """
+        with self._lock, immediate_transaction(self._connection):
+            self._connection.execute(
+                "UPDATE shards SET status = 'done', lease_expires_at = NULL, updated_at = ? WHERE shard_id = ? AND worker_id = ? AND status = 'leased'",
+                (time.time(), shard.shard_id, self.worker_id)
+            )
+
+###-----------------------------###-----------------------------###
+# Command line
+
+def run_coordinator(db_path, shard_size, poll_interval):
+    """
+    A function that runs the crawling cycles like the standalone bot, but publishes the slips as shards and waits for the workers instead of crawling them itself.
+    A cycle stops when the crawling window closes, even if the workers did not crawl all its shards (e.g., because no worker is running)
+    """
+    import wafid_bot_selenium_parallel as bot
+    from telegram.helpers import escape_markdown
+    from wafid_crawl_scheduler import CrawlScheduler
+    coordinator = ShardCoordinator(db_path=db_path, shard_size=shard_size)
+    crawl_scheduler = CrawlScheduler(calendar=bot.crawl_calendar, timezone=bot.crawl_timezone)
+
+    def store_results(cycle_id):
+        for result in coordinator.collect_results(cycle_id):
+            reported_at = result.pop("reported_at")
+            bot.get_result_store().record_result(cycle_id=cycle_id, finished_at=reported_at, **result)
+            if bot.use_result_sink:
+                bot.get_result_sink().add(result=result, finished_at=reported_at)
+
+    def execute_distributed_cycle(slip_numbers_list):
+        cycle_id, slip_numbers_list = bot.get_result_store().start_cycle(slip_numbers_list)
+        coordinator.publish_cycle(cycle_id=cycle_id, slip_numbers_list=bot.get_result_store().slips_to_crawl(cycle_id=cycle_id, slip_numbers_list=slip_numbers_list))
+
+        # Wait for the workers until the window closes. Outside of a window (e.g., when the coordinator is started by hand), wait as long as a cycle is allowed to take
+        window = crawl_scheduler.current_window()
+        deadline = window[1].timestamp() if window is not None else time.time() + bot.default_cycle_duration * bot.cycle_duration_safety_factor
+        while not coordinator.is_cycle_done(cycle_id):
+            if time.time() >= deadline:
+                cancelled_slips = coordinator.cancel_pending_shards(cycle_id)
+                logging.warning(f"The crawling window closed before cycle {cycle_id} was done. {len(cancelled_slips)} slips were not claimed by any worker and are left for the next cycle")
+                break
+            coordinator.reassign_expired_leases()
+            store_results(cycle_id)
+            time.sleep(poll_interval)
+        store_results(cycle_id)
+        failed_slips = coordinator.failed_slips(cycle_id)
+        if failed_slips:
+            bot.get_telegram_notifier().notify(channel="errors", message=escape_markdown(f"No worker could crawl the slip numbers {failed_slips} in cycle {cycle_id}"))
+        bot.get_result_store().finish_cycle(cycle_id)
+
+    bot.run_forever(execute_cycle_func=execute_distributed_cycle)
+
+def run_worker(db_path, lease_duration, poll_interval, idle_timeout):
+    """
+    A function that claims shards, crawls their slips with the local pools (parallel_jobs workers), and reports the results. The browsers are released after idle_timeout seconds without work
+    """
+    import wafid_bot_selenium_parallel as bot
+    from joblib import Parallel, delayed
+
+    # The crawling jobs share the connection of the worker to the shard database and the lease events, which cannot be sent to other processes.
+    # The distributed mode therefore only runs with the threading backend (use_driver_pool = True)
+    if bot.parallel_backend != "threading":
+        raise ValueError(f"The distributed workers need the threading backend, but the bot is configured with the {bot.parallel_backend} backend. Set use_driver_pool to True")
+
+    worker = ShardWorker(db_path=db_path, lease_duration=lease_duration)
+    last_work_at = time.time()
+    cycle_id = None # The cycle of the last claimed shard. The retry budget is per cycle, so it is reset when the worker claims the first shard of a new cycle
+
+    def crawl_slip(shard, slip, is_lease_lost):
+        # Don't crawl the rest of a shard that was given to another worker
+        if is_lease_lost.is_set():
+            return
+        worker.report_result(shard=shard, result=bot.extract_medical_center_parallel(slip=slip, slip_numbers_list=shard.slip_numbers))
+
+    while True:
+        shard = worker.claim_shard()
+        if shard is None:
+            if time.time() - last_work_at > idle_timeout:
+                bot.release_idle_resources()
+            time.sleep(poll_interval)
+            continue
+        if shard.cycle_id != cycle_id:
+            bot.get_retry_policy().budget.reset()
+            cycle_id = shard.cycle_id
+
+        with worker.keep_lease(shard) as is_lease_lost:
+            Parallel(n_jobs=bot.parallel_jobs, backend=bot.parallel_backend)(delayed(crawl_slip)(shard=shard, slip=slip, is_lease_lost=is_lease_lost) for slip in shard.slip_numbers)
+        worker.complete_shard(shard)
+        last_work_at = time.time()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl the slips of a cycle on several hosts. The coordinator and the workers share a SQLite database on shared storage")
+    parser.add_argument("role", choices=["coordinator", "worker"])
+    parser.add_argument("--db", default="wafid_shards.db", help="The path of the shard database. It must be on storage all the hosts can reach")
+    parser.add_argument("--shard-size", type=int, default=5, help="The number of slips in one shard (coordinator)")
+    parser.add_argument("--lease-duration", type=float, default=180, help="The number of seconds a shard stays leased without a heartbeat (worker)")
+    parser.add_argument("--poll-interval", type=float, default=5, help="The number of seconds between two checks of the shard database")
+    parser.add_argument("--idle-timeout", type=float, default=600, help="The number of seconds without work after which a worker quits its browsers (worker)")
+    args = parser.parse_args()
+
+    if args.role == "coordinator":
+        run_coordinator(db_path=args.db, shard_size=args.shard_size, poll_interval=args.poll_interval)
+    else:
+        run_worker(db_path=args.db, lease_duration=args.lease_duration, poll_interval=args.poll_interval, idle_timeout=args.idle_timeout)
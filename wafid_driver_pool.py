@@ -0,0 +1,180 @@
+# Import packages
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+###-----------------------------###-----------------------------###
+
+# Create a class that keeps a pool of long-lived Chrome web drivers that the workers check out and return
+class WebDriverPool:
+    def __init__(self, driver_factory, size, max_uses_per_driver=20, reset_origins=(), checkout_timeout=300, quit_func=None, is_reusable=None):
+        """
+        - driver_factory: A function without arguments that launches and returns a new web driver
+        - quit_func: An optional function that quits a driver and cleans up what was created with it. driver.quit() is used by default
+        - is_reusable: An optional function that returns False if a driver must not be handed out again (e.g., its proxy session was rotated)
+        - size: The maximum number of drivers that can be alive at the same time
+        - max_uses_per_driver: The number of slips a driver is used for before it is quit and replaced with a fresh one
+        - reset_origins: The origins (e.g., "https://wafid.com") whose storage is cleared between slips
+        - checkout_timeout: The number of seconds a worker waits for a free driver before giving up
+        """
+        self.driver_factory = driver_factory
+        self.size = size
+        self.max_uses_per_driver = max_uses_per_driver
+        self.reset_origins = reset_origins
+        self.checkout_timeout = checkout_timeout
+        self.quit_func = quit_func or (lambda driver: driver.quit())
+        self.is_reusable = is_reusable or (lambda driver: True)
+        self._idle_drivers = queue.LifoQueue() # LIFO so that the most recently used (warmest) driver is handed out first
+        self._use_counts = {} # id(driver) --> number of slips the driver was used for
+        self._launching_drivers = 0 # The number of drivers that are starting up and are not in _use_counts yet
+        self._lock = threading.Lock()
+        self._is_shut_down = False
+
+    @property
+    def live_drivers(self):
+        """
+        The number of drivers that are currently alive (idle or checked out)
+        """
+        with self._lock:
+            return len(self._use_counts)
+
+    # Function to check that a driver is still responsive before handing it out
+    def _is_healthy(self, driver):
+        if not self.is_reusable(driver):
+            return False
+        try:
+            driver.execute_script("return document.readyState")
+            return True
+        except Exception as e:
+            logging.warning(f"A pooled web driver failed the health check and will be replaced: {e}")
+            return False
+
+    # Function to quit a driver and forget about it. Errors are swallowed because the browser might already be dead
+    def _discard(self, driver):
+        with self._lock:
+            self._use_counts.pop(id(driver), None)
+        try:
+            self.quit_func(driver)
+        except Exception as e:
+            logging.warning(f"Quitting a pooled web driver failed: {e}")
+
+    # Function to delete the cookies and storage of the previous slip so that every slip starts with a clean session
+    def _reset(self, driver):
+        driver.delete_all_cookies()
+        for origin in self.reset_origins:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+
+        # Drop the requests captured by seleniumwire so that they don't pile up in memory
+        if hasattr(driver, "requests"):
+            del driver.requests
+        driver.get("about:blank")
+
+    def acquire(self):
+        """
+        A function that hands out a healthy driver. It reuses an idle driver if there is one, launches a new one if the pool is not full, and waits otherwise
+        """
+        waiting_started_at = time.time()
+        while True:
+            if self._is_shut_down:
+                raise RuntimeError("The web driver pool was shut down")
+
+            # Reuse an idle driver if there is one
+            try:
+                driver = self._idle_drivers.get_nowait()
+            except queue.Empty:
+                driver = None
+
+            # Launch a new driver if the pool is not full yet
+            if driver is None:
+                with self._lock:
+                    can_launch = len(self._use_counts) + self._launching_drivers < self.size
+                    if can_launch:
+                        self._launching_drivers += 1 # Reserve the slot while Chrome starts
+                if can_launch:
+                    try:
+                        driver = self.driver_factory()
+                        with self._lock:
+                            self._use_counts[id(driver)] = 0
+                    finally:
+                        with self._lock:
+                            self._launching_drivers -= 1
+                    return driver
+
+                # Otherwise, wait for another worker to return its driver. Wake up every second in case a broken driver was discarded and its slot became free
+                if time.time() - waiting_started_at > self.checkout_timeout:
+                    raise TimeoutError(f"No web driver became available within {self.checkout_timeout} seconds")
+                try:
+                    driver = self._idle_drivers.get(timeout=1)
+                except queue.Empty:
+                    continue
+
+            if self._is_healthy(driver):
+                return driver
+            self._discard(driver)
+
+    def release(self, driver, is_broken=False, uses=1):
+        """
+        A function that returns a driver to the pool. The driver is quit instead if it is broken, has reached max_uses_per_driver, or the pool was shut down.
+        uses is the number of slips the driver was used for during this checkout (e.g., a chunk of slips looked up on one page)
+        """
+        with self._lock:
+            self._use_counts[id(driver)] = self._use_counts.get(id(driver), 0) + uses
+            is_worn_out = self._use_counts[id(driver)] >= self.max_uses_per_driver
+
+        if is_broken or is_worn_out or self._is_shut_down:
+            self._discard(driver)
+            return
+
+        try:
+            self._reset(driver)
+        except Exception as e:
+            logging.warning(f"Resetting a pooled web driver failed. The driver will be replaced: {e}")
+            self._discard(driver)
+            return
+        self._idle_drivers.put(driver)
+
+    def trim_idle(self, max_live_drivers):
+        """
+        A function that quits the least recently used idle drivers until at most max_live_drivers are alive (e.g., after the concurrency limit was lowered)
+        """
+        idle_drivers = []
+        while True:
+            try:
+                idle_drivers.append(self._idle_drivers.get_nowait()) # The most recently used driver comes first
+            except queue.Empty:
+                break
+        surplus = max(self.live_drivers - max_live_drivers, 0)
+        kept_drivers = idle_drivers[:max(len(idle_drivers) - surplus, 0)]
+        for driver in idle_drivers[len(kept_drivers):]:
+            self._discard(driver)
+        for driver in reversed(kept_drivers):
+            self._idle_drivers.put(driver)
+
+    @contextmanager
+    def checkout(self):
+        """
+        A context manager that acquires a driver and returns it to the pool afterwards. The driver is recycled if the block raises an exception
+        """
+        driver = self.acquire()
+        try:
+            yield driver
+        except Exception:
+            self.release(driver, is_broken=True)
+            raise
+        else:
+            self.release(driver)
+
+    def shutdown(self):
+        """
+        A function that quits all the idle drivers. Drivers that are still checked out are quit when they are released
+        """
+        self._is_shut_down = True
+        while True:
+            try:
+                driver = self._idle_drivers.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+        logging.info("The web driver pool was shut down")
@@ -0,0 +1,124 @@
+# Import packages
+import asyncio
+import logging
+from urllib.parse import urljoin
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from wafid_page_extraction import parse_page_state
+
+# Global inputs (1): Basic information
+base_url = "https://wafid.com/medical-status-search/"
+http_timeout = 30 # The total number of seconds a single GET or POST is allowed to take
+
+# Send the same headers as a regular Chrome browser so that Wafid serves the same form that Selenium sees
+http_headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en,en_US;q=0.9",
+}
+
+###-----------------------------###-----------------------------###
+
+def extract_form_fields(html, slip_number, captcha_response):
+    """
+    A function that collects the fields of the medical status search form (CSRF token and the other hidden inputs),
+    selects the "Wafid Slip Number" search variant, and fills in the GCC slip number and the captcha token
+    """
+    soup = BeautifulSoup(markup=html, features="html.parser")
+    form = soup.select_one("form.ui.form")
+    if form is None:
+        raise ValueError("The medical status search form was not found on the page")
+
+    # Collect the default value of every named field the same way the browser would when submitting the form
+    form_fields = {}
+    for field in form.select("input[name], select[name], textarea[name]"):
+        field_type = (field.get("type") or "").lower()
+        if field.name == "input" and field_type in ("radio", "checkbox") and not field.has_attr("checked"):
+            continue
+        if field.name == "input" and field_type in ("submit", "button", "image"):
+            continue
+        if field.name == "select":
+            selected_option = field.select_one("option[selected]") or field.select_one("option")
+            form_fields[field["name"]] = selected_option.get("value", selected_option.get_text(strip=True)) if selected_option is not None else ""
+        elif field.name == "textarea":
+            form_fields[field["name"]] = field.get_text()
+        else:
+            form_fields[field["name"]] = field.get("value", "")
+
+    # Select the "Wafid Slip Number" radio button (the equivalent of clicking on id_search_variant_1 in Selenium)
+    search_variant = form.select_one("input#id_search_variant_1")
+    if search_variant is None:
+        raise ValueError("The 'Wafid Slip Number' search variant was not found on the page")
+    form_fields[search_variant["name"]] = search_variant.get("value", "on")
+
+    # Fill in the GCC slip number and the captcha token
+    slip_field = form.select_one("input#id_gcc_slip_no")
+    form_fields[slip_field["name"] if slip_field is not None else "gcc_slip_no"] = str(slip_number)
+    form_fields["g-recaptcha-response"] = captcha_response
+
+    # Return the fields and the URL the form should be posted to
+    return form_fields, form.get("action") or ""
+
+def parse_search_result(html):
+    """
+    A function that parses the page returned after submitting the form. The status could be one of three options.
+    Option 1 (found): The traveled_country__name and medical_center inputs are filled in
+    Option 2 (not_found): The div.header says "Records not found"
+    Option 3 (captcha_failure): The form was returned with a captcha message under input.g-recaptcha
+    """
+    page_state = parse_page_state(html)
+    return {"status": page_state.status, "country": page_state.country, "medical_center": page_state.medical_center}
+
+###-----------------------------###-----------------------------###
+
+async def lookup_slip_http(session, slip_number, captcha_response, url=base_url, proxy=None):
+    """
+    A function that runs the medical status search form flow for one slip number over HTTP (GET the page, POST the form, parse the result)
+    """
+    # Navigate to the website
+    async with session.get(url, proxy=proxy) as response:
+        response.raise_for_status()
+        html = await response.text()
+
+    # Fill in the form and submit it
+    form_fields, form_action = extract_form_fields(html=html, slip_number=slip_number, captcha_response=captcha_response)
+    async with session.post(urljoin(url, form_action), data=form_fields, headers={"Referer": url}, proxy=proxy) as response:
+        response.raise_for_status()
+        result_html = await response.text()
+
+    # Parse the page returned by the website
+    result = parse_search_result(html=result_html)
+    result["slip_number"] = slip_number
+    return result
+
+async def lookup_slips_http(slip_numbers_list, solve_captcha_func, url=base_url, proxy=None, concurrency=10):
+    """
+    A function that looks up a list of slip numbers over one pooled HTTP connector.
+    solve_captcha_func is a blocking function that takes a slip number and returns a reCAPTCHA token (e.g., solve_recaptcha).
+    Slips that could not be resolved are returned with status "error" so that the caller can fall back to Selenium.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    # Share the connection pool between all the slips but give every slip its own cookie jar so that the CSRF cookies of parallel submissions don't clash
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=http_timeout)
+
+    async def lookup_one(slip):
+        async with semaphore:
+            try:
+                captcha_response = await loop.run_in_executor(None, solve_captcha_func, slip)
+                async with aiohttp.ClientSession(connector=connector, connector_owner=False, cookie_jar=aiohttp.CookieJar(), headers=http_headers, timeout=timeout) as session:
+                    result = await lookup_slip_http(session=session, slip_number=slip, captcha_response=captcha_response, url=url, proxy=proxy)
+                logging.info(f"HTTP lookup result for slip number {slip}: {result}")
+                return result
+            except Exception as e:
+                logging.exception(f"The HTTP lookup failed for slip number {slip}: {e}")
+                return {"slip_number": slip, "status": "error", "country": None, "medical_center": None}
+
+    try:
+        return await asyncio.gather(*[lookup_one(slip) for slip in slip_numbers_list])
+    finally:
+        await connector.close()
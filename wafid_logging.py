@@ -0,0 +1,246 @@
+# Import packages
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from multiprocessing.managers import BaseManager
+
+# The environment variables that tell the worker processes (which inherit the environment of the bot) where the log writer listens
+log_address_variable = "WAFID_LOG_ADDRESS"
+log_authkey_variable = "WAFID_LOG_AUTHKEY"
+
+# The attributes every log record has. The other attributes were passed with extra= and are written as fields of the JSON line
+standard_record_attributes = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "is_verbose"}
+
+###-----------------------------###-----------------------------###
+
+# Create a class that formats a log record as one JSON line
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "process": record.process,
+            "thread": record.threadName,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in standard_record_attributes})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+# Create a class that keeps only a share of the verbose records (the ones logged with extra={"is_verbose": True}, e.g., one line per form submission) of every level.
+# The records that are not verbose are always kept
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rates):
+        """
+        - sample_rates: A dictionary of level name --> the share of the verbose records of that level that are kept. The levels that are missing are not sampled
+        """
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.dropped = Counter() # Level name --> the number of verbose records that were dropped
+
+    def filter(self, record):
+        if not getattr(record, "is_verbose", False):
+            return True
+        sample_rate = self.sample_rates.get(record.levelname, 1.0)
+        if sample_rate >= 1 or random.random() < sample_rate:
+            return True
+        self.dropped[record.levelname] += 1
+        return False
+
+# Create a class that rotates the log file when it reaches max_bytes or when it is older than rotate_interval seconds, and compresses the rotated files with gzip
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    def __init__(self, filename, max_bytes, backup_count, rotate_interval):
+        """
+        - filename: The path of the log file. The rotated files are called <filename>.1.gz (the newest) to <filename>.<backup_count>.gz
+        - max_bytes: The size in bytes at which the file is rotated
+        - backup_count: The number of rotated files that are kept
+        - rotate_interval: The number of seconds after which the file is rotated even if it is smaller than max_bytes (None disables it)
+        """
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.rotate_interval = rotate_interval
+        self.opened_at = time.time()
+        self.namer = lambda name: name + ".gz"
+        self.rotator = gzip_rotator
+
+    def shouldRollover(self, record):
+        if self.rotate_interval and time.time() - self.opened_at >= self.rotate_interval and os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened_at = time.time()
+
+def gzip_rotator(source, dest):
+    with open(source, "rb") as source_file, gzip.open(dest, "wb") as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+###-----------------------------###-----------------------------###
+# The log writer. It runs in its own process (the server process of LogQueueManager), takes the batches of records of all the processes of the bot from one queue,
+# and is the only process that writes the log file
+
+writer_queue = None
+
+def get_writer_queue():
+    return writer_queue
+
+def start_log_writer(log_path, max_bytes, backup_count, rotate_interval):
+    """
+    A function that starts the thread that writes the records in the queue to the log file. It is the initializer of the server process of LogQueueManager
+    """
+    global writer_queue
+    writer_queue = queue.Queue()
+    handler = CompressingRotatingFileHandler(filename=log_path, max_bytes=max_bytes, backup_count=backup_count, rotate_interval=rotate_interval)
+    handler.setFormatter(JsonFormatter())
+    threading.Thread(target=write_log_records, args=(handler,), name="log-writer", daemon=True).start()
+
+def write_log_records(handler):
+    while True:
+        records = writer_queue.get()
+        for record in records:
+            handler.handle(record)
+        writer_queue.task_done()
+
+# Create a class that serves the queue of the log writer to the processes of the bot
+class LogQueueManager(BaseManager):
+    pass
+
+LogQueueManager.register("get_queue", callable=get_writer_queue)
+
+###-----------------------------###-----------------------------###
+
+# Create a class that makes a log record picklable so that it can be sent to the log writer. The message is formatted and the traceback is turned into text in the thread that logged it
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        for key, value in vars(record).items():
+            if key not in standard_record_attributes and not isinstance(value, (str, int, float, bool, type(None))):
+                setattr(record, key, str(value))
+        return record
+
+# Create a class that sends the log records of this process (all its threads) to the log writer, and starts the writer if no process of the bot started it yet.
+# Logging only puts the record in a local queue, and a background thread sends the records to the writer in batches, so that the workers never wait for the disk
+class LogPipeline:
+    def __init__(self, log_path, level="INFO", max_bytes=50 * 1024 ** 2, backup_count=20, rotate_interval=86400, verbose_sample_rates=None, batch_size=200):
+        """
+        - log_path: The path of the JSON lines log file
+        - level: The minimum level of the records that are logged
+        - max_bytes, backup_count, rotate_interval: See CompressingRotatingFileHandler
+        - verbose_sample_rates: See SamplingFilter. None keeps all the verbose records
+        - batch_size: The maximum number of records that are sent to the writer at once
+        """
+        self.log_path = log_path
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_interval = rotate_interval
+        self.sampling_filter = SamplingFilter(sample_rates=verbose_sample_rates or {})
+        self.batch_size = batch_size
+        self.is_writer_owner = False
+        self.failed_records = 0 # The number of records that could not be sent to the writer
+        self._manager = None
+        self._writer_queue = None
+        self._local_queue = queue.Queue()
+        self._handler = None
+        self._forwarder_thread = None
+
+    def _connect_to_writer(self):
+        address = os.environ.get(log_address_variable)
+        if address is not None:
+            host, port = address.rsplit(":", 1)
+            manager = LogQueueManager(address=(host, int(port)), authkey=bytes.fromhex(os.environ[log_authkey_variable]))
+            try:
+                manager.connect()
+                return manager
+            except OSError:
+                pass # The process that started the writer is gone. Start a new one
+
+        # Spawn the writer instead of forking it so that it does not inherit the locks of the threads of this process
+        authkey = os.urandom(16)
+        manager = LogQueueManager(address=("127.0.0.1", 0), authkey=authkey, ctx=multiprocessing.get_context("spawn"))
+        manager.start(initializer=start_log_writer, initargs=(os.path.abspath(self.log_path), self.max_bytes, self.backup_count, self.rotate_interval))
+        os.environ[log_address_variable] = f"{manager.address[0]}:{manager.address[1]}"
+        os.environ[log_authkey_variable] = authkey.hex()
+        self.is_writer_owner = True
+        return manager
+
+    def start(self):
+        self._manager = self._connect_to_writer()
+        self._writer_queue = self._manager.get_queue()
+        self._forwarder_thread = threading.Thread(target=self._forward_records, name="log-forwarder", daemon=True)
+        self._forwarder_thread.start()
+
+        # Replace the handlers of the root logger (e.g., the ones of an earlier logging.basicConfig call) with the queue
+        self._handler = RecordQueueHandler(self._local_queue)
+        self._handler.addFilter(self.sampling_filter)
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+        root_logger.addHandler(self._handler)
+        root_logger.setLevel(self.level)
+        atexit.register(self.stop)
+        return self
+
+    def _forward_records(self):
+        while True:
+            records = [self._local_queue.get()]
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self._local_queue.get_nowait())
+                except queue.Empty:
+                    break
+            is_stopped = None in records
+            records = [record for record in records if record is not None]
+            if records:
+                try:
+                    self._writer_queue.put(records)
+                except Exception as e:
+                    # Logging the error would put it back in the queue, so write it to stderr
+                    self.failed_records += len(records)
+                    sys.stderr.write(f"Sending {len(records)} log records to the log writer failed: {e}\n")
+            if is_stopped:
+                return
+
+    def stop(self):
+        """
+        A function that sends the remaining records to the writer and, in the process that started the writer, waits until they are written and stops the writer
+        """
+        if self._handler is None:
+            return
+        if self.sampling_filter.dropped:
+            logging.info(f"Dropped verbose log records by level: {dict(self.sampling_filter.dropped)}")
+        logging.getLogger().removeHandler(self._handler)
+        self._handler = None
+        atexit.unregister(self.stop)
+        self._local_queue.put(None)
+        self._forwarder_thread.join(timeout=10)
+        if self.is_writer_owner:
+            try:
+                self._writer_queue.join()
+            finally:
+                self._manager.shutdown()
+                os.environ.pop(log_address_variable, None)
+                os.environ.pop(log_authkey_variable, None)
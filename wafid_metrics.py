@@ -0,0 +1,191 @@
+# Import packages
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# prometheus_client and psutil are optional. Without prometheus_client the metrics are not exported, and without psutil the memory gauges stay at 0
+try:
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, start_http_server, write_to_textfile
+except ImportError:
+    CollectorRegistry = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# The buckets of the histograms (in seconds, except for the attempts)
+attempt_buckets = (1, 2, 3, 4, 5, 6, 8, 10)
+slip_duration_buckets = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+captcha_solve_buckets = (1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120)
+browser_rss_buckets = tuple(mb * 1024 ** 2 for mb in (100, 200, 300, 400, 500, 750, 1000, 1500, 2000, 3000))
+driver_launch_buckets = (0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+telegram_send_buckets = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+
+###-----------------------------###-----------------------------###
+
+# Create a class that collects the metrics of the crawler and exposes them to Prometheus, either on an HTTP endpoint (/metrics) or in a file for the textfile collector of the node exporter.
+# The workers call the observe_* functions. The gauges that are sampled (live browsers, memory, slips per minute, Telegram latency) are refreshed by a background thread
+class CrawlerMetrics:
+    def __init__(self, live_browsers_func=None, telegram_send_latencies_func=None, refresh_interval=15, slips_per_minute_window=300):
+        """
+        - live_browsers_func: A function that returns the number of running browsers
+        - telegram_send_latencies_func: A function that returns the send_latencies deque of the current TelegramNotifier (or None). The latencies are taken out of it when the metrics are refreshed
+        - refresh_interval: The number of seconds between two refreshes of the sampled gauges (and two writes of the textfile)
+        - slips_per_minute_window: The number of seconds the slips per minute are averaged over
+        """
+        self.refresh_interval = refresh_interval
+        self.slips_per_minute_window = slips_per_minute_window
+        self.live_browsers_func = live_browsers_func
+        self.telegram_send_latencies_func = telegram_send_latencies_func
+        self.is_enabled = CollectorRegistry is not None
+        self._finished_slip_times = deque() # The times the slips finished within the last slips_per_minute_window seconds
+        self._lock = threading.Lock()
+        self._textfile_path = None
+        self._is_stopped = threading.Event()
+        self._refresh_thread = None
+        if not self.is_enabled:
+            logging.warning("prometheus_client is not installed. The crawler metrics will not be exported")
+            return
+
+        self.registry = CollectorRegistry()
+        self.slips_total = Counter("wafid_slips_total", "The slips that were crawled, by outcome", ["status"], registry=self.registry)
+        self.slips_per_minute = Gauge("wafid_slips_per_minute", "The slips crawled per minute, averaged over the last minutes", registry=self.registry)
+        self.slip_duration = Histogram("wafid_slip_duration_seconds", "The time it took to crawl one slip", buckets=slip_duration_buckets, registry=self.registry)
+        self.retries_total = Counter("wafid_retries_total", "The retry decisions (resubmit, requeue, give_up), by failure class", ["failure_class", "decision"], registry=self.registry)
+        self.submit_attempts = Histogram("wafid_submit_attempts", "The number of times the form was submitted for one slip", buckets=attempt_buckets, registry=self.registry)
+        self.captcha_solve_duration = Histogram("wafid_captcha_solve_seconds", "The time the captcha providers took to solve one captcha", buckets=captcha_solve_buckets, registry=self.registry)
+        self.captcha_solve_failures = Counter("wafid_captcha_solve_failures_total", "The captcha solves that raised an error", registry=self.registry)
+        self.driver_launch_duration = Histogram("wafid_driver_launch_seconds", "The time it took to launch one Chrome web driver", buckets=driver_launch_buckets, registry=self.registry)
+        self.slip_browser_peak_rss = Histogram("wafid_slip_browser_peak_rss_bytes", "The peak memory of the browser process tree while crawling one slip", buckets=browser_rss_buckets, registry=self.registry)
+        self.concurrency_limit = Gauge("wafid_concurrency_limit", "The number of slips that may be crawled at the same time, as set by the concurrency controller", registry=self.registry)
+        self.live_browsers = Gauge("wafid_live_browsers", "The number of Chrome browsers that are running", registry=self.registry)
+        self.browser_rss = Gauge("wafid_browser_rss_bytes", "The resident memory of all the Chrome and chromedriver processes", registry=self.registry)
+        self.process_rss = Gauge("wafid_process_rss_bytes", "The resident memory of the bot process itself", registry=self.registry)
+        self.telegram_send_duration = Histogram("wafid_telegram_send_seconds", "The time one Telegram send_message call took", buckets=telegram_send_buckets, registry=self.registry)
+
+    ###-----------------------------###-----------------------------###
+    # Observations
+
+    def observe_slip(self, status, attempts=None, duration=None, browser_peak_rss=None):
+        """
+        A function that records the outcome of a slip, the number of submit attempts it took, how long it took, and the peak memory of its browser
+        """
+        if not self.is_enabled:
+            return
+        with self._lock:
+            self._finished_slip_times.append(time.time())
+        self.slips_total.labels(status=status).inc()
+        if attempts:
+            self.submit_attempts.observe(attempts)
+        if duration is not None:
+            self.slip_duration.observe(duration)
+        if browser_peak_rss is not None:
+            self.slip_browser_peak_rss.observe(browser_peak_rss)
+
+    def observe_retry(self, failure_class, decision):
+        """
+        A function that records one decision of the retry policy after a failed attempt
+        """
+        if self.is_enabled:
+            self.retries_total.labels(failure_class=failure_class, decision=decision).inc()
+
+    def observe_captcha_solve(self, duration, is_failure=False):
+        """
+        A function that records one captcha solve
+        """
+        if not self.is_enabled:
+            return
+        if is_failure:
+            self.captcha_solve_failures.inc()
+        else:
+            self.captcha_solve_duration.observe(duration)
+
+    def observe_concurrency_limit(self, limit):
+        """
+        A function that records a new concurrency limit
+        """
+        if self.is_enabled:
+            self.concurrency_limit.set(limit)
+
+    def observe_driver_launch(self, duration):
+        """
+        A function that records the time it took to launch a Chrome web driver
+        """
+        if self.is_enabled:
+            self.driver_launch_duration.observe(duration)
+
+    ###-----------------------------###-----------------------------###
+    # Sampled gauges
+
+    # Function to sum the resident memory of the Chrome processes that were started by the bot
+    def _measure_memory(self):
+        process = psutil.Process()
+        browser_rss = 0
+        for child in process.children(recursive=True):
+            try:
+                if "chrom" in child.name().lower():
+                    browser_rss += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return browser_rss, process.memory_info().rss
+
+    def refresh(self):
+        """
+        A function that samples the gauges and moves the new Telegram send latencies into the histogram
+        """
+        if not self.is_enabled:
+            return
+        with self._lock:
+            while self._finished_slip_times and time.time() - self._finished_slip_times[0] > self.slips_per_minute_window:
+                self._finished_slip_times.popleft()
+            self.slips_per_minute.set(len(self._finished_slip_times) * 60 / self.slips_per_minute_window)
+        if self.live_browsers_func is not None:
+            self.live_browsers.set(self.live_browsers_func())
+        if psutil is not None:
+            browser_rss, process_rss = self._measure_memory()
+            self.browser_rss.set(browser_rss)
+            self.process_rss.set(process_rss)
+        telegram_send_latencies = self.telegram_send_latencies_func() if self.telegram_send_latencies_func is not None else None
+        while telegram_send_latencies:
+            self.telegram_send_duration.observe(telegram_send_latencies.popleft())
+
+    ###-----------------------------###-----------------------------###
+    # Export
+
+    def start(self, port=None, textfile_path=None):
+        """
+        A function that starts exporting the metrics on http://0.0.0.0:<port>/metrics and/or to textfile_path, and starts the background refresh thread
+        """
+        if not self.is_enabled:
+            return self
+        if port:
+            try:
+                start_http_server(port, registry=self.registry)
+                logging.info(f"Exporting the crawler metrics on port {port}")
+            except OSError as e:
+                # E.g., another bot process on the same host already serves the port. The metrics are still collected (and written to textfile_path)
+                logging.warning(f"The crawler metrics could not be exported on port {port}: {e}")
+        self._textfile_path = textfile_path
+        self._refresh_thread = threading.Thread(target=self._refresh_periodically, name="metrics-refresh", daemon=True)
+        self._refresh_thread.start()
+        return self
+
+    def _refresh_periodically(self):
+        while not self._is_stopped.wait(timeout=self.refresh_interval):
+            try:
+                self.refresh()
+                if self._textfile_path:
+                    os.makedirs(os.path.dirname(os.path.abspath(self._textfile_path)), exist_ok=True)
+                    write_to_textfile(self._textfile_path, self.registry) # Writes to a temporary file and renames it, so the collector never reads half a file
+            except Exception as e:
+                logging.warning(f"Refreshing the crawler metrics failed: {e}")
+
+    def stop(self):
+        """
+        A function that stops the background refresh thread. The HTTP endpoint keeps serving the last values until the process exits
+        """
+        self._is_stopped.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join(timeout=5)
@@ -0,0 +1,127 @@
+# Import packages
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from bs4 import BeautifulSoup
+
+# Use the fastest HTML parser that is installed. selectolax (lexbor, written in C) is the fastest, then BeautifulSoup on top of lxml (also C), then the pure Python html.parser
+try:
+    from selectolax.lexbor import LexborHTMLParser
+    html_parser_backend = "selectolax"
+except ImportError:
+    LexborHTMLParser = None
+    try:
+        import lxml # noqa: F401
+        html_parser_backend = "lxml"
+    except ImportError:
+        html_parser_backend = "html.parser"
+
+# The selectors of the fields we need from the medical status search page
+captcha_msg_selector = "input.g-recaptcha+p"
+gcc_field_selector = "input[placeholder='Enter GCC Slip Number']"
+status_header_selector = "div.header"
+country_selector = "input[name='traveled_country__name']"
+medical_center_selector = "input[name='medical_center']"
+
+###-----------------------------###-----------------------------###
+
+# Create a class to store the fields of the medical status search page that the bot needs
+@dataclass
+class SlipPageState:
+    captcha_msg: Optional[str] # The captcha message under input.g-recaptcha. None if the captcha was accepted
+    gcc_field_value: Optional[str] # The value attribute of the "GCC Slip Number" field (filled in by the website after a successful submission)
+    status_header: Optional[str] # The text of div.header (e.g., "Records not found")
+    country: Optional[str] # The value of traveled_country__name
+    medical_center: Optional[str] # The value of medical_center
+
+    @property
+    def status(self):
+        """
+        The outcome of the page: "found", "not_found", "captcha_failure" or "unknown"
+        """
+        if self.status_header == "Records not found":
+            return "not_found"
+        if self.country is not None:
+            return "found"
+        if self.captcha_msg is not None:
+            return "captcha_failure"
+        return "unknown"
+
+    @property
+    def is_form_submitted(self):
+        """
+        The form was submitted successfully if there is no captcha message and the website filled in the GCC slip number
+        """
+        return self.captcha_msg is None and self.gcc_field_value is not None
+
+    def to_dict(self):
+        return asdict(self)
+
+# A script that reads the fields in the page so that only a few strings are sent over the WebDriver wire instead of the whole serialized DOM.
+# getAttribute is used instead of the value property so that the result matches what the website rendered (and not what was typed)
+extract_page_state_script = f"""
+const captchaMsg = document.querySelector("{captcha_msg_selector}");
+const gccField = document.querySelector("{gcc_field_selector}");
+const statusHeader = document.querySelector("{status_header_selector}");
+const country = document.querySelector("{country_selector}");
+const medicalCenter = document.querySelector("{medical_center_selector}");
+return {{
+    captcha_msg: captchaMsg ? captchaMsg.textContent.trim() : null,
+    gcc_field_value: gccField ? gccField.getAttribute("value") : null,
+    status_header: statusHeader ? statusHeader.textContent.trim() : null,
+    country: country ? country.getAttribute("value") : null,
+    medical_center: medicalCenter ? medicalCenter.getAttribute("value") : null
+}};
+"""
+
+###-----------------------------###-----------------------------###
+
+def extract_page_state_in_browser(driver):
+    """
+    A function that evaluates the selectors in the browser and returns the fields of the current page as a SlipPageState
+    """
+    return SlipPageState(**driver.execute_script(extract_page_state_script))
+
+def parse_page_state_with_selectolax(html):
+    """
+    A function that parses the fields of the page from its HTML with selectolax
+    """
+    tree = LexborHTMLParser(html)
+    captcha_msg = tree.css_first(captcha_msg_selector)
+    gcc_field = tree.css_first(gcc_field_selector)
+    status_header = tree.css_first(status_header_selector)
+    country = tree.css_first(country_selector)
+    medical_center = tree.css_first(medical_center_selector)
+    return SlipPageState(
+        captcha_msg=captcha_msg.text(strip=True) if captcha_msg is not None else None,
+        gcc_field_value=gcc_field.attributes.get("value") if gcc_field is not None else None,
+        status_header=status_header.text(strip=True) if status_header is not None else None,
+        country=country.attributes.get("value") if country is not None else None,
+        medical_center=medical_center.attributes.get("value") if medical_center is not None else None
+    )
+
+def parse_page_state_with_beautifulsoup(html, features="html.parser"):
+    """
+    A function that parses the fields of the page from its HTML with BeautifulSoup (features can be "html.parser" or "lxml")
+    """
+    soup = BeautifulSoup(markup=html, features=features)
+    captcha_msg = soup.select_one(captcha_msg_selector)
+    gcc_field = soup.select_one(gcc_field_selector)
+    status_header = soup.select_one(status_header_selector)
+    country = soup.select_one(country_selector)
+    medical_center = soup.select_one(medical_center_selector)
+    return SlipPageState(
+        captcha_msg=captcha_msg.get_text(strip=True) if captcha_msg is not None else None,
+        gcc_field_value=gcc_field.get("value") if gcc_field is not None else None,
+        status_header=status_header.get_text(strip=True) if status_header is not None else None,
+        country=country.get("value") if country is not None else None,
+        medical_center=medical_center.get("value") if medical_center is not None else None
+    )
+
+def parse_page_state(html):
+    """
+    A function that parses the fields of the page from its HTML with the fastest parser that is installed
+    """
+    if html_parser_backend == "selectolax":
+        return parse_page_state_with_selectolax(html)
+    return parse_page_state_with_beautifulsoup(html, features=html_parser_backend)
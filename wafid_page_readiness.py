@@ -0,0 +1,124 @@
+# Import packages
+import logging
+import time
+
+from selenium.common.exceptions import JavascriptException, TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+
+# The page outcomes that can be waited for
+# - found: The traveled_country__name input is filled in
+# - not_found: The div.header says "Records not found"
+# - captcha_rejected: The captcha message appeared under input.g-recaptcha
+# - form_ready: The "GCC Slip NO" field is on the page
+submit_outcomes = ("found", "not_found", "captcha_rejected")
+
+# A script that runs in the page and calls back as soon as one of the expected outcomes is on the page.
+# It checks the page once and then re-checks it on every DOM mutation instead of polling
+wait_for_outcome_script = """
+const expectedOutcomes = arguments[0];
+const timeoutMs = arguments[1];
+const done = arguments[arguments.length - 1];
+let observer = null;
+let timer = null;
+
+function currentOutcome() {
+    const country = document.querySelector("input[name='traveled_country__name']");
+    if (country && country.value) return "found";
+    const header = document.querySelector("div.header");
+    if (header && header.textContent.trim() === "Records not found") return "not_found";
+    if (document.querySelector("input.g-recaptcha+p")) return "captcha_rejected";
+    if (document.getElementById("id_gcc_slip_no")) return "form_ready";
+    return null;
+}
+
+function finish(outcome) {
+    if (observer) observer.disconnect();
+    clearTimeout(timer);
+    done(outcome);
+}
+
+function check() {
+    const outcome = currentOutcome();
+    if (outcome && expectedOutcomes.includes(outcome)) {
+        finish(outcome);
+        return true;
+    }
+    return false;
+}
+
+if (!check()) {
+    observer = new MutationObserver(check);
+    observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+    timer = setTimeout(() => finish(null), timeoutMs);
+}
+"""
+
+# A script that prepares the page of the previous slip for the next one without loading it again. The result page still has the search form, but with the "Passport" search variant.
+# It selects the "Wafid Slip Number" variant, clears the slip number and the captcha token of the previous slip, clears the web storage, and returns false if the form is not on the page.
+# The cookies are kept because the CSRF cookie must match the CSRF token of the loaded form
+reset_search_form_script = """
+const slipVariant = document.getElementById("id_search_variant_1");
+const gccField = document.getElementById("id_gcc_slip_no");
+if (!slipVariant || !gccField) return false;
+if (!slipVariant.checked) slipVariant.click();
+gccField.value = "";
+const captchaResponse = document.getElementById("g-recaptcha-response");
+if (captchaResponse) {
+    captchaResponse.innerHTML = "";
+    captchaResponse.value = "";
+}
+try {
+    window.localStorage.clear();
+    window.sessionStorage.clear();
+} catch (e) {}
+return true;
+"""
+
+###-----------------------------###-----------------------------###
+
+def wait_for_page_outcome(driver, timeout, expected_outcomes=submit_outcomes):
+    """
+    A function that returns the page outcome as soon as one of the expected outcomes is on the page, or None if none of them appeared before the timeout
+    """
+    deadline = time.time() + timeout
+    while True:
+        remaining_time = deadline - time.time()
+        if remaining_time <= 0:
+            return None
+        try:
+            driver.set_script_timeout(remaining_time + 5)
+            return driver.execute_async_script(wait_for_outcome_script, list(expected_outcomes), int(remaining_time * 1000))
+        except (JavascriptException, TimeoutException) as e:
+            # The script is destroyed if the page navigates while it is waiting, so start it again on the new page
+            logging.debug(f"Waiting for the page outcome was interrupted, most likely by a navigation. Retrying: {e}")
+            time.sleep(0.05)
+
+def wait_for_navigation(driver, timeout):
+    """
+    A function that waits until the page that was marked by mark_current_page() is replaced by a new page whose DOM is ready
+    """
+    WebDriverWait(driver, timeout, poll_frequency=0.1, ignored_exceptions=(WebDriverException,)).until(
+        lambda d: d.execute_script("return window.__wafidPageMarker === undefined && document.readyState !== 'loading'")
+    )
+
+def mark_current_page(driver):
+    """
+    A function that tags the current document so that wait_for_navigation() can tell when it was replaced
+    """
+    driver.execute_script("window.__wafidPageMarker = Date.now()")
+
+def submit_form_and_wait(driver, submit_script, timeout):
+    """
+    A function that submits the form with submit_script, waits for the new page to load, and returns the outcome of the submission (or None on timeout)
+    """
+    started_at = time.time()
+    mark_current_page(driver)
+    driver.execute_script(submit_script)
+    try:
+        wait_for_navigation(driver, timeout=timeout)
+    except TimeoutException:
+        logging.warning(f"The page did not navigate within {timeout} seconds after submitting the form")
+        return None
+    outcome = wait_for_page_outcome(driver, timeout=max(timeout - (time.time() - started_at), 0.1))
+    logging.info(f"The form submission returned '{outcome}' after {time.time() - started_at:.2f} seconds")
+    return outcome
@@ -0,0 +1,125 @@
+# Import packages
+import asyncio
+import base64
+import logging
+import threading
+
+max_request_head_size = 64 * 1024 # The maximum size of the request line and headers sent by Chrome
+pipe_chunk_size = 64 * 1024
+
+###-----------------------------###-----------------------------###
+
+# Create a class that runs a local HTTP proxy which forwards Chrome's traffic to an authenticated upstream proxy.
+# Chrome cannot pass a username and password to a proxy from the command line, so the forwarder adds the Proxy-Authorization header to every request it forwards.
+# HTTPS traffic goes through CONNECT tunnels that are piped byte for byte, so nothing is decrypted (unlike the seleniumwire MITM proxy)
+class ProxyForwarder:
+    def __init__(self, upstream_endpoint, username, password, listen_host="127.0.0.1", listen_port=0):
+        """
+        - upstream_endpoint: The upstream proxy (host:port)
+        - username, password: The credentials of the upstream proxy
+        - listen_host, listen_port: Where the local proxy listens. Port 0 picks a free port, which is available in self.port after start()
+        """
+        self.upstream_host, self.upstream_port = upstream_endpoint.rsplit(":", 1)
+        self.upstream_port = int(self.upstream_port)
+        self.proxy_authorization = "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.port = None
+        self.bytes_in = 0 # Bytes received from the upstream proxy
+        self.bytes_out = 0 # Bytes sent to the upstream proxy
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._is_started = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.listen_host}:{self.port}"
+
+    def start(self):
+        """
+        A function that starts the local proxy in a background thread and returns once it is listening
+        """
+        self._thread = threading.Thread(target=self._run, name=f"proxy-forwarder-{self.upstream_host}", daemon=True)
+        self._thread.start()
+        self._is_started.wait(timeout=10)
+        if self.port is None:
+            raise RuntimeError("The proxy forwarder could not be started")
+        return self
+
+    def stop(self):
+        """
+        A function that closes the local proxy and all its connections
+        """
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle_client, self.listen_host, self.listen_port))
+            self.port = self._server.sockets[0].getsockname()[1]
+        finally:
+            self._is_started.set()
+        self._loop.run_forever()
+        self._server.close()
+        for task in asyncio.all_tasks(self._loop):
+            task.cancel()
+        self._loop.run_until_complete(asyncio.sleep(0))
+        self._loop.close()
+
+    # Function to add the Proxy-Authorization header to the request head of Chrome.
+    # Plain HTTP requests are limited to one request per connection because only the first request of a kept-alive connection goes through this function
+    def _rewrite_request_head(self, request_head):
+        lines = request_head.decode("latin-1").split("\r\n")
+        request_line, headers = lines[0], [line for line in lines[1:] if line]
+        is_connect = request_line.upper().startswith("CONNECT ")
+        headers = [header for header in headers if not header.lower().startswith(("proxy-authorization:", "proxy-connection:", "connection:" if not is_connect else "\0"))]
+        headers.append(f"Proxy-Authorization: {self.proxy_authorization}")
+        if not is_connect:
+            headers.append("Connection: close")
+        return ("\r\n".join([request_line] + headers) + "\r\n\r\n").encode("latin-1")
+
+    async def _pipe(self, reader, writer, direction):
+        try:
+            while True:
+                chunk = await reader.read(pipe_chunk_size)
+                if not chunk:
+                    break
+                if direction == "out":
+                    self.bytes_out += len(chunk)
+                else:
+                    self.bytes_in += len(chunk)
+                writer.write(chunk)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_client(self, client_reader, client_writer):
+        upstream_writer = None
+        try:
+            request_head = await client_reader.readuntil(b"\r\n\r\n")
+            if len(request_head) > max_request_head_size:
+                raise ValueError("The request head is too large")
+            upstream_reader, upstream_writer = await asyncio.open_connection(self.upstream_host, self.upstream_port)
+            rewritten_head = self._rewrite_request_head(request_head)
+            self.bytes_out += len(rewritten_head)
+            upstream_writer.write(rewritten_head)
+            await upstream_writer.drain()
+
+            # From here on, the traffic is piped as is in both directions. For CONNECT, the upstream proxy answers "200 Connection established" and the TLS tunnel follows
+            await asyncio.gather(
+                self._pipe(client_reader, upstream_writer, direction="out"),
+                self._pipe(upstream_reader, client_writer, direction="in")
+            )
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, OSError, ValueError) as e:
+            logging.debug(f"A proxied connection was closed: {e}")
+        finally:
+            client_writer.close()
+            if upstream_writer is not None:
+                upstream_writer.close()
@@ -0,0 +1,140 @@
+# Import packages
+import logging
+import random
+import threading
+import time
+import uuid
+
+###-----------------------------###-----------------------------###
+
+# Create a class to store one sticky proxy session (an endpoint plus a session ID that keeps the same exit IP) and its track record
+class ProxySession:
+    def __init__(self, endpoint, username, password, session_username_template):
+        self.endpoint = endpoint
+        self.base_username = username
+        self.password = password
+        self.session_username_template = session_username_template
+        self.in_use = 0 # The number of browsers or HTTP sessions that currently use this proxy session
+        self.rotate()
+
+    def rotate(self):
+        """
+        A function that starts a new sticky session on the same endpoint, which gives it a new exit IP, and forgets the track record of the old one
+        """
+        self.session_id = uuid.uuid4().hex[:10]
+        self.successes = 0
+        self.failures = 0
+        self.latency_ewma = None # Exponentially weighted moving average of the slip duration in seconds
+        self.exit_ip = None
+        self.exit_ip_checked_at = 0
+
+    @property
+    def username(self):
+        if not self.session_username_template:
+            return self.base_username
+        return self.session_username_template.format(username=self.base_username, session_id=self.session_id)
+
+    @property
+    def url(self):
+        return f"http://{self.username}:{self.password}@{self.endpoint}"
+
+    @property
+    def score(self):
+        """
+        The success rate (with one optimistic prior success and one prior failure so that new sessions get tried) divided by the latency penalty
+        """
+        success_rate = (self.successes + 1) / (self.successes + self.failures + 2)
+        latency_penalty = 1 + (self.latency_ewma or 0) / 30
+        return success_rate / latency_penalty
+
+    def __repr__(self):
+        return f"ProxySession(endpoint={self.endpoint}, session_id={self.session_id}, exit_ip={self.exit_ip}, score={self.score:.2f})"
+
+# Create a class that hands out the healthiest proxy sessions and avoids the exit IPs that recently got captcha failures
+class ProxyManager:
+    def __init__(self, endpoints, username, password, sessions_per_endpoint=5, session_username_template="{username}-sessid-{session_id}",
+                 bad_exit_ip_cooldown=1800, exit_ip_ttl=600, max_failure_rate=0.6, min_observations=3):
+        """
+        - endpoints: The proxy endpoints (host:port)
+        - username, password: The proxy credentials
+        - sessions_per_endpoint: The number of sticky sessions that are kept per endpoint
+        - session_username_template: How the session ID is added to the username to get a sticky session (Oxylabs style by default). Use "" to disable sticky sessions
+        - bad_exit_ip_cooldown: The number of seconds an exit IP is avoided after it triggered a captcha failure
+        - exit_ip_ttl: The number of seconds the exit IP of a session is cached before it is checked again
+        - max_failure_rate: Sessions that fail more often than this (after min_observations slips) are rotated to a new exit IP
+        """
+        self.bad_exit_ip_cooldown = bad_exit_ip_cooldown
+        self.exit_ip_ttl = exit_ip_ttl
+        self.max_failure_rate = max_failure_rate
+        self.min_observations = min_observations
+        self.sessions = [
+            ProxySession(endpoint=endpoint, username=username, password=password, session_username_template=session_username_template)
+            for endpoint in endpoints for _ in range(sessions_per_endpoint)
+        ]
+        self._sticky_sessions = {} # sticky key --> ProxySession
+        self._bad_exit_ips = {} # exit IP --> the time it triggered a captcha failure
+        self._lock = threading.Lock()
+
+    # Function to check whether the exit IP of a session triggered a captcha failure recently. Must be called while holding the lock
+    def _has_bad_exit_ip(self, session):
+        failed_at = self._bad_exit_ips.get(session.exit_ip)
+        return failed_at is not None and time.time() - failed_at < self.bad_exit_ip_cooldown
+
+    def acquire(self, sticky_key=None):
+        """
+        A function that returns the best proxy session. If a sticky key is given, the same session is returned for that key as long as it stays healthy
+        """
+        with self._lock:
+            if sticky_key is not None and sticky_key in self._sticky_sessions and not self._has_bad_exit_ip(self._sticky_sessions[sticky_key]):
+                return self._sticky_sessions[sticky_key] # Already counted in in_use when the key was first acquired
+
+            # Pick the session with the best score among the ones that don't have a bad exit IP. Sessions that are already in use are penalized so that the load is spread,
+            # and random noise breaks the ties between equally good sessions
+            candidates = [session for session in self.sessions if not self._has_bad_exit_ip(session)] or self.sessions
+            best_session = max(candidates, key=lambda session: session.score / (1 + session.in_use) * random.uniform(0.95, 1.05))
+            best_session.in_use += 1
+            if sticky_key is not None:
+                self._sticky_sessions[sticky_key] = best_session
+            return best_session
+
+    def release(self, session, sticky_key=None):
+        """
+        A function that gives a session back (e.g., when the driver that used it was quit) and forgets its sticky key
+        """
+        with self._lock:
+            session.in_use = max(session.in_use - 1, 0)
+            if sticky_key is not None:
+                self._sticky_sessions.pop(sticky_key, None)
+
+    def report(self, session, is_success, latency=None, is_captcha_failure=False, is_proxy_failure=False):
+        """
+        A function that records the outcome of a slip crawled through a session. A captcha failure marks the exit IP as bad, and both a captcha failure and a proxy failure rotate the session.
+        It returns True if the session was rotated to a new exit IP, in which case the browser that uses it should be replaced
+        """
+        with self._lock:
+            if is_success:
+                session.successes += 1
+            else:
+                session.failures += 1
+            if latency is not None:
+                session.latency_ewma = latency if session.latency_ewma is None else 0.7 * session.latency_ewma + 0.3 * latency
+            if is_captcha_failure and session.exit_ip is not None:
+                self._bad_exit_ips[session.exit_ip] = time.time()
+
+            observations = session.successes + session.failures
+            is_failing = observations >= self.min_observations and session.failures / observations > self.max_failure_rate
+            if is_captcha_failure or is_proxy_failure or is_failing:
+                logging.info(f"Rotating {session} after a {'captcha failure' if is_captcha_failure else 'proxy failure' if is_proxy_failure else 'high failure rate'}")
+                session.rotate()
+                return True
+            return False
+
+    def get_exit_ip(self, session, fetch_func):
+        """
+        A function that returns the exit IP of a session. fetch_func is only called if the IP was not checked within exit_ip_ttl seconds
+        """
+        if session.exit_ip is None or time.time() - session.exit_ip_checked_at > self.exit_ip_ttl:
+            session.exit_ip = fetch_func()
+            session.exit_ip_checked_at = time.time()
+            logging.info(f"The exit IP of proxy session {session.session_id} is {session.exit_ip}")
+        return session.exit_ip
@@ -0,0 +1,74 @@
+# Import packages
+import logging
+
+# The URL patterns Chrome does not download. Images are NOT blocked because the captcha test fails without them, and nothing on
+# google.com/recaptcha or www.gstatic.com/recaptcha is matched because the reCAPTCHA script and the form depend on them.
+# The wildcards are the ones of the CDP Network.setBlockedURLs command ("*" matches any sequence of characters)
+blocked_url_patterns = [
+    # Fonts
+    "*.woff", "*.woff?*", "*.woff2", "*.woff2?*", "*.ttf", "*.ttf?*", "*.otf", "*.otf?*", "*.eot", "*.eot?*",
+    "*fonts.googleapis.com/*", "*fonts.gstatic.com/*", "*use.fontawesome.com/*", "*kit.fontawesome.com/*",
+    # Analytics and third-party trackers
+    "*google-analytics.com/*", "*googletagmanager.com/*", "*doubleclick.net/*", "*googlesyndication.com/*",
+    "*connect.facebook.net/*", "*facebook.com/tr*", "*hotjar.com/*", "*clarity.ms/*", "*bing.com/bat*", "*yandex.ru/metrika*",
+    # Media
+    "*.mp4", "*.mp4?*", "*.webm", "*.webm?*", "*.mp3", "*.mp3?*", "*.ogg", "*.ogg?*", "*.wav", "*.wav?*",
+]
+
+###-----------------------------###-----------------------------###
+
+def apply_request_filter(driver, url_patterns=None):
+    """
+    A function that tells Chrome to block the requests that match url_patterns (blocked_url_patterns by default) for the lifetime of the browser.
+    It works with seleniumwire and plain selenium drivers because the requests are blocked by Chrome before they reach any proxy
+    """
+    url_patterns = blocked_url_patterns if url_patterns is None else url_patterns
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": url_patterns})
+    except Exception as e:
+        logging.warning(f"The request filter could not be applied. All the requests will be downloaded: {e}")
+
+###-----------------------------###-----------------------------###
+
+# Create a class that measures the bytes a browser sent to and received from the proxy while one slip was crawled.
+# In native proxy mode the counters of the local proxy forwarder are used. In seleniumwire mode the captured requests are summed up
+class SlipTrafficMeter:
+    def __init__(self, driver):
+        self.driver = driver
+        self.proxy_forwarder = getattr(driver, "proxy_forwarder", None)
+        self._started_bytes_in = 0
+        self._started_bytes_out = 0
+
+    def start(self):
+        """
+        A function that starts the measurement. The driver must not be used by anyone else until stop() is called
+        """
+        if self.proxy_forwarder is not None:
+            self._started_bytes_in = self.proxy_forwarder.bytes_in
+            self._started_bytes_out = self.proxy_forwarder.bytes_out
+        elif hasattr(self.driver, "requests"):
+            del self.driver.requests # Only count the requests of this slip
+        return self
+
+    # Function to sum up the sizes of the requests captured by seleniumwire. The headers are counted approximately, and the bodies as they went over the wire (i.e., compressed)
+    def _count_seleniumwire_bytes(self):
+        bytes_in, bytes_out = 0, 0
+        for request in self.driver.requests:
+            bytes_out += len(request.method) + len(request.url) + len(str(request.headers)) + len(request.body or b"")
+            if request.response is not None:
+                bytes_in += len(str(request.response.headers)) + len(request.response.body or b"")
+        return bytes_in, bytes_out
+
+    def stop(self):
+        """
+        A function that returns the number of bytes (bytes_in, bytes_out) since start(), or (None, None) if the driver does not expose its traffic
+        """
+        try:
+            if self.proxy_forwarder is not None:
+                return self.proxy_forwarder.bytes_in - self._started_bytes_in, self.proxy_forwarder.bytes_out - self._started_bytes_out
+            if hasattr(self.driver, "requests"):
+                return self._count_seleniumwire_bytes()
+        except Exception as e:
+            logging.warning(f"The traffic of the slip could not be measured: {e}")
+        return None, None
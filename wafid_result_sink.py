@@ -0,0 +1,118 @@
+# Import packages
+import importlib.util
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+import pandas as pd
+import pytz
+
+# pyarrow is optional. Without it the history is written as CSV instead of Parquet
+default_history_format = "parquet" if importlib.util.find_spec("pyarrow") is not None else "csv"
+
+# The columns of the rows that are written to the results worksheet and the history
+result_columns = ["slip_number", "status", "country", "medical_center", "attempts", "timestamp"]
+
+###-----------------------------###-----------------------------###
+
+# Create a class that buffers the results of the slips and writes them out every flush_interval seconds: all the buffered rows go to the results worksheet
+# in one API call, and to a local history that is partitioned by day (history_dir/date=YYYY-MM-DD/) for analysis
+class ResultSink:
+    def __init__(self, append_rows_func, history_dir, flush_interval=60, timezone="UTC", history_format=default_history_format, max_pending_rows=10000):
+        """
+        - append_rows_func: A function that appends a list of rows (lists of values in the order of result_columns) to the results worksheet in one call. None disables the worksheet
+        - history_dir: The directory of the history. None disables the history
+        - flush_interval: The number of seconds between two flushes
+        - timezone: The time zone of the timestamps and of the day partitions
+        - history_format: "parquet" (one file per flush and day) or "csv" (one file per day that the rows are appended to)
+        - max_pending_rows: The maximum number of rows that are kept for the worksheet while the Sheets API fails. The oldest rows are dropped beyond it
+        """
+        self.append_rows_func = append_rows_func
+        self.history_dir = history_dir
+        self.flush_interval = flush_interval
+        self.timezone = pytz.timezone(timezone)
+        self.history_format = history_format
+        self.max_pending_rows = max_pending_rows
+        self._buffered_rows = [] # The rows that were not written anywhere yet
+        self._pending_sheet_rows = [] # The rows that are in the history but not in the worksheet yet (because the last append failed)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # Makes sure that two flushes don't write the same rows
+        self._is_stopped = threading.Event()
+        self._flush_thread = None
+
+    def add(self, result, finished_at=None):
+        """
+        A function that buffers the result dictionary of a slip (as returned by extract_medical_center_parallel)
+        """
+        timestamp = datetime.fromtimestamp(finished_at or time.time(), tz=self.timezone)
+        row = {column: result.get(column) for column in result_columns[:-1]}
+        row["slip_number"] = int(row["slip_number"])
+        row["timestamp"] = timestamp.isoformat(timespec="seconds")
+        with self._lock:
+            self._buffered_rows.append(row)
+
+    def flush(self):
+        """
+        A function that writes the buffered rows to the history and appends them (and the rows of the previous failed appends) to the results worksheet
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffered_rows = self._buffered_rows, []
+            if rows and self.history_dir is not None:
+                try:
+                    self._write_history(rows)
+                except Exception as e:
+                    logging.warning(f"Writing {len(rows)} results to the history in {self.history_dir} failed: {e}")
+            if self.append_rows_func is None:
+                return
+
+            sheet_rows = self._pending_sheet_rows + rows
+            if not sheet_rows:
+                return
+            try:
+                self.append_rows_func([[row[column] for column in result_columns] for row in sheet_rows])
+                self._pending_sheet_rows = []
+                logging.info(f"Appended {len(sheet_rows)} results to the results worksheet")
+            except Exception as e:
+                if len(sheet_rows) > self.max_pending_rows:
+                    logging.warning(f"Dropping the {len(sheet_rows) - self.max_pending_rows} oldest results that could not be appended to the results worksheet")
+                self._pending_sheet_rows = sheet_rows[-self.max_pending_rows:]
+                logging.warning(f"Appending {len(sheet_rows)} results to the results worksheet failed. They will be appended with the next flush: {e}")
+
+    # Function to write the rows to the partition of their day
+    def _write_history(self, rows):
+        rows_per_day = defaultdict(list)
+        for row in rows:
+            rows_per_day[row["timestamp"][:10]].append(row)
+        for day, day_rows in rows_per_day.items():
+            partition_dir = os.path.join(self.history_dir, f"date={day}")
+            os.makedirs(partition_dir, exist_ok=True)
+            df_rows = pd.DataFrame(day_rows, columns=result_columns)
+            if self.history_format == "parquet":
+                # A Parquet file cannot be appended to, so every flush writes a new file. pd.read_parquet(history_dir) reads all the partitions as one table
+                df_rows.to_parquet(os.path.join(partition_dir, f"results-{time.strftime('%H%M%S')}-{uuid.uuid4().hex[:6]}.parquet"), index=False)
+            else:
+                csv_path = os.path.join(partition_dir, "results.csv")
+                df_rows.to_csv(csv_path, mode="a", header=not os.path.exists(csv_path), index=False)
+
+    def start(self):
+        self._flush_thread = threading.Thread(target=self._flush_periodically, name="result-sink-flusher", daemon=True)
+        self._flush_thread.start()
+        return self
+
+    def _flush_periodically(self):
+        while not self._is_stopped.wait(timeout=self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        """
+        A function that stops the background flushes and writes out the rows that are still buffered
+        """
+        self._is_stopped.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join(timeout=5)
+        self.flush()
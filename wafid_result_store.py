@@ -0,0 +1,307 @@
+# Import packages
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+# The statuses a slip can end a cycle with. A slip is "in_progress" while it is being crawled
+resolved_statuses = ("found", "not_found", "captcha_failure", "error")
+
+create_tables_sql = """
+CREATE TABLE IF NOT EXISTS crawl_cycles (
+    cycle_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    bytes_in INTEGER,
+    bytes_out INTEGER,
+    is_resumed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS slip_results (
+    slip_number INTEGER PRIMARY KEY,
+    cycle_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    country TEXT,
+    medical_center TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started_at REAL,
+    finished_at REAL,
+    duration_s REAL,
+    bytes_in INTEGER,
+    bytes_out INTEGER,
+    browser_peak_rss INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cycle_slips (
+    cycle_id INTEGER NOT NULL,
+    slip_number INTEGER NOT NULL,
+    PRIMARY KEY (cycle_id, slip_number)
+);
+CREATE INDEX IF NOT EXISTS slip_results_cycle_id ON slip_results (cycle_id, status);
+"""
+
+# The columns that were added after the first version of the tables. They are added to the databases that were created before
+added_columns = {
+    "crawl_cycles": {"bytes_in": "INTEGER", "bytes_out": "INTEGER", "is_resumed": "INTEGER NOT NULL DEFAULT 0"},
+    "slip_results": {"bytes_in": "INTEGER", "bytes_out": "INTEGER", "browser_peak_rss": "INTEGER"},
+}
+
+upsert_slip_result_sql = """
+INSERT INTO slip_results (slip_number, cycle_id, status, country, medical_center, attempts, started_at, finished_at, duration_s, bytes_in, bytes_out, browser_peak_rss, updated_at)
+VALUES (:slip_number, :cycle_id, :status, :country, :medical_center, :attempts, :started_at, :finished_at, :duration_s, :bytes_in, :bytes_out, :browser_peak_rss, :updated_at)
+ON CONFLICT (slip_number) DO UPDATE SET
+    cycle_id = excluded.cycle_id,
+    status = excluded.status,
+    country = COALESCE(excluded.country, slip_results.country),
+    medical_center = COALESCE(excluded.medical_center, slip_results.medical_center),
+    attempts = excluded.attempts,
+    started_at = COALESCE(excluded.started_at, slip_results.started_at),
+    finished_at = excluded.finished_at,
+    duration_s = excluded.duration_s,
+    bytes_in = excluded.bytes_in,
+    bytes_out = excluded.bytes_out,
+    browser_peak_rss = excluded.browser_peak_rss,
+    updated_at = excluded.updated_at
+"""
+
+###-----------------------------###-----------------------------###
+
+# Create a class that stores the result of every slip number in a local SQLite database so that a crashed cycle can be resumed
+class ResultStore:
+    def __init__(self, db_path, flush_interval=2, batch_size=50):
+        """
+        - db_path: The path of the SQLite database file
+        - flush_interval: The maximum number of seconds a result waits in memory before it is written to the database
+        - batch_size: The number of results that are written in one transaction
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending_rows = queue.Queue()
+        self._lock = threading.Lock() # Serializes the access to the connection between the writer thread and the readers
+        self._flush_lock = threading.Lock() # Makes sure that the batches are written in the order they were queued
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL") # Readers don't block the writer and vice versa
+        self._connection.execute("PRAGMA synchronous=NORMAL") # Safe with WAL and much faster than FULL
+        self._connection.executescript(create_tables_sql)
+        self._add_missing_columns()
+        self._is_closed = threading.Event()
+        self._writer_thread = threading.Thread(target=self._write_batches, name="result-store-writer", daemon=True)
+        self._writer_thread.start()
+
+    # Function to migrate a database that was created by an older version of the bot
+    def _add_missing_columns(self):
+        for table, columns in added_columns.items():
+            existing_columns = {row[1] for row in self._connection.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in columns.items():
+                if column not in existing_columns:
+                    with self._connection:
+                        self._connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    ###-----------------------------###-----------------------------###
+    # Cycles
+
+    def unfinished_cycle_slips(self):
+        """
+        A function that returns the slip numbers that the unfinished cycle planned if the process died in the middle of one, or None otherwise
+        """
+        with self._lock:
+            unfinished_cycle = self._connection.execute("SELECT cycle_id FROM crawl_cycles WHERE finished_at IS NULL ORDER BY cycle_id DESC LIMIT 1").fetchone()
+            if unfinished_cycle is None:
+                return None
+            rows = self._connection.execute("SELECT slip_number FROM cycle_slips WHERE cycle_id = ? ORDER BY rowid", (unfinished_cycle[0],)).fetchall()
+        return [row[0] for row in rows] or None
+
+    def start_cycle(self, slip_numbers_list):
+        """
+        A function that resumes the unfinished cycle if the process died in the middle of one, or starts a new cycle that crawls slip_numbers_list otherwise.
+        It returns the cycle ID and the slip numbers of the cycle, which are the ones the unfinished cycle planned when it is resumed (the frontier moved since then,
+        so a new plan would drop the slips of the old one that were not crawled yet)
+        """
+        with self._lock:
+            unfinished_cycle = self._connection.execute("SELECT cycle_id FROM crawl_cycles WHERE finished_at IS NULL ORDER BY cycle_id DESC LIMIT 1").fetchone()
+            if unfinished_cycle is not None:
+                cycle_id = unfinished_cycle[0]
+                logging.info(f"Resuming the unfinished crawling cycle {cycle_id}")
+                planned_slips = [row[0] for row in self._connection.execute("SELECT slip_number FROM cycle_slips WHERE cycle_id = ? ORDER BY rowid", (cycle_id,))]
+                with self._connection:
+                    # The duration of a resumed cycle includes the time the bot was down, so it is left out of recent_cycle_durations
+                    self._connection.execute("UPDATE crawl_cycles SET is_resumed = 1 WHERE cycle_id = ?", (cycle_id,))
+                    if not planned_slips:
+                        # The cycle was started by a version of the bot that did not save the plan
+                        self._save_cycle_slips(cycle_id, slip_numbers_list)
+                return cycle_id, planned_slips or list(slip_numbers_list)
+            with self._connection:
+                cycle_id = self._connection.execute("INSERT INTO crawl_cycles (started_at) VALUES (?)", (time.time(),)).lastrowid
+                self._save_cycle_slips(cycle_id, slip_numbers_list)
+            return cycle_id, list(slip_numbers_list)
+
+    def _save_cycle_slips(self, cycle_id, slip_numbers_list):
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO cycle_slips (cycle_id, slip_number) VALUES (?, ?)",
+            [(cycle_id, int(slip)) for slip in slip_numbers_list]
+        )
+
+    def finish_cycle(self, cycle_id):
+        """
+        A function that writes the pending results, marks the cycle as finished, and stores the bytes that were downloaded and uploaded during the cycle.
+        It returns the traffic of the cycle as a dictionary with bytes_in and bytes_out
+        """
+        self.flush()
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                UPDATE crawl_cycles SET
+                    finished_at = ?,
+                    bytes_in = (SELECT SUM(bytes_in) FROM slip_results WHERE cycle_id = crawl_cycles.cycle_id),
+                    bytes_out = (SELECT SUM(bytes_out) FROM slip_results WHERE cycle_id = crawl_cycles.cycle_id)
+                WHERE cycle_id = ?
+                """,
+                (time.time(), cycle_id)
+            )
+            self._connection.execute("DELETE FROM cycle_slips WHERE cycle_id = ?", (cycle_id,)) # The plan is only needed to resume the cycle
+            bytes_in, bytes_out = self._connection.execute("SELECT bytes_in, bytes_out FROM crawl_cycles WHERE cycle_id = ?", (cycle_id,)).fetchone()
+        return {"bytes_in": bytes_in, "bytes_out": bytes_out}
+
+    def recent_cycle_durations(self, limit=10):
+        """
+        A function that returns the durations (in seconds) of the last finished cycles, newest first.
+        The cycles that were resumed after a crash or a restart are left out because their duration spans the time the bot was down
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT finished_at - started_at FROM crawl_cycles WHERE finished_at IS NOT NULL AND is_resumed = 0 ORDER BY cycle_id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def slips_to_crawl(self, cycle_id, slip_numbers_list):
+        """
+        A function that drops the slips that don't need to be crawled from slip_numbers_list.
+        A slip is skipped if a record was found for it in any cycle, or if it already got a result in the current cycle (i.e., the cycle is being resumed after a restart)
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT slip_number, cycle_id, status FROM slip_results WHERE slip_number IN ({','.join('?' * len(slip_numbers_list))})",
+                [int(slip) for slip in slip_numbers_list]
+            ).fetchall()
+        skipped_slips = {slip_number for slip_number, slip_cycle_id, status in rows if status == "found" or (slip_cycle_id == cycle_id and status in resolved_statuses)}
+        if skipped_slips:
+            logging.info(f"Skipping {len(skipped_slips)} slips that are already resolved")
+        return [slip for slip in slip_numbers_list if int(slip) not in skipped_slips]
+
+    ###-----------------------------###-----------------------------###
+    # Slip results
+
+    def record_started(self, slip_number, cycle_id):
+        """
+        A function that marks a slip as being crawled
+        """
+        self.record_result(slip_number=slip_number, cycle_id=cycle_id, status="in_progress", started_at=time.time())
+
+    def record_result(self, slip_number, cycle_id, status, country=None, medical_center=None, attempts=0, started_at=None, finished_at=None, bytes_in=None, bytes_out=None, browser_peak_rss=None):
+        """
+        A function that queues the result of a slip. The results are written in batches by a background thread so that the workers never wait on the database.
+        bytes_in and bytes_out are the bytes the browser received from and sent to the proxy while crawling the slip (None if they were not measured).
+        browser_peak_rss is the peak memory in bytes of the process tree of the browser during the slip (None if it was not measured)
+        """
+        self._pending_rows.put({
+            "slip_number": int(slip_number),
+            "cycle_id": cycle_id,
+            "status": status,
+            "country": country,
+            "medical_center": medical_center,
+            "attempts": attempts,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "duration_s": finished_at - started_at if started_at is not None and finished_at is not None else None,
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "browser_peak_rss": browser_peak_rss,
+            "updated_at": time.time()
+        })
+
+    def get_result(self, slip_number):
+        """
+        A function that returns the stored result of a slip as a dictionary, or None if the slip was never crawled
+        """
+        self.flush()
+        with self._lock:
+            cursor = self._connection.execute("SELECT * FROM slip_results WHERE slip_number = ?", (int(slip_number),))
+            row = cursor.fetchone()
+            return dict(zip([column[0] for column in cursor.description], row)) if row is not None else None
+
+    def newest_found_slip(self):
+        """
+        A function that returns the highest slip number a record was found for, or None if no record was found yet
+        """
+        self.flush()
+        with self._lock:
+            return self._connection.execute("SELECT MAX(slip_number) FROM slip_results WHERE status = 'found'").fetchone()[0]
+
+    def found_slips_between(self, first_slip, last_slip):
+        """
+        A function that returns the set of slip numbers between first_slip and last_slip (inclusive) a record was found for
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT slip_number FROM slip_results WHERE status = 'found' AND slip_number BETWEEN ? AND ?",
+                (int(first_slip), int(last_slip))
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def resolved_slips_between(self, first_slip, last_slip):
+        """
+        A function that returns the set of slip numbers between first_slip and last_slip (inclusive) that were resolved (a record was found or the website said there is none)
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT slip_number FROM slip_results WHERE status IN ('found', 'not_found') AND slip_number BETWEEN ? AND ?",
+                (int(first_slip), int(last_slip))
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    ###-----------------------------###-----------------------------###
+    # Batched writes
+
+    # Function to take up to batch_size rows from the queue without waiting
+    def _take_batch(self):
+        rows = []
+        try:
+            while len(rows) < self.batch_size:
+                rows.append(self._pending_rows.get_nowait())
+        except queue.Empty:
+            pass
+        return rows
+
+    def _write_batches(self):
+        while not self._is_closed.wait(timeout=self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.exception(f"Writing the slip results to {self.db_path} failed: {e}")
+
+    def flush(self):
+        """
+        A function that writes all the queued results right away, in the order they were recorded
+        """
+        with self._flush_lock:
+            while True:
+                rows = self._take_batch()
+                if not rows:
+                    return
+                with self._lock, self._connection:
+                    self._connection.executemany(upsert_slip_result_sql, rows)
+
+    def close(self):
+        """
+        A function that writes the queued results and closes the database
+        """
+        self._is_closed.set()
+        self._writer_thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+        with self._lock:
+            self._connection.close()
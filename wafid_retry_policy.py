@@ -0,0 +1,176 @@
+# Import packages
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from selenium.common.exceptions import InvalidSessionIdException, NoSuchWindowException, TimeoutException, WebDriverException
+
+# The classes of failures a slip can run into
+# - captcha_rejected: The website answered the submission with the captcha message
+# - form_not_filled: The form came back without the captcha message but the website did not fill in the GCC slip number
+# - timeout: The page did not load or show an outcome in time
+# - network_error: The connection was reset, closed or answered with nothing. The target site can cause it as easily as the proxy, so the exit IP is not blamed
+# - proxy_error: The proxy refused the connection, failed the authentication, or dropped the tunnel
+# - webdriver_crash: Chrome or chromedriver died or lost the window
+# - unknown: Any other error (e.g., the captcha providers failed)
+failure_classes = ("captcha_rejected", "form_not_filled", "timeout", "network_error", "proxy_error", "webdriver_crash", "unknown")
+
+# The parts of the Chrome and chromedriver error messages that point to a proxy failure, a network failure or a dead browser. They are matched against the whole message,
+# which includes stack traces, addresses and ports, so they must be specific (e.g., a bare "407" matches ordinary WebDriver errors)
+proxy_error_markers = ("ERR_PROXY_CONNECTION_FAILED", "ERR_TUNNEL_CONNECTION_FAILED", "ERR_PROXY_CERTIFICATE_INVALID", "ERR_NO_SUPPORTED_PROXIES", "407 Proxy Authentication Required")
+network_error_markers = ("ERR_CONNECTION_RESET", "ERR_CONNECTION_CLOSED", "ERR_EMPTY_RESPONSE")
+timeout_markers = ("ERR_TIMED_OUT", "ERR_CONNECTION_TIMED_OUT", "timed out receiving message from renderer")
+webdriver_crash_markers = ("chrome not reachable", "disconnected", "session deleted", "invalid session id", "target window already closed", "tab crashed", "no such window")
+
+###-----------------------------###-----------------------------###
+
+def classify_exception(exception):
+    """
+    A function that returns the failure class of an exception that was raised while crawling a slip
+    """
+    message = str(exception)
+    if isinstance(exception, (InvalidSessionIdException, NoSuchWindowException)) or any(marker in message for marker in webdriver_crash_markers):
+        return "webdriver_crash"
+    if any(marker in message for marker in proxy_error_markers):
+        return "proxy_error"
+    if any(marker in message for marker in network_error_markers):
+        return "network_error"
+    if isinstance(exception, (TimeoutException, TimeoutError)) or any(marker in message for marker in timeout_markers):
+        return "timeout"
+    if isinstance(exception, WebDriverException):
+        return "webdriver_crash"
+    return "unknown"
+
+def classify_page_state(page_state, submit_outcome):
+    """
+    A function that returns the failure class of a form submission that did not go through. submit_outcome is None if the page did not show any outcome in time
+    """
+    if page_state.captcha_msg is not None:
+        return "captcha_rejected"
+    if submit_outcome is None:
+        return "timeout"
+    return "form_not_filled"
+
+# Create a class to store how one class of failures is retried
+@dataclass
+class RetryRule:
+    session_attempts: int # The number of attempts on the same browser and exit IP before the slip is requeued
+    base_delay: float # The backoff before the first retry in seconds. It doubles with every retry
+    max_delay: float # The maximum backoff in seconds
+    is_requeued: bool # Whether the slip is crawled again on another browser after session_attempts failed attempts
+    is_proxy_rotated: bool # Whether the proxy session gets a new exit IP before the slip is requeued
+
+# A captcha rejection on an exit IP usually repeats, so the session is only given a second chance before the slip moves to another browser and exit IP.
+# A form that was not filled in is usually a glitch of the page, so it is resubmitted on the same browser a few times. Timeouts, network errors, proxy errors and crashes poison the session right away.
+# Of these, only proxy errors rotate the exit IP: a reset or empty connection can come from the target site as well
+# Unknown failures (e.g., the captcha providers failed) have nothing to do with the browser, so a fresh browser would not help and they are not requeued
+default_retry_rules = {
+    "captcha_rejected": RetryRule(session_attempts=2, base_delay=1, max_delay=6, is_requeued=True, is_proxy_rotated=True),
+    "form_not_filled": RetryRule(session_attempts=3, base_delay=0.5, max_delay=3, is_requeued=True, is_proxy_rotated=False),
+    "timeout": RetryRule(session_attempts=1, base_delay=2, max_delay=15, is_requeued=True, is_proxy_rotated=False),
+    "network_error": RetryRule(session_attempts=1, base_delay=2, max_delay=15, is_requeued=True, is_proxy_rotated=False),
+    "proxy_error": RetryRule(session_attempts=1, base_delay=1, max_delay=8, is_requeued=True, is_proxy_rotated=True),
+    "webdriver_crash": RetryRule(session_attempts=1, base_delay=0.5, max_delay=2, is_requeued=True, is_proxy_rotated=False),
+    "unknown": RetryRule(session_attempts=1, base_delay=2, max_delay=10, is_requeued=False, is_proxy_rotated=False)
+}
+
+###-----------------------------###-----------------------------###
+
+# Create a class that caps the retries of a crawling cycle at min_retries plus retry_ratio retries per slip, so that a blocked site or a dead proxy pool
+# does not multiply the load (and the captcha spend) of a cycle. The budget is shared by all the workers
+class RetryBudget:
+    def __init__(self, retry_ratio=0.5, min_retries=10):
+        """
+        - retry_ratio: The number of retries that are allowed per slip of the cycle on average
+        - min_retries: The number of retries that are allowed on top, so that a small cycle can still retry
+        """
+        self.retry_ratio = retry_ratio
+        self.min_retries = min_retries
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        A function that starts the budget of a new crawling cycle
+        """
+        with self._lock:
+            self.slips = 0
+            self.spent_retries = 0
+            self.denied_retries = 0
+
+    def record_slip(self):
+        with self._lock:
+            self.slips += 1
+
+    def try_spend(self):
+        """
+        A function that takes one retry out of the budget. It returns False if the budget of the cycle is used up
+        """
+        with self._lock:
+            if self.spent_retries >= self.min_retries + self.retry_ratio * self.slips:
+                self.denied_retries += 1
+                return False
+            self.spent_retries += 1
+            return True
+
+# Create a class that decides whether a failed attempt is retried on the same browser, requeued to another browser and exit IP, or given up, and how long to back off before the retry
+class RetryPolicy:
+    def __init__(self, rules=None, max_requeues=2, budget=None):
+        """
+        - rules: A dictionary of failure class --> RetryRule (default_retry_rules by default)
+        - max_requeues: The number of times a slip can move to another browser
+        - budget: The RetryBudget that all the retries are taken from
+        """
+        self.rules = rules or default_retry_rules
+        self.max_requeues = max_requeues
+        self.budget = budget or RetryBudget()
+        self.decisions = Counter() # (failure class, decision) --> count
+        self._lock = threading.Lock()
+
+    def _count(self, failure_class, decision):
+        with self._lock:
+            self.decisions[(failure_class, decision)] += 1
+
+    def should_retry_on_session(self, failure_class, session_attempts):
+        """
+        A function that checks whether a slip is retried on the same browser after session_attempts failed attempts of failure_class
+        """
+        if session_attempts < self.rules[failure_class].session_attempts and self.budget.try_spend():
+            self._count(failure_class, "resubmit")
+            return True
+        return False
+
+    def should_requeue(self, failure_class, requeues):
+        """
+        A function that checks whether a slip that failed on its browser is crawled again on another browser. requeues is the number of times it was already requeued
+        """
+        if self.rules[failure_class].is_requeued and requeues < self.max_requeues and self.budget.try_spend():
+            self._count(failure_class, "requeue")
+            return True
+        self._count(failure_class, "give_up")
+        return False
+
+    def backoff(self, failure_class, attempt):
+        """
+        A function that returns the number of seconds to wait before retry number attempt (0 for the first retry). Half of the exponential delay is fixed and the other half is random
+        so that the workers that failed at the same time (e.g., when the proxy dropped) don't come back at the same time
+        """
+        rule = self.rules[failure_class]
+        delay = min(rule.max_delay, rule.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def wait(self, failure_class, attempt):
+        delay = self.backoff(failure_class, attempt)
+        logging.info(f"Backing off for {delay:.1f} seconds after a {failure_class} failure")
+        time.sleep(delay)
+
+    def stats(self):
+        """
+        A function that returns the number of resubmits, requeues and given up slips per failure class, and the state of the retry budget
+        """
+        with self._lock:
+            decisions = {f"{failure_class}/{decision}": count for (failure_class, decision), count in sorted(self.decisions.items())}
+        return {**decisions, "spent_retries": self.budget.spent_retries, "denied_retries": self.budget.denied_retries}
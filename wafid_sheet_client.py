@@ -0,0 +1,120 @@
+# Import packages
+import json
+import logging
+import os
+import threading
+import time
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+# The Drive API endpoint that returns the modified time and the revision of a file without downloading it
+drive_files_url = "https://www.googleapis.com/drive/v3/files/"
+
+###-----------------------------###-----------------------------###
+
+# Create a class that keeps one authorized Google Sheets client and caches the records of a worksheet until the spreadsheet changes
+class CachedSheetClient:
+    def __init__(self, service_account_file, spreadsheet_key, scope, worksheet_index=0, ttl=600, request_timeout=20, cache_path=None):
+        """
+        - service_account_file: The path of the service account JSON key
+        - spreadsheet_key: The key of the spreadsheet (the part of the URL after /spreadsheets/d/)
+        - scope: The OAuth scopes of the service account
+        - worksheet_index: The index of the worksheet to read (starting from 0)
+        - ttl: The number of seconds after which the records are re-read even if the revision did not change
+        - request_timeout: The number of seconds a Google API call may take before the cached records are used instead
+        - cache_path: An optional JSON file where the last records are saved so that the bot can start from them if the API is down
+        """
+        self.service_account_file = service_account_file
+        self.spreadsheet_key = spreadsheet_key
+        self.scope = scope
+        self.worksheet_index = worksheet_index
+        self.ttl = ttl
+        self.request_timeout = request_timeout
+        self.cache_path = cache_path
+        self._credentials = None
+        self._client = None
+        self._records = None
+        self._revision = None
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+        self._load_cache_file()
+
+    # Function to load the records that were saved by a previous run
+    def _load_cache_file(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, encoding="utf-8") as cache_file:
+                cache = json.load(cache_file)
+            self._records = cache["records"]
+            self._revision = cache["revision"]
+            # Keep _fetched_at at 0 so that the first call re-reads the sheet if the API is reachable
+        except Exception as e:
+            logging.warning(f"The cached Google Sheet records in {self.cache_path} could not be loaded: {e}")
+
+    def _save_cache_file(self):
+        if self.cache_path is None:
+            return
+        try:
+            with open(self.cache_path + ".tmp", "w", encoding="utf-8") as cache_file:
+                json.dump({"records": self._records, "revision": self._revision}, cache_file)
+            os.replace(self.cache_path + ".tmp", self.cache_path) # Replace the file atomically so that a crash does not leave half a cache behind
+        except Exception as e:
+            logging.warning(f"The Google Sheet records could not be saved to {self.cache_path}: {e}")
+
+    # Function to return the authorized client. The service account key is read and authorized only once, and the access token is refreshed when it expires
+    def _get_client(self):
+        if self._client is None:
+            self._credentials = ServiceAccountCredentials.from_json_keyfile_name(self.service_account_file, self.scope)
+            self._client = gspread.authorize(self._credentials)
+            self._client.set_timeout(self.request_timeout)
+        elif self._credentials.access_token_expired:
+            self._client.login()
+        return self._client
+
+    # Function to return the revision of the spreadsheet. It is a tiny Drive API call compared to reading all the records
+    def _get_revision(self):
+        response = self._get_client().request("get", drive_files_url + self.spreadsheet_key, params={"fields": "modifiedTime,version"})
+        metadata = response.json()
+        return f'{metadata.get("version")}-{metadata.get("modifiedTime")}'
+
+    def _fetch_records(self):
+        worksheet = self._get_client().open_by_key(self.spreadsheet_key).get_worksheet(index=self.worksheet_index)
+        return worksheet.get_all_records(empty2zero=False, default_blank=None)
+
+    def get_records(self):
+        """
+        A function that returns the records of the worksheet as a list of dictionaries.
+        The records are only re-read if the revision of the spreadsheet changed or the TTL passed. If the API fails, the cached records are returned
+        """
+        with self._lock:
+            try:
+                is_expired = time.time() - self._fetched_at > self.ttl
+                revision = self._get_revision()
+                if self._records is None or is_expired or revision != self._revision:
+                    self._records = self._fetch_records()
+                    self._revision = revision
+                    self._fetched_at = time.time()
+                    self._save_cache_file()
+                    logging.info(f"Read {len(self._records)} records from the Google Sheet (revision {revision})")
+            except Exception as e:
+                if self._records is None:
+                    raise
+                logging.warning(f"Reading the Google Sheet failed. Using the cached records from revision {self._revision}: {e}")
+            return self._records
+
+    def append_rows(self, rows, worksheet_title, header=None):
+        """
+        A function that appends rows (lists of values) to the worksheet with the title worksheet_title in one API call.
+        The worksheet is created (with the header as its first row) if it does not exist. Errors are raised so that the caller can keep the rows and try again
+        """
+        with self._lock:
+            spreadsheet = self._get_client().open_by_key(self.spreadsheet_key)
+            try:
+                worksheet = spreadsheet.worksheet(worksheet_title)
+            except gspread.exceptions.WorksheetNotFound:
+                worksheet = spreadsheet.add_worksheet(title=worksheet_title, rows=1, cols=len(header or rows[0]))
+                if header is not None:
+                    rows = [header] + rows
+            worksheet.append_rows(rows, value_input_option="RAW")
@@ -0,0 +1,64 @@
+# Import packages
+import logging
+
+###-----------------------------###-----------------------------###
+
+# Create a class that decides which slip numbers to crawl in a cycle based on the results that were observed so far.
+# Slip numbers are issued in increasing order, so the newest slip number a record was found for is the boundary between the issued and the not-yet-issued slips (the frontier).
+# Most of the budget is spent on a dense window right after the frontier, and the rest on probes that gallop ahead of the window (+step, +2*step, +4*step, ...)
+# so that a jump in the numbering is detected. As soon as a probe finds a record, it becomes the new frontier and the dense window moves there in the next cycle.
+# The slips the probe jumped over (the gap) were issued too, so they are crawled with up to half of the dense budget of the next cycles until they are all resolved
+class SlipFrontier:
+    def __init__(self, result_store, budget=50, lookback=5, probe_count=6, probe_base_step=8):
+        """
+        - result_store: The ResultStore the observed results are read from
+        - budget: The number of slips that are crawled per cycle
+        - lookback: The number of slips before the frontier that are re-checked in case they were issued out of order
+        - probe_count: The number of sparse probes after the dense window
+        - probe_base_step: The distance between the end of the dense window and the first probe. Every following probe is twice as far
+        """
+        self.result_store = result_store
+        self.budget = budget
+        self.lookback = lookback
+        self.probe_count = min(probe_count, budget - 1)
+        self.probe_base_step = probe_base_step
+
+    def frontier(self, seed_slip):
+        """
+        A function that returns the first slip number after the frontier. The seed slip (e.g., the one in the Google Sheet) is used until a record is found after it
+        """
+        newest_found_slip = self.result_store.newest_found_slip()
+        if newest_found_slip is None or newest_found_slip < int(seed_slip):
+            return int(seed_slip)
+        return newest_found_slip + 1
+
+    def plan_cycle(self, seed_slip):
+        """
+        A function that returns the slip numbers to crawl in the next cycle in ascending order
+        """
+        frontier = self.frontier(seed_slip)
+
+        # Gap: the slips before the dense window that were never resolved, e.g., because a probe found a record far ahead of the previous window and the frontier jumped there.
+        # The gap cannot be longer than the farthest probe (plus the budget of a cycle), so only that far back is checked
+        dense_budget = self.budget - self.probe_count
+        window_start = max(frontier - self.lookback, int(seed_slip))
+        gap_start = max(frontier - self.probe_base_step * 2 ** max(self.probe_count - 1, 0) - self.budget, int(seed_slip))
+        resolved_slips = self.result_store.resolved_slips_between(gap_start, window_start - 1) if gap_start < window_start else set()
+        gap_slips = [slip for slip in range(gap_start, window_start) if slip not in resolved_slips][:dense_budget // 2]
+
+        # Dense window: a few slips before the frontier and as many slips after it as the rest of the budget allows. Slips that already have a record are not counted against the budget
+        found_slips = self.result_store.found_slips_between(window_start, frontier + self.budget * 2)
+        dense_slips = []
+        slip = window_start
+        while len(dense_slips) < dense_budget - len(gap_slips):
+            if slip not in found_slips:
+                dense_slips.append(slip)
+            slip += 1
+
+        # Probes: gallop ahead of the dense window to detect a jump in the numbering
+        probe_slips = [dense_slips[-1] + self.probe_base_step * 2 ** k for k in range(self.probe_count)]
+
+        if gap_slips:
+            logging.info(f"Crawling {len(gap_slips)} slips from {gap_slips[0]} to {gap_slips[-1]} that were skipped before the slip frontier")
+        logging.info(f"The slip frontier is at {frontier}. Crawling {len(dense_slips)} slips from {dense_slips[0]} to {dense_slips[-1]} and probing {probe_slips}")
+        return gap_slips + dense_slips + probe_slips
@@ -0,0 +1,172 @@
+# Import packages
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+telegram_message_limit = 4096 # The maximum number of characters in one Telegram message
+
+###-----------------------------###-----------------------------###
+
+# Create a class that sends all the Telegram messages of the bot from one background thread.
+# The workers put messages on a queue and never wait for Telegram. Urgent messages are sent right away, and routine lines are rolled into a periodic digest
+class TelegramNotifier:
+    def __init__(self, channels, digest_interval=600, min_send_interval=3, max_retries=5, parse_mode=ParseMode.MARKDOWN):
+        """
+        - channels: A dictionary of channel name --> (bot, chat_id), e.g., {"wafid": (Bot(token=...), chat_id), "errors": (Bot(token=...), chat_id)}.
+          A bot only needs the async initialize(), send_message() and shutdown() methods of telegram.Bot, so a stub can be passed in tests
+        - digest_interval: The number of seconds between two digests of the routine lines
+        - min_send_interval: The minimum number of seconds between two messages to the same chat (Telegram allows about 20 messages per minute in a group)
+        - max_retries: The number of times a message is retried after a network error before it is dropped
+        - parse_mode: The parse mode of the messages
+        """
+        self.channels = channels
+        self.digest_interval = digest_interval
+        self.min_send_interval = min_send_interval
+        self.max_retries = max_retries
+        self.parse_mode = parse_mode
+        self.send_latencies = deque(maxlen=10000) # The durations of the successful send_message calls. Taken out by the metrics exporter
+        self._digest_lines = defaultdict(list) # channel --> routine lines waiting for the next digest
+        self._digest_lock = threading.Lock()
+        self._next_send_at = defaultdict(float) # chat_id --> the earliest time the next message can be sent
+        self._sequence = itertools.count() # Keeps the messages with the same priority in order
+        self._loop = asyncio.new_event_loop()
+        self._queue = None
+        self._sender_task = None
+        self._digest_task = None
+        self._is_started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="telegram-notifier", daemon=True)
+
+    def start(self):
+        """
+        A function that starts the background thread that sends the messages
+        """
+        self._thread.start()
+        self._is_started.wait()
+        return self
+
+    def notify(self, channel, message, is_urgent=True):
+        """
+        A function that queues a message without waiting for it to be sent. Urgent messages jump ahead of the digests
+        """
+        priority = 0 if is_urgent else 1
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (priority, next(self._sequence), channel, message))
+
+    def add_to_digest(self, channel, line):
+        """
+        A function that adds a routine line to the next digest of the channel instead of sending it on its own
+        """
+        with self._digest_lock:
+            self._digest_lines[channel].append(line)
+
+    def stop(self, timeout=60):
+        """
+        A function that sends the pending digest, waits until the queue is empty (up to timeout seconds), and stops the background thread
+        """
+        if not self._thread.is_alive():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._drain(), self._loop)
+        try:
+            future.result(timeout=timeout)
+        except Exception as e:
+            logging.warning(f"Not all the Telegram messages could be sent before stopping the notifier: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    ###-----------------------------###-----------------------------###
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.PriorityQueue()
+        self._loop.run_until_complete(self._initialize_bots())
+        self._sender_task = self._loop.create_task(self._send_messages())
+        self._digest_task = self._loop.create_task(self._send_digests_periodically())
+        self._is_started.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._shutdown_bots())
+        self._loop.close()
+
+    # Function to open the HTTP connection pool of every bot once so that it is reused for all the messages
+    async def _initialize_bots(self):
+        for bot in {id(bot): bot for bot, chat_id in self.channels.values()}.values():
+            try:
+                await bot.initialize()
+            except Exception as e:
+                logging.warning(f"A Telegram bot could not be initialized. It will be retried on the first message: {e}")
+
+    async def _shutdown_bots(self):
+        for task in (self._sender_task, self._digest_task):
+            task.cancel()
+        for bot in {id(bot): bot for bot, chat_id in self.channels.values()}.values():
+            try:
+                await bot.shutdown()
+            except Exception as e:
+                logging.warning(f"A Telegram bot could not be shut down: {e}")
+
+    # Function to build the digest messages and put them on the queue. Long digests are split to respect the Telegram message limit
+    def _queue_digests(self):
+        with self._digest_lock:
+            digest_lines = self._digest_lines
+            self._digest_lines = defaultdict(list)
+        for channel, lines in digest_lines.items():
+            message = f"Digest of the last {len(lines)} routine results:"
+            for line in lines:
+                if len(message) + len(line) + 1 > telegram_message_limit:
+                    self._queue.put_nowait((1, next(self._sequence), channel, message))
+                    message = ""
+                message = f"{message}\n{line}" if message else line
+            self._queue.put_nowait((1, next(self._sequence), channel, message))
+
+    async def _send_digests_periodically(self):
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            self._queue_digests()
+
+    async def _drain(self):
+        self._queue_digests()
+        await self._queue.join()
+
+    async def _send_messages(self):
+        while True:
+            priority, sequence, channel, message = await self._queue.get()
+            try:
+                await self._send_with_retries(channel=channel, message=message)
+            except Exception as e:
+                logging.exception(f"The Telegram message to {channel} was dropped: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _send_with_retries(self, channel, message):
+        bot, chat_id = self.channels[channel]
+        backoff = 0 # The number of seconds to wait before the next attempt after a failed one
+        for attempt in range(self.max_retries + 1):
+            # Respect the rate limit of the chat and the backoff of the previous attempt
+            wait_time = max(self._next_send_at[chat_id] - time.time(), backoff)
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+
+            try:
+                started_at = time.time()
+                await bot.send_message(chat_id=chat_id, text=message, parse_mode=self.parse_mode)
+                self.send_latencies.append(time.time() - started_at)
+                self._next_send_at[chat_id] = time.time() + self.min_send_interval
+                return
+            except (BadRequest, Forbidden) as e:
+                # Permanent errors (e.g., Markdown that cannot be parsed, or a bot that was removed from the chat). Retrying would only block the queue.
+                # BadRequest is a subclass of NetworkError, so it must be caught first
+                logging.error(f"Telegram rejected the message to {channel}. It will not be retried: {e}")
+                return
+            except RetryAfter as e:
+                # Telegram answered with 429. Wait as long as it asked before sending anything else to this chat
+                backoff = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                logging.warning(f"Telegram asked to wait {backoff} seconds before sending to {channel}")
+            except (TimedOut, NetworkError) as e:
+                # Back off exponentially on timeouts and connection errors (1, 2, 4, ... seconds)
+                backoff = 2 ** attempt
+                logging.warning(f"Sending a Telegram message to {channel} failed (attempt {attempt + 1}): {e}")
+        raise RuntimeError(f"The message could not be sent after {self.max_retries + 1} attempts")
@@ -0,0 +1,169 @@
+# Import packages
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+###-----------------------------###-----------------------------###
+
+# Create a class that records how long every stage of a slip takes (driver launch, IP check, page load, captcha solve, every submit, parsing, notifications) as one JSON line per span.
+# The slip number and cycle ID are set once per slip with slip_context() and added to all the spans the same thread records until the slip finishes
+class SlipTracer:
+    def __init__(self, trace_path, is_enabled=True):
+        """
+        - trace_path: The JSONL file the spans are appended to
+        - is_enabled: If False, span() only runs the code inside it and nothing is written
+        """
+        self.trace_path = trace_path
+        self.is_enabled = is_enabled
+        self._context = threading.local()
+        self._lock = threading.Lock()
+        self._trace_file = open(trace_path, "a", encoding="utf-8", buffering=1) if is_enabled else None # Line buffered so that a crash loses at most one span
+
+    @contextmanager
+    def slip_context(self, slip_number, cycle_id=None):
+        """
+        A context manager that tags all the spans of the current thread with the slip number and the cycle ID
+        """
+        previous_context = getattr(self._context, "slip", None)
+        self._context.slip = {"slip_number": slip_number, "cycle_id": cycle_id}
+        try:
+            yield
+        finally:
+            self._context.slip = previous_context
+
+    @contextmanager
+    def span(self, stage, attempt=None, **attributes):
+        """
+        A context manager that records how long the code inside it takes. The span is written even if the code raises, with status "error"
+        - stage: The name of the stage (e.g., "page_load")
+        - attempt: The index of the attempt for stages that are retried (e.g., "submit")
+        - attributes: Any other fields that should be written with the span. The code inside the span can add more fields to the dictionary it gets (e.g., the outcome)
+        """
+        if not self.is_enabled:
+            yield attributes
+            return
+        started_at = time.time()
+        status, error = "ok", None
+        try:
+            yield attributes
+        except BaseException as e:
+            status, error = "error", f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            finished_at = time.time()
+            self._write({
+                "stage": stage,
+                **(getattr(self._context, "slip", None) or {"slip_number": None, "cycle_id": None}),
+                "pid": os.getpid(),
+                "thread": threading.current_thread().name,
+                "attempt": attempt,
+                "start": started_at,
+                "end": finished_at,
+                "duration_s": finished_at - started_at,
+                "status": status,
+                "error": error,
+                **attributes
+            })
+
+    def _write(self, record):
+        try:
+            line = json.dumps(record, default=str)
+            with self._lock:
+                self._trace_file.write(line + "\n")
+        except Exception as e:
+            logging.warning(f"A trace span could not be written to {self.trace_path}: {e}")
+
+    def close(self):
+        if self._trace_file is not None:
+            with self._lock:
+                self._trace_file.close()
+
+###-----------------------------###-----------------------------###
+# Report
+
+def read_spans(trace_path):
+    """
+    A function that reads the spans of a trace file. Lines that cannot be parsed (e.g., the last line after a crash) are skipped
+    """
+    spans = []
+    with open(trace_path, encoding="utf-8") as trace_file:
+        for line in trace_file:
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return spans
+
+def stage_percentiles(spans):
+    """
+    A function that returns the count, p50, p95, p99 and total duration of every stage, sorted by the total duration
+    """
+    durations = defaultdict(list)
+    for span in spans:
+        durations[span["stage"]].append(span["duration_s"])
+    report = []
+    for stage, stage_durations in durations.items():
+        p50, p95, p99 = np.percentile(stage_durations, [50, 95, 99])
+        report.append({"stage": stage, "count": len(stage_durations), "p50": p50, "p95": p95, "p99": p99, "total": sum(stage_durations)})
+    return sorted(report, key=lambda row: row["total"], reverse=True)
+
+def cycle_critical_paths(spans, root_stage="slip"):
+    """
+    A function that returns the critical path of every cycle. The workers take slips one after the other, so a cycle ends when the busiest worker (pid + thread) finishes its last slip.
+    The critical path is the chain of slips of that worker, and the time it spent in every stage
+    """
+    spans_by_cycle = defaultdict(list)
+    for span in spans:
+        if span.get("cycle_id") is not None:
+            spans_by_cycle[span["cycle_id"]].append(span)
+
+    critical_paths = []
+    for cycle_id, cycle_spans in sorted(spans_by_cycle.items()):
+        slip_spans = [span for span in cycle_spans if span["stage"] == root_stage]
+        if not slip_spans:
+            continue
+        last_slip_span = max(slip_spans, key=lambda span: span["end"])
+        worker = (last_slip_span["pid"], last_slip_span["thread"])
+        worker_slips = {span["slip_number"] for span in slip_spans if (span["pid"], span["thread"]) == worker}
+        stage_totals = defaultdict(float)
+        for span in cycle_spans:
+            if span["stage"] != root_stage and (span["pid"], span["thread"]) == worker and span["slip_number"] in worker_slips:
+                stage_totals[span["stage"]] += span["duration_s"]
+        critical_paths.append({
+            "cycle_id": cycle_id,
+            "wall_clock_s": last_slip_span["end"] - min(span["start"] for span in slip_spans),
+            "slips": len(slip_spans),
+            "worker": f"{worker[0]}/{worker[1]}",
+            "worker_slips": len(worker_slips),
+            "stage_totals": dict(sorted(stage_totals.items(), key=lambda item: item[1], reverse=True))
+        })
+    return critical_paths
+
+def print_report(trace_path):
+    spans = read_spans(trace_path)
+    print(f"{len(spans)} spans in {trace_path}\n")
+    print(f"{'Stage':<24}{'Count':>8}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}{'Total (s)':>12}")
+    for row in stage_percentiles(spans):
+        print(f"{row['stage']:<24}{row['count']:>8}{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}{row['total']:>12.1f}")
+
+    for critical_path in cycle_critical_paths(spans):
+        print(
+            f"\nCycle {critical_path['cycle_id']}: {critical_path['slips']} slips in {critical_path['wall_clock_s']:.1f} s. "
+            f"Critical path: worker {critical_path['worker']} with {critical_path['worker_slips']} slips"
+        )
+        for stage, total in critical_path["stage_totals"].items():
+            print(f"    {stage:<24}{total:>10.1f} s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate a trace file of the wafid bot into per-stage percentiles and the critical path of every cycle")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("trace_path", nargs="?", default="wafid_trace.jsonl")
+    args = parser.parse_args()
+    print_report(args.trace_path)